@@ -31,4 +31,12 @@ setuptools.setup(
     install_requires=[
         'requests'
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': [
+            'pyproxmox3-exporter=pyproxmox3.exporter:main',
+        ],
+    },
 )
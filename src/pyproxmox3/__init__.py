@@ -24,9 +24,28 @@ For more information see https://github.com/Daemonthread/pyproxmox.
 
 import sys
 import json
+import time
 from urllib3 import disable_warnings
 from urllib3.exceptions import InsecureRequestWarning
 import requests
+from .tasks import TaskFuture, TaskTracker, follow_task_log
+from .upid import UPID, parse_upid, parse_upids
+from .bulk import BulkPower, BulkResult
+from .clone import ClonePipeline
+from .vmid import VmidAllocator
+from .migrate import MigrationScheduler
+from .planner import Planner
+from .rrd import RRDSeries, rollup
+from .rrdstore import RRDStore, RRDCollector
+from .instrumentation import Instrumentation
+from .transport import Transport, TimingTransport
+from .replay import RecordingTransport, ReplayTransport
+from .ratelimit import RateLimiter, RateLimitExceeded
+from .adaptive import AdaptiveLimiter
+from .priority import PriorityScheduler, priority
+from .federation import Federation
+from .agent import BulkAgent
+from .addresses import AddressIndex
 
 
 # Authentication class
@@ -38,14 +57,17 @@ class ProxAuth:
     2. Valid username, including the @pve or @pam
     3. A password
 
+    port and scheme default to the pveproxy ones (8006, https).
+
     Creates the required ticket and CSRF prevention token for future connections.
 
     Designed to be instanciated then passed to the new pyproxmox class as an init parameter.
     """
-    def __init__(self, url, username, password):
+    def __init__(self, url, username, password, port=8006, scheme='https'):
         self.url = url
         self.connect_data = {"username": username, "password": password}
-        self.full_url = "https://{}:8006/api2/json/access/ticket".format(self.url)
+        self.base_url = "{}://{}:{}/api2/json".format(scheme, self.url, port)
+        self.full_url = "{}/access/ticket".format(self.base_url)
 
         self.setup_connection()
 
@@ -81,63 +103,164 @@ class PyProxmox:
     def __init__(self, auth_class):
         """Take the prox_auth instance and extract the important stuff"""
         self.auth_class = auth_class
+        # Instrumentation instance recording every request, None to disable
+        self.instrumentation = None
+        # Transport sending the requests, None for the requests module functions
+        self.transport = None
+        # RateLimiter taking a token before each request, None for no limit
+        self.rate_limiter = None
+        # PriorityScheduler queueing the requests by class, None for no queue
+        self.scheduler = None
         self.get_auth_data()
 
     def get_auth_data(self,):
         """Get authentication data."""
         self.url = self.auth_class.url
+        self.base_url = getattr(self.auth_class, 'base_url',
+                                "https://{}:8006/api2/json".format(self.url))
         self.ticket = self.auth_class.ticket
         self.csrf = self.auth_class.csrf
 
-    def connect(self, conn_type, option, post_data):
+    def connect(self, conn_type, option, post_data, timeout=None):
         """
         The main communication method.
+        timeout: seconds to wait for the server (requests.Timeout when over),
+        None to wait as long as it takes.
         """
-        self.full_url = "https://{}:8006/api2/json/{}".format(self.url, option)
+        full_url = "{}/{}".format(self.base_url, option)
+        self.full_url = full_url
 
         httpheaders = {'Accept': 'application/json',
                        'Content-Type': 'application/x-www-form-urlencoded'}
         disable_warnings(InsecureRequestWarning)
+        # Keep the response local so concurrent calls (task pollers, bulk
+        # operations) never read each other's result.
+        # the rate limit token first: a request sleeping for one must not
+        # hold a scheduler slot the interactive calls are waiting for
+        rate_wait = 0.0
+        if self.rate_limiter is not None:
+            rate_wait = self.rate_limiter.acquire(conn_type, option)
+        scheduler = self.scheduler
+        request_class, queue_wait = None, 0.0
+        if scheduler is not None:
+            request_class, queue_wait = scheduler.acquire(conn_type, option)
+        try:
+            instrumentation = self.instrumentation
+            info = None
+            if instrumentation is not None and instrumentation.enabled:
+                info = instrumentation.before(conn_type, option, rate_wait,
+                                              queue_wait, request_class)
+            try:
+                response = self._send(conn_type, full_url, post_data, httpheaders, timeout)
+            except Exception as error:  # pylint: disable=broad-except
+                if info is not None:
+                    instrumentation.after(info, error=error)
+                raise
+        finally:
+            if scheduler is not None:
+                scheduler.release()
+        self.response = response
+
+        timing = getattr(response, 'timing', None)
+        decode_start = time.perf_counter()
+        returned_data = None
+        decode_error = None
+        try:
+            returned_data = response.json()
+        except json.JSONDecodeError as error:
+            decode_error = error
+        if timing is not None:
+            timing['decode'] = time.perf_counter() - decode_start
+        if info is not None:
+            instrumentation.after(info, response)
+
+        if decode_error is None:
+            returned_data.update({'status': {'code': response.status_code,
+                                             'ok': response.ok,
+                                             'reason': response.reason}})
+            if timing is not None:
+                returned_data['timing'] = timing
+            self.returned_data = returned_data
+            return returned_data
+        print("Error in trying to process JSON")
+        print(response)
+        if (response.status_code == 401 and
+           (not sys._getframe(1).f_code.co_name == sys._getframe(0).f_code.co_name)):
+            print("Unexpected error: {} : {}".format(type(decode_error), decode_error))
+            print("try to recover connection auth")
+            self.auth_class.setup_connection()
+            self.get_auth_data()
+            return self.connect(conn_type, option, post_data, timeout)
+        return None
+
+    def _send(self, conn_type, full_url, post_data, httpheaders, timeout=None):
+        """Send one request, returns the requests response."""
+        if self.transport is not None:
+            # only given when set, for transports written without it
+            extra = {} if timeout is None else {'timeout': timeout}
+            if conn_type != "get":
+                httpheaders['CSRFPreventionToken'] = str(self.csrf)
+                return self.transport.request(conn_type, full_url, data=post_data,
+                                              cookies=self.ticket, headers=httpheaders, **extra)
+            params = post_data if isinstance(post_data, dict) else None
+            return self.transport.request(conn_type, full_url, params=params,
+                                          cookies=self.ticket, **extra)
+        response = None
         if conn_type == "post":
             httpheaders['CSRFPreventionToken'] = str(self.csrf)
-            self.response = requests.post(self.full_url, verify=False,
-                                          data=post_data,
-                                          cookies=self.ticket,
-                                          headers=httpheaders)
+            response = requests.post(full_url, verify=False,
+                                     data=post_data,
+                                     cookies=self.ticket,
+                                     headers=httpheaders, timeout=timeout)
 
         elif conn_type == "put":
             httpheaders['CSRFPreventionToken'] = str(self.csrf)
-            self.response = requests.put(self.full_url, verify=False,
-                                         data=post_data,
-                                         cookies=self.ticket,
-                                         headers=httpheaders)
+            response = requests.put(full_url, verify=False,
+                                    data=post_data,
+                                    cookies=self.ticket,
+                                    headers=httpheaders, timeout=timeout)
         elif conn_type == "delete":
             httpheaders['CSRFPreventionToken'] = str(self.csrf)
-            self.response = requests.delete(self.full_url, verify=False,
-                                            data=post_data,
-                                            cookies=self.ticket,
-                                            headers=httpheaders)
+            response = requests.delete(full_url, verify=False,
+                                       data=post_data,
+                                       cookies=self.ticket,
+                                       headers=httpheaders, timeout=timeout)
         elif conn_type == "get":
-            self.response = requests.get(self.full_url, verify=False,
-                                         cookies=self.ticket)
+            params = post_data if isinstance(post_data, dict) else None
+            response = requests.get(full_url, verify=False,
+                                    params=params,
+                                    cookies=self.ticket, timeout=timeout)
+        return response
 
-        try:
-            self.returned_data = self.response.json()
-            self.returned_data.update({'status': {'code': self.response.status_code,
-                                                'ok': self.response.ok,
-                                                'reason': self.response.reason}})
-            return self.returned_data
-        except json.JSONDecodeError:
-            print("Error in trying to process JSON")
-            print(self.response)
-            if (self.response.status_code == 401 and
-               (not sys._getframe(1).f_code.co_name == sys._getframe(0).f_code.co_name)):
-                print("Unexpected error: {} : {}".format(str(sys.exc_info()[0]),
-                                                         str(sys.exc_info()[1])))
-                print("try to recover connection auth")
-                self.auth_class.setup_connection()
-                self.get_auth_data()
-                return self.connect(conn_type, option, post_data)
+    def task_future(self, data, node=None, tracker=None):
+        """
+        Wrap the UPID returned by a mutating call in a TaskFuture.
+        If tracker is a TaskTracker the task is polled by it, otherwise the
+        future polls on its own. The task methods pass their future
+        argument (True or a TaskTracker) as tracker.
+        Raises AssertionError if the call did not start a task.
+        """
+        upid = data.get('data') if data else None
+        if not isinstance(upid, str) or not upid.startswith('UPID:'):
+            error = AssertionError('Task Error: no UPID returned: \n {}'.format(
+                data.get('status') if data else data))
+            # HTTP status of the call, for the callers telling overload from refusal
+            error.status = data.get('status') if data else None
+            raise error
+        if isinstance(tracker, TaskTracker):
+            return tracker.track(upid, node)
+        return TaskFuture(self, upid, node)
+
+    @staticmethod
+    def task_route(node, upid=None):
+        """
+        Return (node, upid) for the task methods, taking the node from the
+        UPID when only the UPID was given.
+        """
+        if upid is None:
+            upid = parse_upid(node)
+            return upid.node, upid.upid
+        return node, str(upid)
 
     # Methods using the GET protocol to communicate with the Proxmox API.
     # Cluster Methods
@@ -257,26 +380,52 @@ class PyProxmox:
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def get_node_rrd_data(self, node, post_data):
-        """Read node RRD statistics. Returns RRD"""
+    def get_node_rrd_data(self, node, post_data, columnar=False):
+        """Read node RRD statistics. Returns RRD
+        Ex: POST_DATA = {'timeframe': 'hour'}
+        With columnar=True returns an RRDSeries."""
         data = self.connect('get', 'nodes/{}/rrddata'.format(node), post_data)
+        if columnar:
+            return RRDSeries.from_rrd_data(data)
         #data_json = json.dumps(data, indent=4, sort_keys=True)
         return data
 
-    def get_node_task_by_upid(self, node, upid):
-        """Get tasks by UPID. Returns JSON"""
+    def get_node_task_by_upid(self, node, upid=None):
+        """Get tasks by UPID. Returns JSON
+        The node can be omitted: get_node_task_by_upid(upid)"""
+        node, upid = self.task_route(node, upid)
         data = self.connect('get', 'nodes/{}/tasks/{}'.format(node, upid), None)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def get_node_task_log_by_upid(self, node, upid):
-        """Read task log. Returns JSON"""
-        data = self.connect('get', 'nodes/{}/tasks/{}/log'.format(node, upid), None)
+    def get_node_task_log_by_upid(self, node, upid=None, start=None, limit=None):
+        """Read task log. Returns JSON
+        The node can be omitted: get_node_task_log_by_upid(upid)
+        start/limit select a window of lines (start is 0 based)."""
+        node, upid = self.task_route(node, upid)
+        post_data = None
+        if start is not None or limit is not None:
+            post_data = {}
+            if start is not None:
+                post_data['start'] = start
+            if limit is not None:
+                post_data['limit'] = limit
+        data = self.connect('get', 'nodes/{}/tasks/{}/log'.format(node, upid), post_data)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def get_node_task_status_by_upid(self, node, upid):
-        """Read task status. Returns JSON"""
+    def follow_task_log(self, node, upid=None, **kwargs):
+        """
+        Iterate over the task log lines as they are written, until the task
+        stopped. See pyproxmox3.tasks.follow_task_log for the options.
+        """
+        node, upid = self.task_route(node, upid)
+        return follow_task_log(self, upid, node, **kwargs)
+
+    def get_node_task_status_by_upid(self, node, upid=None):
+        """Read task status. Returns JSON
+        The node can be omitted: get_node_task_status_by_upid(upid)"""
+        node, upid = self.task_route(node, upid)
         data = self.connect('get', 'nodes/{}/tasks/{}/status'.format(node, upid), None)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
@@ -344,9 +493,13 @@ class PyProxmox:
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def get_lxc_rrd_data(self, node, vmid):
-        """Read VM RRD statistics. Returns RRD"""
-        data = self.connect('get', 'nodes/{}/lxc/{}/rrddata'.format(node, vmid), None)
+    def get_lxc_rrd_data(self, node, vmid, post_data=None, columnar=False):
+        """Read VM RRD statistics. Returns RRD
+        Ex: POST_DATA = {'timeframe': 'day', 'cf': 'AVERAGE'}
+        With columnar=True returns an RRDSeries."""
+        data = self.connect('get', 'nodes/{}/lxc/{}/rrddata'.format(node, vmid), post_data)
+        if columnar:
+            return RRDSeries.from_rrd_data(data)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
@@ -391,9 +544,13 @@ class PyProxmox:
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def get_virtual_rrd_data(self, node, vmid):
-        """Read VM RRD statistics. Returns JSON"""
-        data = self.connect('get', 'nodes/{}/qemu/{}/rrddata'.format(node, vmid), None)
+    def get_virtual_rrd_data(self, node, vmid, post_data=None, columnar=False):
+        """Read VM RRD statistics. Returns JSON
+        Ex: POST_DATA = {'timeframe': 'day', 'cf': 'AVERAGE'}
+        With columnar=True returns an RRDSeries."""
+        data = self.connect('get', 'nodes/{}/qemu/{}/rrddata'.format(node, vmid), post_data)
+        if columnar:
+            return RRDSeries.from_rrd_data(data)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
@@ -423,9 +580,14 @@ class PyProxmox:
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def get_node_storage_rrd_data(self, node, storage):
-        """Read storage RRD statistics. Returns JSON"""
-        data = self.connect('get', 'nodes/{}/storage/{}/rrddata'.format(node, storage), None)
+    def get_node_storage_rrd_data(self, node, storage, post_data=None, columnar=False):
+        """Read storage RRD statistics. Returns JSON
+        Ex: POST_DATA = {'timeframe': 'week'}
+        With columnar=True returns an RRDSeries."""
+        data = self.connect('get', 'nodes/{}/storage/{}/rrddata'.format(node, storage),
+                            post_data)
+        if columnar:
+            return RRDSeries.from_rrd_data(data)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
@@ -437,118 +599,152 @@ class PyProxmox:
 
     # Methods using the POST protocol to communicate with the Proxmox API.
     # LXC Methods
-    def create_lxc_container(self, node, post_data):
+    def create_lxc_container(self, node, post_data, future=False):
         """
         Create or restore a container. Returns JSON
         Requires a dictionary of tuples formatted [('postname1','data'),('postname2','data')]
         """
         data = self.connect('post', 'nodes/{}/lxc'.format(node), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def shutdown_lxc_container(self, node, vmid):
+    def shutdown_lxc_container(self, node, vmid, future=False):
         """Shutdown the container. Returns JSON"""
         post_data = None
         data = self.connect('post', 'nodes/{}/lxc/{}/status/shutdown'.format(node, vmid),
                             post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def start_lxc_container(self, node, vmid):
+    def start_lxc_container(self, node, vmid, future=False):
         """Start the container. Returns JSON"""
         post_data = None
         data = self.connect('post', 'nodes/{}/lxc/{}/status/start'.format(node, vmid), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def stop_lxc_container(self, node, vmid):
+    def stop_lxc_container(self, node, vmid, future=False):
         """Stop the container. Returns JSON"""
         post_data = None
         data = self.connect('post', 'nodes/{}/lxc/{}/status/stop'.format(node, vmid), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def migrate_lxc_container(self, node, vmid, target):
-        """Migrate the container to another node. Creates a new migration task. Returns JSON"""
-        post_data = {'target': str(target)}
+    def migrate_lxc_container(self, node, vmid, target, future=False, post_data=None):
+        """
+        Migrate the container to another node. Creates a new migration task. Returns JSON
+        post_data can carry extra options. Ex: POST_DATA = {'restart': 1, 'bwlimit': 102400}
+        """
+        post_data = dict(post_data or {}, target=str(target))
         data = self.connect('post', 'nodes/{}/lxc/{}/migrate'.format(node, vmid), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
     # KVM Methods
-    def create_virtual_machine(self, node, post_data):
+    def create_virtual_machine(self, node, post_data, future=False):
         """
         Create or restore a virtual machine. Returns JSON
         Requires a dictionary of tuples formatted [('postname1','data'),('postname2','data')]
         """
         data = self.connect('post', 'nodes/{}/qemu'.format(node), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def clone_virtual_machine(self, node, vmid, post_data):
+    def clone_virtual_machine(self, node, vmid, post_data, future=False):
         """
         Create a copy of virtual machine/template. Returns JSON
         Requires a dictionary of tuples formatted [('postname1','data'),('postname2','data')]
         """
         data = self.connect('post', 'nodes/{}/qemu/{}/clone'.format(node, vmid), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def reset_virtual_machine(self, node, vmid):
+    def reset_virtual_machine(self, node, vmid, future=False):
         """Reset a virtual machine. Returns JSON"""
         post_data = None
         data = self.connect('post', 'nodes/{}/qemu/{}/status/reset'.format(node, vmid), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def resume_virtual_machine(self, node, vmid):
+    def resume_virtual_machine(self, node, vmid, future=False):
         """Resume a virtual machine. Returns JSON"""
         post_data = None
         data = self.connect('post', 'nodes/{}/qemu/{}/status/resume'.format(node, vmid), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def shutdown_virtual_machine(self, node, vmid):
+    def shutdown_virtual_machine(self, node, vmid, future=False):
         """Shut down a virtual machine. Returns JSON"""
         post_data = None
         data = self.connect('post', 'nodes/{}/qemu/{}/status/shutdown'.format(node, vmid),
                             post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def start_virtual_machine(self, node, vmid):
+    def start_virtual_machine(self, node, vmid, future=False):
         """Start a virtual machine. Returns JSON
          :param     node:    node name
          :param     vmid:    vm id (e.g. 167)
+         :param     future:  return a TaskFuture for the started task instead,
+                             polled by this TaskTracker when one is given
          :type      node:       str
          :type      vmid:       int
+         :type      future:     bool or TaskTracker
          :return:   {   'status':        { 'code': http returncode, 'reason': http return string,
                                            'ok': return status }
                         'data':          { 'task String (UPID)'}
-         :rtype     dict
+         :rtype     dict or TaskFuture
         """
         post_data = None
         data = self.connect('post', 'nodes/{}/qemu/{}/status/start'.format(node, vmid), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def stop_virtual_machine(self, node, vmid):
+    def stop_virtual_machine(self, node, vmid, future=False):
         """Stop a virtual machine. Returns JSON"""
         post_data = None
         data = self.connect('post', 'nodes/{}/qemu/{}/status/stop'.format(node, vmid), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def suspend_virtual_machine(self, node, vmid):
+    def suspend_virtual_machine(self, node, vmid, future=False):
         """Suspend a virtual machine. Returns JSON"""
         post_data = None
         data = self.connect('post', 'nodes/{}/qemu/{}/status/suspend'.format(node, vmid), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
-    def migrate_virtual_machine(self, node, vmid, post_data):
+    def migrate_virtual_machine(self, node, vmid, post_data, future=False):
         """Migrate a virtual machine. Returns JSON"""
         data = self.connect('post', 'nodes/{}/qemu/{}/migrate'.format(node, vmid), post_data)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
@@ -640,11 +836,48 @@ class PyProxmox:
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
+    # Node
+    def start_all_node_guests(self, node, post_data=None, future=False):
+        """
+        Start all VMs and containers of a node. Returns JSON
+        Only the ones with onboot=1, unless force is set.
+        Ex: POST_DATA = {'vms': '101,102', 'force': 1}
+        """
+        data = self.connect('post', 'nodes/{}/startall'.format(node), post_data)
+        if future:
+            return self.task_future(data, node, future)
+        data_json = json.dumps(data, indent=4, sort_keys=True)
+        return data_json
+
+    def stop_all_node_guests(self, node, post_data=None, future=False):
+        """
+        Stop all VMs and containers of a node. Returns JSON
+        Ex: POST_DATA = {'vms': '101,102'}
+        """
+        data = self.connect('post', 'nodes/{}/stopall'.format(node), post_data)
+        if future:
+            return self.task_future(data, node, future)
+        data_json = json.dumps(data, indent=4, sort_keys=True)
+        return data_json
+
+    def migrate_all_node_guests(self, node, post_data, future=False):
+        """
+        Migrate all VMs and containers of a node. Returns JSON
+        Ex: POST_DATA = {'target': 'vnode02', 'vms': '101,102', 'maxworkers': 4}
+        """
+        data = self.connect('post', 'nodes/{}/migrateall'.format(node), post_data)
+        if future:
+            return self.task_future(data, node, future)
+        data_json = json.dumps(data, indent=4, sort_keys=True)
+        return data_json
+
     # Methods using the DELETE protocol to communicate with the Proxmox API.
     # LXC
-    def delete_lxc_container(self, node, vmid):
+    def delete_lxc_container(self, node, vmid, future=False):
         """Deletes the specified lxc container. Returns JSON"""
         data = self.connect('delete', 'nodes/{}/lxc/{}'.format(node, vmid), None)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
@@ -662,9 +895,11 @@ class PyProxmox:
         return data_json
 
     # KVM
-    def delete_virtual_machine(self, node, vmid):
+    def delete_virtual_machine(self, node, vmid, future=False):
         """Destroy the vm (also delete all used/owned volumes). Returns JSON"""
         data = self.connect('delete', 'nodes/{}/qemu/{}'.format(node, vmid), None)
+        if future:
+            return self.task_future(data, node, future)
         data_json = json.dumps(data, indent=4, sort_keys=True)
         return data_json
 
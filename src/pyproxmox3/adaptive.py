@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive concurrency limits.
+
+AdaptiveLimiter keeps one AIMD limit per key (a node name usually): the
+limit grows by about one per round of requests while their latency stays
+healthy, and is multiplied by backoff when the latency rises, or a request
+fails with a 5xx (596 included) or a connection error. It converges on the
+concurrency a node sustains instead of a guessed fixed value:
+
+limiter = AdaptiveLimiter(initial=4, maximum=32)
+bulk = BulkPower(b, adaptive=limiter)        # node slots follow the limiter
+collector = RRDCollector(b, store, limiter=limiter)
+limiter.limits()                             # {'vnode01': 12, ...}
+print('\n'.join(limiter.openmetrics()))
+
+Healthy latency is tolerance times the baseline, unless target (seconds)
+is given. The baseline is the lowest latency of the key, taken again from
+the last window seconds of samples once per window so it follows a node
+getting slower for good.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+
+def failed_status(status):
+    """True for the statuses of an overloaded node: None (no answer) and 5xx."""
+    return status is None or status >= 500
+
+
+class KeyLimit:
+    """AIMD state of one key. Not locked: AdaptiveLimiter holds its lock."""
+    __slots__ = ('limit', 'inflight', 'baseline', 'window_min', 'window_start', 'latency',
+                 'samples', 'recovery', 'increases', 'decreases', 'failures')
+
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.inflight = 0
+        self.baseline = None
+        self.window_min = None
+        self.window_start = time.monotonic()
+        self.latency = None
+        self.samples = 0
+        # congestion signals ignored until the requests in flight at the
+        # last decrease came back, so one overload halves the limit once
+        self.recovery = 0
+        self.increases = 0
+        self.decreases = 0
+        self.failures = 0
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit per key.
+
+    initial, minimum, maximum: limits (requests in flight per key).
+    backoff: factor applied to the limit on congestion.
+    tolerance: latency over tolerance * baseline is congestion.
+    target: fixed healthy latency in seconds, instead of the baseline.
+    smoothing: weight of a new sample in the latency moving average.
+    window: seconds after which the baseline is the lowest recent latency.
+    """
+    def __init__(self, initial=4, minimum=1, maximum=64, backoff=0.5, tolerance=2.0,
+                 target=None, smoothing=0.2, window=60.0, name='adaptive'):
+        if not 1 <= minimum <= initial <= maximum:
+            raise ValueError('Expected 1 <= minimum <= initial <= maximum: {} {} {}'.format(
+                minimum, initial, maximum))
+        if not 0 < backoff < 1:
+            raise ValueError('Backoff must be between 0 and 1: {}'.format(backoff))
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.target = target
+        self.smoothing = smoothing
+        self.window = window
+        self.name = name
+        self._keys = {}
+        self._cond = threading.Condition()
+
+    def _state(self, key):
+        state = self._keys.get(key)
+        if state is None:
+            state = self._keys[key] = KeyLimit(self.initial)
+        return state
+
+    def limit(self, key=''):
+        """Current limit of a key."""
+        with self._cond:
+            return int(self._state(key).limit)
+
+    def limits(self):
+        """{key: current limit}."""
+        with self._cond:
+            return {key: int(state.limit) for key, state in sorted(self._keys.items())}
+
+    def healthy(self, key=''):
+        """Latency under which the requests of a key count as healthy, None before any sample."""
+        with self._cond:
+            return self._healthy(self._state(key))
+
+    def _healthy(self, state):
+        if self.target is not None:
+            return self.target
+        if state.baseline is None:
+            return None
+        return state.baseline * self.tolerance
+
+    def observe(self, key, seconds, status=200, inflight=None):
+        """
+        Feed the outcome of one request: its latency and HTTP status (None
+        for a connection error or timeout). inflight is the number of
+        requests of the key in flight when it was sent, the current one by
+        default. Returns the new limit.
+        """
+        with self._cond:
+            state = self._state(key)
+            inflight = state.inflight if inflight is None else inflight
+            state.samples += 1
+            failure = failed_status(status)
+            if not failure:
+                if state.baseline is None or seconds < state.baseline:
+                    state.baseline = seconds
+                if state.window_min is None or seconds < state.window_min:
+                    state.window_min = seconds
+                now = time.monotonic()
+                if now - state.window_start >= self.window:
+                    state.baseline = state.window_min
+                    state.window_min = None
+                    state.window_start = now
+                if state.latency is None:
+                    state.latency = seconds
+                else:
+                    state.latency += (seconds - state.latency) * self.smoothing
+            else:
+                state.failures += 1
+            healthy = self._healthy(state)
+            congested = failure or (healthy is not None and state.latency > healthy)
+            if state.recovery > 0:
+                state.recovery -= 1
+            elif congested:
+                limit = max(float(self.minimum), state.limit * self.backoff)
+                if limit < state.limit:
+                    state.limit = limit
+                    state.decreases += 1
+                # the smoothed latency starts over from the next samples
+                state.latency = None
+                # the others of the round, this one being back already
+                state.recovery = max(inflight - 1, 0)
+            elif state.limit < self.maximum and inflight * 2 >= state.limit:
+                # only grow a limit that is actually used
+                previous = int(state.limit)
+                state.limit = min(float(self.maximum), state.limit + 1.0 / state.limit)
+                if int(state.limit) > previous:
+                    state.increases += 1
+                    self._cond.notify_all()
+            return int(state.limit)
+
+    def acquire(self, key='', timeout=None):
+        """Wait for a free slot of a key. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            state = self._state(key)
+            while state.inflight >= int(state.limit):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            state.inflight += 1
+            return True
+
+    def release(self, key='', seconds=None, status=200):
+        """Give a slot back, observing the request when seconds is given."""
+        with self._cond:
+            state = self._state(key)
+            inflight = state.inflight
+            state.inflight -= 1
+            if seconds is not None:
+                self.observe(key, seconds, status, inflight)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, key=''):
+        """
+        Hold a slot of a key around a request. The yielded Slot's status
+        (200 by default) is observed with the elapsed time; an exception
+        counts as a failure.
+        """
+        self.acquire(key)
+        slot = Slot()
+        start = time.perf_counter()
+        try:
+            yield slot
+        except Exception:
+            self.release(key, time.perf_counter() - start, None)
+            raise
+        self.release(key, time.perf_counter() - start, slot.status)
+
+    def hook(self, key_of):
+        """
+        An Instrumentation post hook observing every request: key_of(info)
+        returns the key of a request, None to ignore it.
+        """
+        def observe(info):
+            key = key_of(info)
+            if key is not None:
+                self.observe(key, info['seconds'], info['status'])
+        return observe
+
+    def snapshot(self):
+        """{key: {'limit', 'inflight', 'baseline', 'latency', 'samples', 'increases', ...}}."""
+        with self._cond:
+            return {key: {'limit': int(state.limit), 'inflight': state.inflight,
+                          'baseline': state.baseline, 'latency': state.latency,
+                          'samples': state.samples, 'increases': state.increases,
+                          'decreases': state.decreases, 'failures': state.failures}
+                    for key, state in sorted(self._keys.items())}
+
+    def openmetrics(self, prefix='pyproxmox_client'):
+        """Current limits and requests in flight as OpenMetrics lines (no '# EOF')."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, field, doc in (('concurrency_limit', 'limit', 'Adaptive concurrency limit'),
+                                 ('concurrency_inflight', 'inflight', 'Requests in flight')):
+            lines.append('# TYPE {}_{} gauge'.format(prefix, name))
+            lines.append('# HELP {}_{} {}'.format(prefix, name, doc))
+            for key, state in snapshot.items():
+                lines.append('{}_{}{{limiter="{}",key="{}"}} {}'.format(
+                    prefix, name, self.name, key, state[field]))
+        lines.append('# TYPE {}_concurrency_decreases counter'.format(prefix))
+        lines.append('# HELP {}_concurrency_decreases Limit decreases on congestion'.format(prefix))
+        for key, state in snapshot.items():
+            lines.append('{}_concurrency_decreases_total{{limiter="{}",key="{}"}} {}'.format(
+                prefix, self.name, key, state['decreases']))
+        return lines
+
+
+class Slot:
+    """Outcome of a request run in AdaptiveLimiter.slot."""
+    __slots__ = ('status',)
+
+    def __init__(self):
+        self.status = 200
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IP and MAC address index of the guests.
+
+AddressIndex finds which guest owns an address without asking every VM.
+Addresses come from the guest agents ('network-get-interfaces', through
+BulkAgent), and for guests without a working agent from their config: the
+net* MAC addresses and cloud-init ipconfig* of qemu guests, the hwaddr and
+static ip= / ip6= of LXC containers:
+
+index = AddressIndex(b)
+index.refresh()                       # again every few minutes
+index.by_ip('10.1.0.100')             # [{'vmid': 100, 'node': 'vnode01', ...}]
+index.by_mac('bc:24:11:00:00:64')
+index.in_network('10.1.0.0/24')
+
+refresh() is incremental: only the new guests, the guests that moved,
+started or stopped, and the ones read more than max_age seconds ago are
+read again. IP and MAC lookups are dict lookups; network lookups bisect
+the sorted addresses.
+"""
+
+import re
+import time
+import bisect
+import threading
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from .agent import BulkAgent
+
+MAC = re.compile(r'^[0-9a-f]{2}(?::[0-9a-f]{2}){5}$', re.IGNORECASE)
+NET_KEY = re.compile(r'^net(\d+)$')
+IPCONFIG_KEY = re.compile(r'^ipconfig(\d+)$')
+
+
+def parse_options(value):
+    """{key: value} of a 'key=value,key=value' config option."""
+    options = {}
+    for part in str(value).split(','):
+        key, _, setting = part.partition('=')
+        options[key.strip()] = setting.strip()
+    return options
+
+
+def _address(text):
+    """The ip_address of 'addr' or 'addr/prefix', None for 'dhcp', 'manual'..."""
+    try:
+        return ipaddress.ip_interface(text).ip
+    except ValueError:
+        return None
+
+
+def _usable(address):
+    return address is not None and not (address.is_loopback or address.is_link_local)
+
+
+def config_addresses(kind, config):
+    """[(interface, mac, ip or None)] from a qemu or LXC config."""
+    found = []
+    ipconfig = {}
+    for key, value in config.items():
+        match = IPCONFIG_KEY.match(key)
+        if match:
+            ipconfig[match.group(1)] = parse_options(value)
+    for key, value in sorted(config.items()):
+        match = NET_KEY.match(key)
+        if not match:
+            continue
+        options = parse_options(value)
+        if kind == 'lxc':
+            mac = options.get('hwaddr')
+            interface = options.get('name', key)
+            settings = options
+        else:
+            mac = options.get('macaddr') or next(
+                (setting for setting in options.values() if MAC.match(setting)), None)
+            interface = key
+            settings = ipconfig.get(match.group(1), {})
+        mac = mac.lower() if mac and MAC.match(mac) else None
+        ips = [address for address in (_address(settings.get('ip', '')),
+                                       _address(settings.get('ip6', '')))
+               if _usable(address)]
+        for address in ips or [None]:
+            found.append((interface, mac, address))
+    return found
+
+
+def agent_addresses(interfaces):
+    """[(interface, mac, ip or None)] from a 'network-get-interfaces' result."""
+    found = []
+    for interface in interfaces or []:
+        mac = (interface.get('hardware-address') or '').lower()
+        mac = mac if MAC.match(mac) and mac != '00:00:00:00:00:00' else None
+        ips = [address for address in (_address(entry.get('ip-address', ''))
+                                       for entry in interface.get('ip-addresses') or [])
+               if _usable(address)]
+        if mac is None and not ips:
+            continue
+        for address in ips or [None]:
+            found.append((interface.get('name'), mac, address))
+    return found
+
+
+class AddressIndex:
+    """
+    Guests by IP and MAC address.
+
+    agent: the BulkAgent used for the agent queries (one with its defaults
+    by default; its negative cache spares the dead agents). max_age:
+    seconds before a guest is read again. workers: configs read at once.
+    """
+    def __init__(self, prox, agent=None, max_age=900, workers=16):
+        self.prox = prox
+        self.agent = agent if agent is not None else BulkAgent(prox)
+        self.max_age = max_age
+        self.workers = workers
+        # {vmid: guest record}
+        self.guests = {}
+        self._ip = {}
+        self._mac = {}
+        self._sorted = None
+        self._lock = threading.Lock()
+
+    def refresh(self, full=False):
+        """
+        Read the guests that changed (all of them when full) and update the
+        index. Returns {'read', 'removed', 'guests'} counts.
+        """
+        data = self.prox.connect('get', 'cluster/resources', {'type': 'vm'})
+        resources = (data or {}).get('data')
+        if not isinstance(resources, list):
+            raise AssertionError('Index Error: no cluster resources: \n {}'.format(
+                (data or {}).get('status')))
+        current = {resource['vmid']: resource for resource in resources
+                   if resource.get('type') in ('qemu', 'lxc') and not resource.get('template')}
+        now = time.monotonic()
+        with self._lock:
+            known = dict(self.guests)
+        stale = {}
+        for vmid, resource in current.items():
+            record = known.get(vmid)
+            # guests that could not be read (source None) are tried again
+            if (full or record is None or record['source'] is None or
+                    now - record['read'] > self.max_age or
+                    (record['node'], record['status']) != (resource['node'],
+                                                           resource.get('status'))):
+                stale[vmid] = resource
+        records = self._read(stale, now)
+        removed = [vmid for vmid in known if vmid not in current]
+        with self._lock:
+            for vmid in removed:
+                self._unindex(self.guests.pop(vmid))
+            for vmid, record in records.items():
+                if vmid in self.guests:
+                    self._unindex(self.guests[vmid])
+                self.guests[vmid] = record
+                self._index(record)
+            self._sorted = None
+            return {'read': len(records), 'removed': len(removed), 'guests': len(self.guests)}
+
+    def _read(self, resources, now):
+        """Guest records of resources: agent data when it answers, the config otherwise."""
+        qemu = {vmid: resource for vmid, resource in resources.items()
+                if resource['type'] == 'qemu'}
+        answers = self.agent.query('network-get-interfaces', guests=qemu) if qemu else {}
+        records = {}
+        from_config = []
+        for vmid, resource in resources.items():
+            record = {'vmid': vmid, 'node': resource['node'], 'type': resource['type'],
+                      'name': resource.get('name'), 'status': resource.get('status'),
+                      'read': now, 'source': None, 'addresses': []}
+            records[vmid] = record
+            answer = answers.get(vmid)
+            if answer is not None and answer['state'] == 'ok':
+                record['source'] = 'agent'
+                record['addresses'] = agent_addresses(
+                    answer['data'].get('network-get-interfaces'))
+            else:
+                from_config.append(record)
+        if from_config:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(from_config))) as executor:
+                list(executor.map(self._read_config, from_config))
+        return records
+
+    def _read_config(self, record):
+        """Addresses of a guest config. On error source stays None, read again next refresh."""
+        try:
+            data = self.prox.connect('get', 'nodes/{}/{}/{}/config'.format(
+                record['node'], record['type'], record['vmid']), None)
+        except requests.RequestException:
+            return
+        config = (data or {}).get('data')
+        if isinstance(config, dict):
+            record['source'] = 'config'
+            record['addresses'] = config_addresses(record['type'], config)
+
+    def _index(self, record):
+        for _, mac, address in record['addresses']:
+            if address is not None:
+                self._ip.setdefault(address, set()).add(record['vmid'])
+            if mac is not None:
+                self._mac.setdefault(mac, set()).add(record['vmid'])
+
+    def _unindex(self, record):
+        for _, mac, address in record['addresses']:
+            for index, key in ((self._ip, address), (self._mac, mac)):
+                vmids = index.get(key)
+                if vmids is not None:
+                    vmids.discard(record['vmid'])
+                    if not vmids:
+                        del index[key]
+
+    def _records(self, vmids):
+        return [dict(self.guests[vmid]) for vmid in sorted(vmids)]
+
+    def by_ip(self, address):
+        """Guest records owning an IP address (str or ipaddress object)."""
+        address = ipaddress.ip_address(address)
+        with self._lock:
+            return self._records(self._ip.get(address, ()))
+
+    def by_mac(self, mac):
+        """Guest records owning a MAC address, in any case."""
+        with self._lock:
+            return self._records(self._mac.get(mac.lower(), ()))
+
+    def in_network(self, network):
+        """{ip: guest records} of the addresses inside a CIDR network ('10.1.0.0/16')."""
+        network = ipaddress.ip_network(network, strict=False)
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = {4: [], 6: []}
+                for address in sorted(self._ip, key=lambda address: (address.version,
+                                                                      int(address))):
+                    self._sorted[address.version].append(int(address))
+            addresses = self._sorted[network.version]
+            start = bisect.bisect_left(addresses, int(network.network_address))
+            end = bisect.bisect_right(addresses, int(network.broadcast_address))
+            factory = ipaddress.IPv4Address if network.version == 4 else ipaddress.IPv6Address
+            return {factory(value): self._records(self._ip[factory(value)])
+                    for value in addresses[start:end]}
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Guest agent queries on many VMs.
+
+BulkAgent runs guest agent commands on every running qemu guest (or the
+given vmids) at once, with a short timeout per VM instead of the pveproxy
+one. VMs whose config disables the agent are skipped, and VMs whose agent
+is dead (timed out, not running) are not asked again before negative_ttl
+seconds; other errors (VM locked, proxy errors...) are not cached:
+
+agent = BulkAgent(b, timeout=3, workers=32)
+results = agent.query(('network-get-interfaces', 'get-osinfo'))
+results[101]['data']['get-osinfo']['name']
+results[102]['state']                # 'ok', 'disabled', 'stopped', 'failed' or 'cached'
+
+Call query() every cycle: the agent settings of the configs are cached for
+config_ttl seconds, and the dead agents for negative_ttl seconds.
+"""
+
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# answers of a dead agent, cached; other errors are tried again next query
+DEAD_AGENT = re.compile(r'agent is not running|no qemu guest agent configured|got timeout',
+                        re.IGNORECASE)
+
+
+def agent_enabled(config):
+    """True when a qemu config enables the agent ('1', 'enabled=1,fstrim_cloned_disks=1'...)."""
+    value = str((config or {}).get('agent', '0'))
+    for part in value.split(','):
+        key, _, setting = part.partition('=')
+        if not setting:
+            return key.strip() == '1'
+        if key.strip() == 'enabled':
+            return setting.strip() == '1'
+    return False
+
+
+class BulkAgent:
+    """
+    Guest agent commands on many VMs.
+
+    timeout: seconds allowed to each agent call. workers: VMs queried at
+    once. negative_ttl: seconds a VM whose agent is dead is skipped.
+    config_ttl: seconds the agent setting of a config is trusted.
+    """
+    def __init__(self, prox, timeout=3.0, workers=32, negative_ttl=600, config_ttl=3600):
+        self.prox = prox
+        self.timeout = timeout
+        self.workers = workers
+        self.negative_ttl = negative_ttl
+        self.config_ttl = config_ttl
+        # {vmid: (agent enabled, expiry)}
+        self._enabled = {}
+        # {vmid: (reason, expiry)}
+        self._negative = {}
+        self._lock = threading.Lock()
+
+    def guests(self, vmids=None):
+        """{vmid: 'cluster/resources' entry} of the qemu guests (of vmids)."""
+        wanted = None if vmids is None else set(vmids)
+        data = self.prox.connect('get', 'cluster/resources', {'type': 'vm'})
+        return {resource['vmid']: resource for resource in (data or {}).get('data') or []
+                if resource.get('type') == 'qemu' and not resource.get('template')
+                and (wanted is None or resource['vmid'] in wanted)}
+
+    def negative(self):
+        """{vmid: reason} of the VMs currently skipped for a dead agent."""
+        now = time.monotonic()
+        with self._lock:
+            return {vmid: reason for vmid, (reason, expiry) in self._negative.items()
+                    if expiry > now}
+
+    def forget(self, vmid=None):
+        """Drop the cached agent state of a VM, of every VM when vmid is None."""
+        with self._lock:
+            if vmid is None:
+                self._negative.clear()
+                self._enabled.clear()
+            else:
+                self._negative.pop(vmid, None)
+                self._enabled.pop(vmid, None)
+
+    def query(self, commands, vmids=None, guests=None):
+        """
+        Run agent commands (a name or a list) on the running qemu guests,
+        all of them or those of vmids. guests: {vmid: resource} already
+        read from 'cluster/resources', to save that call.
+
+        Returns {vmid: {'node', 'state', 'data': {command: result}, 'error'}}
+        with state 'ok', 'disabled' (agent off in the config), 'stopped',
+        'cached' (skipped, agent found dead recently) or 'failed'.
+        """
+        if isinstance(commands, str):
+            commands = (commands,)
+        guests = self.guests(vmids) if guests is None else guests
+        negative = self.negative()
+        results = {}
+        pending = []
+        for vmid, resource in guests.items():
+            entry = {'node': resource['node'], 'state': None, 'data': {}, 'error': None}
+            results[vmid] = entry
+            if resource.get('status') != 'running':
+                entry['state'] = 'stopped'
+            elif vmid in negative:
+                entry['state'] = 'cached'
+                entry['error'] = negative[vmid]
+            else:
+                pending.append((vmid, entry))
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending))) as executor:
+                list(executor.map(lambda job: self._query_one(job[0], job[1], commands),
+                                  pending))
+        return results
+
+    def _is_enabled(self, vmid, node):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._enabled.get(vmid)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        data = self.prox.connect('get', 'nodes/{}/qemu/{}/config'.format(node, vmid), None,
+                                 timeout=self.timeout)
+        config = (data or {}).get('data')
+        if not isinstance(config, dict):
+            raise AssertionError('Agent Error: no config: \n {}'.format(
+                (data or {}).get('status')))
+        enabled = agent_enabled(config)
+        with self._lock:
+            self._enabled[vmid] = (enabled, now + self.config_ttl)
+        return enabled
+
+    def _query_one(self, vmid, entry, commands):
+        node = entry['node']
+        try:
+            enabled = self._is_enabled(vmid, node)
+        except (requests.RequestException, AssertionError) as error:
+            # the config could not be read: not the agent's fault, no caching
+            entry['state'] = 'failed'
+            entry['error'] = str(error)
+            return
+        if not enabled:
+            entry['state'] = 'disabled'
+            return
+        try:
+            for command in commands:
+                data = self.prox.connect(
+                    'get', 'nodes/{}/qemu/{}/agent/{}'.format(node, vmid, command), None,
+                    timeout=self.timeout)
+                status = (data or {}).get('status') or {}
+                if not data or not status.get('ok'):
+                    raise AssertionError('{} {}'.format(status.get('code'),
+                                                        status.get('reason')))
+                result = data.get('data')
+                entry['data'][command] = (result.get('result', result)
+                                          if isinstance(result, dict) else result)
+        except requests.Timeout:
+            self._fail(vmid, entry, 'timeout after {}s'.format(self.timeout))
+            return
+        except (requests.RequestException, AssertionError) as error:
+            # a locked VM or a lost connection says nothing of the agent
+            self._fail(vmid, entry, str(error), DEAD_AGENT.search(str(error)) is not None)
+            return
+        entry['state'] = 'ok'
+
+    def _fail(self, vmid, entry, reason, dead=True):
+        entry['state'] = 'failed'
+        entry['error'] = reason
+        if not dead:
+            return
+        with self._lock:
+            self._negative[vmid] = (reason, time.monotonic() + self.negative_ttl)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Client throughput and latency benchmarks.
+
+Each workload runs against a FakeProxmoxServer in a child process, so the
+numbers (calls/sec, latency percentiles, peak RSS) only account for the
+client. Workloads:
+
+inventory   cluster/resources, then the guests and status of every node
+power       start every guest, one call each
+tasks       task status polls plus the per node active task listing
+rrd         rrddata of every guest, node and storage, decoded to RRDSeries
+
+and modes:
+
+sync        one call after the other
+threaded    a thread pool of --concurrency workers
+async       an asyncio loop running --concurrency calls at once in executor
+            threads, like an async application driving this client
+
+python -m pyproxmox3.benchmark --output bench.json
+python -m pyproxmox3.benchmark --workloads inventory,rrd --modes threaded --latency 0.002
+"""
+
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import platform
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+WORKLOADS = ('inventory', 'power', 'tasks', 'rrd')
+MODES = ('sync', 'threaded', 'async')
+
+
+def percentile(values, percent):
+    """Percentile (0-100) of a list of values, nearest rank."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, min(len(values), math.ceil(percent / 100.0 * len(values))) - 1)
+    return values[rank]
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KiB, None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def guests_by_node(prox):
+    """{node: [(type, vmid)]} from cluster/resources."""
+    nodes = {}
+    for entry in prox.connect('get', 'cluster/resources', None)['data']:
+        if entry.get('type') == 'node':
+            nodes.setdefault(entry['node'], [])
+        elif entry.get('type') in ('qemu', 'lxc') and not entry.get('template'):
+            nodes.setdefault(entry['node'], []).append((entry['type'], entry['vmid']))
+    return nodes
+
+
+def inventory_jobs(prox, iterations):
+    """A full inventory sweep per iteration."""
+    nodes = guests_by_node(prox)
+    jobs = []
+    for _ in range(iterations):
+        jobs.append(prox.get_cluster_resources)
+        for node in nodes:
+            jobs.append(lambda node=node: prox.get_virtual_list(node))
+            jobs.append(lambda node=node: prox.connect('get', 'nodes/{}/lxc'.format(node), None))
+            jobs.append(lambda node=node: prox.get_node_status(node))
+    return jobs
+
+
+def power_jobs(prox, iterations):
+    """One start call per guest (the guests are stopped beforehand)."""
+    jobs = []
+    for node, guests in guests_by_node(prox).items():
+        for kind, vmid in guests:
+            method = prox.start_virtual_machine if kind == 'qemu' else prox.start_lxc_container
+            jobs.append(lambda method=method, node=node, vmid=vmid: method(node, vmid))
+    return jobs * max(1, iterations // 10)
+
+
+def tasks_jobs(prox, iterations):
+    """Status polls of running tasks, plus one active listing per node and round."""
+    upids = []
+    nodes = guests_by_node(prox)
+    for node, guests in nodes.items():
+        for kind, vmid in guests[:10]:
+            data = prox.connect('post', 'nodes/{}/{}/{}/status/start'.format(node, kind, vmid),
+                                None)
+            upids.append((node, data['data']))
+    jobs = []
+    for _ in range(iterations):
+        for node in nodes:
+            jobs.append(lambda node=node: prox.connect('get', 'nodes/{}/tasks'.format(node),
+                                                       {'source': 'active', 'limit': 500}))
+        for node, upid in upids:
+            jobs.append(lambda node=node, upid=upid: prox.get_node_task_status_by_upid(node,
+                                                                                       upid))
+    return jobs
+
+
+def rrd_jobs(prox, iterations):
+    """rrddata of every guest, node and storage, decoded to columns."""
+    from .rrd import RRDSeries  # pylint: disable=import-outside-toplevel
+    from .rrdstore import RRDCollector  # pylint: disable=import-outside-toplevel
+    post_data = {'timeframe': 'hour', 'cf': 'AVERAGE'}
+    paths = [path for _, path in RRDCollector(prox, None).targets()]
+    return [lambda path=path: RRDSeries.from_rrd_data(prox.connect('get', path, post_data))
+            for path in paths] * max(1, iterations // 5)
+
+
+JOBS = {'inventory': inventory_jobs, 'power': power_jobs, 'tasks': tasks_jobs,
+        'rrd': rrd_jobs}
+
+
+def run_jobs(jobs, mode, concurrency):
+    """Run the jobs in a mode. Returns the errors raised."""
+    errors = []
+
+    def call(job):
+        try:
+            job()
+        except Exception as error:  # pylint: disable=broad-except
+            errors.append(error)
+
+    if mode == 'sync':
+        for job in jobs:
+            call(job)
+    elif mode == 'threaded':
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(call, jobs))
+    elif mode == 'async':
+        async def main():
+            loop = asyncio.get_running_loop()
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(job):
+                async with semaphore:
+                    await loop.run_in_executor(executor, call, job)
+            try:
+                await asyncio.gather(*(one(job) for job in jobs))
+            finally:
+                executor.shutdown()
+        asyncio.run(main())
+    else:
+        raise ValueError('Unknown mode: {}'.format(mode))
+    return errors
+
+
+def run_case(case):
+    """Run one (workload, mode) case. Called in a child process, returns a result dict."""
+    from . import ProxAuth, PyProxmox, Instrumentation  # pylint: disable=import-outside-toplevel
+    from .transport import Transport  # pylint: disable=import-outside-toplevel
+    prox = PyProxmox(ProxAuth(case['host'], case['username'], case['password'],
+                              port=case['port'], scheme=case['scheme']))
+    prox.transport = Transport(pool_size=case['concurrency'])
+    jobs = JOBS[case['workload']](prox, case['iterations'])
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def record(info):
+        with lock:
+            latencies.append(info['seconds'])
+            statuses[info['status']] = statuses.get(info['status'], 0) + 1
+    instrumentation = Instrumentation()
+    instrumentation.add_hooks(post=record)
+    prox.instrumentation = instrumentation
+
+    start = time.perf_counter()
+    errors = run_jobs(jobs, case['mode'], case['concurrency'])
+    seconds = time.perf_counter() - start
+    prox.transport.close()
+    failed = sum(count for status, count in statuses.items() if status is None or status >= 400)
+    return {
+        'workload': case['workload'], 'mode': case['mode'],
+        'concurrency': 1 if case['mode'] == 'sync' else case['concurrency'],
+        'jobs': len(jobs), 'calls': len(latencies), 'seconds': round(seconds, 6),
+        'calls_per_sec': round(len(latencies) / seconds, 2) if seconds else None,
+        'p50_ms': _ms(percentile(latencies, 50)), 'p99_ms': _ms(percentile(latencies, 99)),
+        'max_ms': _ms(max(latencies) if latencies else None),
+        'mean_ms': _ms(sum(latencies) / len(latencies) if latencies else None),
+        'errors': failed + len(errors), 'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def run(workloads=WORKLOADS, modes=MODES, nodes=3, guests_per_node=50, iterations=20,
+        concurrency=8, latency=0.0, workers=None):
+    """Run every workload in every mode. Returns the report dict."""
+    from .fakeapi import FakeCluster, FakeProxmoxServer  # pylint: disable=import-outside-toplevel
+    cluster = FakeCluster(nodes, guests_per_node, task_duration=3600, agent_failure_rate=0)
+    server = FakeProxmoxServer(cluster, latency=latency, workers=workers)
+    results = []
+    # one fresh process per case: clean peak RSS, no GIL shared with the server
+    context = multiprocessing.get_context('spawn')
+    with server:
+        for workload in workloads:
+            for mode in modes:
+                _prepare(cluster, workload)
+                case = {'workload': workload, 'mode': mode, 'host': server.host,
+                        'port': server.port, 'scheme': server.scheme, 'username': 'root@pam',
+                        'password': cluster.users['root@pam'], 'iterations': iterations,
+                        'concurrency': concurrency}
+                with context.Pool(1, maxtasksperchild=1) as pool:
+                    result = pool.apply(run_case, (case,))
+                results.append(result)
+                print('{workload:<10} {mode:<9} {calls:>7} calls {calls_per_sec:>9} /s '
+                      'p50 {p50_ms} ms p99 {p99_ms} ms rss {peak_rss_kb} KiB'.format(**result),
+                      file=sys.stderr)
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'time': int(time.time()),
+            'parameters': {'nodes': nodes, 'guests_per_node': guests_per_node,
+                           'iterations': iterations, 'concurrency': concurrency,
+                           'latency': latency, 'workers': workers},
+            'results': results}
+
+
+def _prepare(cluster, workload):
+    """Reset the cluster state a workload expects."""
+    with cluster.lock:
+        if workload == 'power':
+            for guest in cluster.guests.values():
+                guest['status'] = 'stopped'
+        cluster.tasks.clear()
+        cluster._pending.clear()  # pylint: disable=protected-access
+        cluster._finished.clear()  # pylint: disable=protected-access
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='pyproxmox3 client benchmarks')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS),
+                        help='comma separated, among {}'.format(', '.join(WORKLOADS)))
+    parser.add_argument('--modes', default=','.join(MODES),
+                        help='comma separated, among {}'.format(', '.join(MODES)))
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--guests-per-node', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added by the server to each request')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='requests the server processes at once')
+    parser.add_argument('--output', help='write the JSON report to this file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    workloads = [name for name in args.workloads.split(',') if name]
+    modes = [name for name in args.modes.split(',') if name]
+    for name in workloads:
+        if name not in WORKLOADS:
+            parser.error('unknown workload {}'.format(name))
+    for name in modes:
+        if name not in MODES:
+            parser.error('unknown mode {}'.format(name))
+    report = run(workloads, modes, args.nodes, args.guests_per_node, args.iterations,
+                 args.concurrency, args.latency, args.workers)
+    text = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            output.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
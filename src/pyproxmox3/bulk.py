@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bulk operations on many guests.
+
+BulkPower starts, stops or migrates a list of vmids. Guests are located with
+one 'cluster/resources' call and grouped by node. The node level
+startall/stopall/migrateall endpoints are used when possible, otherwise one
+call is made per guest while keeping a limited number of tasks in flight per
+node and for the whole cluster:
+
+with BulkPower(b, node_concurrency=8, cluster_concurrency=64) as bulk:
+    result = bulk.start(range(100, 600))
+    done, not_done = result.wait(timeout=900)
+print(result.failed())
+"""
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import requests
+from .tasks import TaskTracker
+
+
+def locate_guests(prox, vmids):
+    """Find the guests (list of int) in 'cluster/resources'. Returns {vmid: resource}."""
+    wanted = set(vmids)
+    data = prox.connect('get', 'cluster/resources', {'type': 'vm'})
+    found = {}
+    for resource in (data or {}).get('data') or []:
+        if resource.get('vmid') in wanted:
+            found[resource['vmid']] = resource
+    return found
+
+
+def missing_guest(vmid):
+    """A future failed for a vmid not found in the cluster."""
+    future = Future()
+    future.set_exception(AssertionError('Bulk Error: VM {} not found in cluster resources'
+                                        .format(vmid)))
+    return future
+
+
+def noop_guest(vmid, node):
+    """A future resolved OK for a guest with nothing to do (already on node)."""
+    future = Future()
+    future.set_result({'status': 'stopped', 'exitstatus': 'OK', 'upid': None,
+                       'node': node, 'vmid': vmid})
+    return future
+
+
+class TaskDispatcher:
+    """
+    Launch task-starting calls while limiting how many tasks are in flight.
+
+    Each job declares the slots it takes, as (kind, key) pairs such as
+    ('node', 'vnode01') or ('cluster', ''). limits maps a kind to the max
+    number of tasks in flight per key of that kind; kinds without a limit
+    are not restricted. A slot is held from the launch call until the task
+    stopped. Jobs are started in submission order, skipping the ones whose
+    slots are full so that a busy node does not hold back the others.
+
+    adaptive maps a kind to an AdaptiveLimiter which then sets the limits
+    of that kind instead of limits; it observes the latency and failures of
+    the launch calls.
+
+    close() (or leaving a with block) stops the launch threads once the
+    queued jobs are launched.
+    """
+    def __init__(self, limits, workers=8, adaptive=None):
+        self.limits = dict(limits)
+        self.adaptive = dict(adaptive or {})
+        self._inflight = {}
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._thread = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self, cancel=False):
+        """
+        Stop the launch threads, after launching the queued jobs (which may
+        wait for tasks in flight to free their slots), or cancelling them
+        with cancel. Tasks already launched keep being followed.
+        """
+        with self._cond:
+            self._closed = True
+            if cancel:
+                while self._queue:
+                    self._queue.popleft()[2].cancel()
+                self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._executor.shutdown()
+
+    def submit(self, launch, slots):
+        """
+        Queue a job. launch() must return a TaskFuture (or any Future).
+        Returns a Future resolved with the task result; its 'task'
+        attribute is set to the launched TaskFuture.
+        """
+        outer = Future()
+        outer.task = None
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('cannot submit jobs after close')
+            self._queue.append((launch, tuple(slots), outer))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='task-dispatcher')
+                self._thread.start()
+            self._cond.notify()
+        return outer
+
+    def inflight(self, kind=None):
+        """Tasks in flight, per (kind, key)."""
+        with self._cond:
+            return {slot: count for slot, count in self._inflight.items()
+                    if count and (kind is None or slot[0] == kind)}
+
+    def limit(self, kind, key):
+        """Current in-flight limit for a slot, None when not limited."""
+        limiter = self.adaptive.get(kind)
+        if limiter is not None:
+            return limiter.limit(key)
+        return self.limits.get(kind)
+
+    def _free(self, slots):
+        for kind, key in slots:
+            limit = self.limit(kind, key)
+            if limit is not None and self._inflight.get((kind, key), 0) >= limit:
+                return False
+        return True
+
+    def _next_job(self):
+        for job in self._queue:
+            if self._free(job[1]):
+                self._queue.remove(job)
+                return job
+        return None
+
+    def _run(self):
+        with self._cond:
+            while True:
+                if not self._queue:
+                    self._thread = None
+                    return
+                job = self._next_job()
+                if job is None:
+                    self._cond.wait()
+                    continue
+                for slot in job[1]:
+                    self._inflight[slot] = self._inflight.get(slot, 0) + 1
+                self._executor.submit(self._launch, job)
+
+    def _release(self, slots):
+        with self._cond:
+            for slot in slots:
+                self._inflight[slot] -= 1
+            self._cond.notify()
+
+    def _launch(self, job):
+        launch, slots, outer = job
+        start = time.perf_counter()
+        try:
+            task = launch()
+        except Exception as error:  # pylint: disable=broad-except
+            status = getattr(error, 'status', None)
+            self._observe(slots, time.perf_counter() - start,
+                          status.get('code') if isinstance(status, dict) else None)
+            self._release(slots)
+            outer.set_exception(error)
+            return
+        self._observe(slots, time.perf_counter() - start, 200)
+        outer.task = task
+        task.add_done_callback(lambda done: self._finish(slots, outer, done))
+
+    def _observe(self, slots, seconds, status):
+        """Feed a launch call to the adaptive limiters of its slots."""
+        if not self.adaptive:
+            return
+        with self._cond:
+            inflight = {slot: self._inflight.get(slot, 0) for slot in slots}
+        for kind, key in slots:
+            limiter = self.adaptive.get(kind)
+            if limiter is not None:
+                limiter.observe(key, seconds, status, inflight[(kind, key)])
+        with self._cond:
+            # a grown limit may free a slot
+            self._cond.notify()
+
+    def _finish(self, slots, outer, task):
+        self._release(slots)
+        if task.cancelled():
+            outer.cancel()
+        elif task.exception() is not None:
+            outer.set_exception(task.exception())
+        else:
+            outer.set_result(task.result())
+
+
+class BulkResult:
+    """The futures of a bulk operation, one per vmid."""
+    def __init__(self, futures):
+        self.futures = futures
+
+    def __repr__(self):
+        done = sum(1 for future in self.futures.values() if future.done())
+        return '<BulkResult {}/{} done>'.format(done, len(self.futures))
+
+    def wait(self, timeout=None):
+        """Wait for every guest. Returns (done, not_done) like concurrent.futures.wait."""
+        return wait(list(self.futures.values()), timeout)
+
+    def done(self):
+        """True when every task stopped."""
+        return all(future.done() for future in self.futures.values())
+
+    def results(self):
+        """Task status (or exception) of the finished guests, per vmid."""
+        results = {}
+        for vmid, future in self.futures.items():
+            if future.done() and not future.cancelled():
+                results[vmid] = future.exception() or future.result()
+        return results
+
+    def failed(self):
+        """Finished guests whose call raised or whose task did not exit with OK."""
+        failed = {}
+        for vmid, result in self.results().items():
+            if isinstance(result, BaseException):
+                failed[vmid] = str(result)
+            elif result.get('exitstatus') != 'OK':
+                failed[vmid] = result.get('exitstatus')
+        return failed
+
+
+class BulkPower:
+    """
+    Power operations and migrations on many guests at once.
+
+    node_concurrency and cluster_concurrency bound the number of guest tasks
+    in flight per node and for the whole cluster when one call per guest is
+    needed. Tasks are followed by a single TaskTracker. adaptive: an
+    AdaptiveLimiter setting the per node limits instead of node_concurrency.
+    close() it (or use it in a with block) once done.
+    """
+    # per guest methods, by guest type and action
+    ACTIONS = {
+        'qemu': {'start': 'start_virtual_machine', 'stop': 'stop_virtual_machine',
+                 'shutdown': 'shutdown_virtual_machine', 'reset': 'reset_virtual_machine',
+                 'suspend': 'suspend_virtual_machine', 'resume': 'resume_virtual_machine'},
+        'lxc': {'start': 'start_lxc_container', 'stop': 'stop_lxc_container',
+                'shutdown': 'shutdown_lxc_container'},
+    }
+
+    def __init__(self, prox, node_concurrency=4, cluster_concurrency=32, tracker=None,
+                 workers=8, adaptive=None):
+        self.prox = prox
+        self.tracker = tracker or TaskTracker(prox)
+        self.dispatcher = TaskDispatcher({'node': node_concurrency,
+                                          'cluster': cluster_concurrency}, workers,
+                                         {'node': adaptive} if adaptive else None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self, cancel=False):
+        """Stop the launch threads once the queued guests are launched (or cancelled)."""
+        self.dispatcher.close(cancel)
+
+    def start(self, vmids, node_endpoints=True):
+        """Start guests. Returns a BulkResult."""
+        if node_endpoints:
+            return self._node_call(vmids, 'start_all_node_guests', {'force': 1})
+        return self.run('start', vmids)
+
+    def stop(self, vmids, node_endpoints=True):
+        """Stop guests. Returns a BulkResult."""
+        if node_endpoints:
+            return self._node_call(vmids, 'stop_all_node_guests', {})
+        return self.run('stop', vmids)
+
+    def shutdown(self, vmids):
+        """Shut down guests, one call per guest. Returns a BulkResult."""
+        return self.run('shutdown', vmids)
+
+    def migrate(self, vmids, target, node_endpoints=True, online=True):
+        """
+        Migrate guests to target. Guests already on target are not sent and
+        resolve at once with exitstatus OK. Without node_endpoints, running
+        VMs move online (when online) and running containers by a restart.
+        Returns a BulkResult.
+        """
+        vmids = [int(vmid) for vmid in vmids]
+        guests = locate_guests(self.prox, vmids)
+        futures = {vmid: noop_guest(vmid, target) for vmid in vmids
+                   if vmid in guests and guests[vmid]['node'] == target}
+        vmids = [vmid for vmid in vmids if vmid not in futures]
+        if node_endpoints:
+            result = self._node_call(vmids, 'migrate_all_node_guests',
+                                     {'target': target,
+                                      'maxworkers': self.dispatcher.limits['node']}, guests)
+            futures.update(result.futures)
+            return BulkResult(futures)
+        for vmid in vmids:
+            resource = guests.get(vmid)
+            if resource is None:
+                futures[vmid] = missing_guest(vmid)
+                continue
+            node = resource['node']
+            if resource['type'] == 'lxc':
+                # a running container can only move by a restart on the target
+                post_data = {'restart': 1} if resource.get('status') == 'running' else None
+                launch = self._launcher('migrate_lxc_container', node, vmid, target,
+                                        post_data=post_data)
+            else:
+                post_data = {'target': target}
+                if online and resource.get('status') == 'running':
+                    post_data['online'] = 1
+                launch = self._launcher('migrate_virtual_machine', node, vmid, post_data)
+            futures[vmid] = self.dispatcher.submit(launch, [('node', node), ('cluster', '')])
+        return BulkResult(futures)
+
+    def run(self, action, vmids):
+        """Run a power action (start, stop, shutdown...) one call per guest."""
+        futures = {}
+        vmids = [int(vmid) for vmid in vmids]
+        guests = locate_guests(self.prox, vmids)
+        for vmid in vmids:
+            resource = guests.get(vmid)
+            if resource is None:
+                futures[vmid] = missing_guest(vmid)
+                continue
+            method = self.ACTIONS[resource['type']].get(action)
+            if method is None:
+                futures[vmid] = Future()
+                futures[vmid].set_exception(AssertionError('Bulk Error: {} not supported for {} {}'
+                                                           .format(action, resource['type'],
+                                                                   vmid)))
+                continue
+            launch = self._launcher(method, resource['node'], vmid)
+            futures[vmid] = self.dispatcher.submit(launch, [('node', resource['node']),
+                                                            ('cluster', '')])
+        return BulkResult(futures)
+
+    def _launcher(self, method, node, *args, **kwargs):
+        def launch():
+            return getattr(self.prox, method)(node, *args, future=self.tracker, **kwargs)
+        return launch
+
+    def _node_call(self, vmids, method, post_data, guests=None):
+        """
+        One node level call per node. Every guest of a node shares its task.
+        guests: the locate_guests() result when already read.
+        """
+        futures = {}
+        by_node = {}
+        vmids = [int(vmid) for vmid in vmids]
+        guests = locate_guests(self.prox, vmids) if guests is None else guests
+        for vmid in vmids:
+            if vmid in guests:
+                by_node.setdefault(guests[vmid]['node'], []).append(vmid)
+            else:
+                futures[vmid] = missing_guest(vmid)
+        for node, node_vmids in by_node.items():
+            node_data = dict(post_data, vms=','.join(str(vmid) for vmid in node_vmids))
+            try:
+                task = getattr(self.prox, method)(node, node_data, future=self.tracker)
+            except (requests.RequestException, AssertionError) as error:
+                # only the guests of this node fail, the other nodes go on
+                task = Future()
+                task.set_exception(error)
+            for vmid in node_vmids:
+                futures[vmid] = task
+        return BulkResult(futures)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mass cloning of templates.
+
+ClonePipeline leases the new vmids up front from a VmidAllocator, makes
+linked clones when the template and its storage allow it, limits the clones
+in flight per template, per storage and for the cluster, then applies each
+clone configuration once its clone task succeeded:
+
+pipeline = ClonePipeline(b)
+result = pipeline.clone('vnode01', 9000, ['web{:02}'.format(i) for i in range(100)],
+                        config={'cores': 2, 'memory': 4096})
+result.wait()
+"""
+
+import json
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from .bulk import BulkResult, TaskDispatcher
+from .tasks import TaskTracker
+from .vmid import VmidAllocator
+
+
+# Storage types able to hold linked clones. dir like storages need qcow2 disks.
+LINKED_CLONE_STORAGE = {'lvmthin', 'zfspool', 'rbd', 'btrfs', 'dir', 'nfs', 'cifs',
+                        'glusterfs', 'cephfs'}
+QCOW2_ONLY_STORAGE = {'dir', 'nfs', 'cifs', 'glusterfs', 'cephfs'}
+DISK_KEYS = ('ide', 'sata', 'scsi', 'virtio', 'efidisk', 'tpmstate')
+
+
+def disk_storages(config):
+    """Storage ids used by the disks of a VM config, {storage: [volume, ...]}."""
+    storages = {}
+    for key, value in config.items():
+        if not key.startswith(DISK_KEYS) or not isinstance(value, str) or 'media=cdrom' in value:
+            continue
+        volume = value.split(',', 1)[0]
+        if ':' in volume:
+            storages.setdefault(volume.split(':', 1)[0], []).append(volume)
+    return storages
+
+
+class ClonePipeline:
+    """
+    Clone templates at high throughput.
+
+    template_concurrency, storage_concurrency and cluster_concurrency bound
+    the clone tasks in flight per template, per storage and for the cluster.
+    Full clones of a template lock it, so a low template_concurrency matters
+    for them; linked clones are cheap and mostly bound by the storage.
+    adaptive: an AdaptiveLimiter setting the per storage limits instead of
+    storage_concurrency. close() it (or use it in a with block) once done.
+    """
+    def __init__(self, prox, template_concurrency=2, storage_concurrency=4,
+                 cluster_concurrency=16, tracker=None, workers=8, allocator=None,
+                 adaptive=None):
+        self.prox = prox
+        self.allocator = allocator or VmidAllocator(prox)
+        self.tracker = tracker or TaskTracker(prox)
+        self.dispatcher = TaskDispatcher({'template': template_concurrency,
+                                          'storage': storage_concurrency,
+                                          'cluster': cluster_concurrency}, workers,
+                                         {'storage': adaptive} if adaptive else None)
+        self._configure = ThreadPoolExecutor(max_workers=workers)
+        # results of the clones launched and not yet configured
+        self._pending = set()
+        self._storage_types = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self, cancel=False):
+        """
+        Stop the threads once the queued clones are launched (or cancelled)
+        and the launched ones configured.
+        """
+        self.dispatcher.close(cancel)
+        wait(list(self._pending))
+        self._configure.shutdown()
+
+    def storage_types(self):
+        """Storage types by storage id, read once."""
+        if self._storage_types is None:
+            data = self.prox.connect('get', 'storage', None)
+            self._storage_types = {storage['storage']: storage.get('type')
+                                   for storage in (data or {}).get('data') or []}
+        return self._storage_types
+
+    def can_link(self, config):
+        """True if a linked clone can be made from a template config."""
+        if str(config.get('template')) != '1':
+            return False
+        types = self.storage_types()
+        for storage, volumes in disk_storages(config).items():
+            storage_type = types.get(storage)
+            if storage_type not in LINKED_CLONE_STORAGE:
+                return False
+            if storage_type in QCOW2_ONLY_STORAGE and \
+                    not all(volume.endswith('.qcow2') for volume in volumes):
+                return False
+        return True
+
+    def clone(self, node, template, names, config=None, storage=None, full=None,
+              post_data=None, tenant=None):
+        """
+        Clone template once per name. Returns a BulkResult keyed by new vmid.
+
+        config: options applied to each clone once created (a dict, or a
+                function taking (newid, name) and returning a dict)
+        storage: target storage of full clones
+        full: force full (True) or linked (False) clones, default is linked
+              when possible
+        post_data: extra clone parameters (pool, target, description...)
+        tenant: allocator range to take the new vmids from
+        """
+        names = list(names)
+        template_config = json.loads(self.prox.get_virtual_config(node, template))['data']
+        if full is None:
+            full = storage is not None or not self.can_link(template_config)
+        if full and storage:
+            slot_storage = storage
+        else:
+            slot_storage = ','.join(sorted(disk_storages(template_config)))
+
+        futures = {}
+        for newid, name in zip(self.allocator.allocate_many(len(names), tenant), names):
+            clone_data = dict(post_data or {}, newid=newid, name=name, full=1 if full else 0)
+            if full and storage:
+                clone_data['storage'] = storage
+            task = self.dispatcher.submit(self._launcher(node, template, clone_data),
+                                          [('template', '{}/{}'.format(node, template)),
+                                           ('storage', slot_storage), ('cluster', '')])
+            futures[newid] = self._then_configure(task, clone_data.get('target', node),
+                                                  newid, name, config)
+        return BulkResult(futures)
+
+    def _launcher(self, node, template, clone_data):
+        def launch():
+            return self.prox.clone_virtual_machine(node, template, clone_data,
+                                                   future=self.tracker)
+        return launch
+
+    def _then_configure(self, task, node, newid, name, config):
+        """Future resolved once the clone and its configuration are done."""
+        result = Future()
+
+        def cloned(done):
+            if done.cancelled():
+                self.allocator.release(newid)
+                result.cancel()
+            elif done.exception() is not None:
+                if 'already exists' in str(done.exception()):
+                    self.allocator.report_collision(newid)
+                else:
+                    self.allocator.release(newid)
+                result.set_exception(done.exception())
+            elif done.result().get('exitstatus') != 'OK':
+                if 'already exists' in str(done.result().get('exitstatus')):
+                    self.allocator.report_collision(newid)
+                else:
+                    self.allocator.release(newid)
+                result.set_result(done.result())
+            elif not config:
+                self.allocator.confirm(newid)
+                result.set_result(done.result())
+            else:
+                self.allocator.confirm(newid)
+                self._configure.submit(configure, done.result())
+
+        def configure(status):
+            options = config(newid, name) if callable(config) else config
+            try:
+                answer = json.loads(self.prox.set_virtual_machine_options(node, newid, options))
+            except Exception as error:  # pylint: disable=broad-except
+                result.set_exception(error)
+                return
+            if not answer['status']['ok']:
+                result.set_exception(AssertionError('Clone Error: config of {} failed: \n {}'
+                                                    .format(newid, answer['status'])))
+            else:
+                result.set_result(status)
+
+        self._pending.add(result)
+        result.add_done_callback(self._pending.discard)
+        task.add_done_callback(cloned)
+        return result
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test proxmox api access."""
+
+import sys
+import pathlib
+from configparser import ConfigParser
+from urllib3 import disable_warnings
+from urllib3.exceptions import InsecureRequestWarning
+from pyproxmox3 import ProxAuth, PyProxmox, ClonePipeline
+
+# Read conf.ini
+INI_CONF = "./proxmox_api.ini"
+
+if not pathlib.Path(INI_CONF).exists():
+    print("Config file not found!")
+    print("Need the config file in {}".format(INI_CONF))
+    sys.exit(1)
+
+CONFIG = ConfigParser()
+CONFIG.read(INI_CONF)
+
+# DB parameters
+URL = CONFIG.get('api', 'ipaddress')
+USERAPI = CONFIG.get('api', 'user')
+PASSWORD = CONFIG.get('api', 'passwd')
+NODE = CONFIG.get('api', 'node')
+
+disable_warnings(InsecureRequestWarning)
+
+INIT_AUTHENT = ProxAuth(URL, USERAPI, PASSWORD)
+
+PROXMOX_EXEC = PyProxmox(INIT_AUTHENT)
+
+TEMPLATE = '9000'
+NAMES = ['test{:03}.example.org'.format(i) for i in range(100)]
+
+with ClonePipeline(PROXMOX_EXEC, template_concurrency=2, storage_concurrency=4) as PIPELINE:
+    RESULT = PIPELINE.clone(NODE, TEMPLATE, NAMES, config={'cores': 2, 'memory': 2048})
+    DONE, NOT_DONE = RESULT.wait()
+print(RESULT)
+print("New VMIDs : {}".format(sorted(RESULT.futures)))
+print("Failed : {}".format(RESULT.failed()))
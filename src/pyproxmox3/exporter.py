@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus / OpenMetrics exporter.
+
+All guest, node and storage metrics come from a single 'cluster/resources'
+call, plus 'get_node_status' for each node refreshed less often. A
+background thread refreshes the metrics and scrapes are served from that
+cache, so the scrape rate has no effect on pveproxy.
+
+Run it with the same ini file as the examples:
+
+pyproxmox3-exporter --config proxmox_api.ini --port 9221 --interval 30
+python -m pyproxmox3.exporter --config proxmox_api.ini
+"""
+
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from . import ProxAuth, PyProxmox
+from .priority import BACKGROUND, priority
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# (metric, type, help, resource field) for guests, nodes and storages
+GUEST_METRICS = (
+    ('pve_guest_up', 'gauge', 'Guest is running', None),
+    ('pve_guest_cpu_ratio', 'gauge', 'Guest cpu usage, 1 is one full core', 'cpu'),
+    ('pve_guest_cpus', 'gauge', 'Guest cpu count', 'maxcpu'),
+    ('pve_guest_memory_bytes', 'gauge', 'Guest memory usage', 'mem'),
+    ('pve_guest_memory_max_bytes', 'gauge', 'Guest memory size', 'maxmem'),
+    ('pve_guest_disk_max_bytes', 'gauge', 'Guest disk size', 'maxdisk'),
+    ('pve_guest_uptime_seconds', 'gauge', 'Guest uptime', 'uptime'),
+    ('pve_guest_network_receive_bytes', 'counter', 'Guest network bytes received', 'netin'),
+    ('pve_guest_network_transmit_bytes', 'counter', 'Guest network bytes sent', 'netout'),
+    ('pve_guest_disk_read_bytes', 'counter', 'Guest disk bytes read', 'diskread'),
+    ('pve_guest_disk_write_bytes', 'counter', 'Guest disk bytes written', 'diskwrite'),
+)
+NODE_METRICS = (
+    ('pve_node_up', 'gauge', 'Node is online', None),
+    ('pve_node_cpu_ratio', 'gauge', 'Node cpu usage, 1 is all cores', 'cpu'),
+    ('pve_node_cpus', 'gauge', 'Node cpu count', 'maxcpu'),
+    ('pve_node_memory_bytes', 'gauge', 'Node memory usage', 'mem'),
+    ('pve_node_memory_max_bytes', 'gauge', 'Node memory size', 'maxmem'),
+    ('pve_node_disk_bytes', 'gauge', 'Node root disk usage', 'disk'),
+    ('pve_node_disk_max_bytes', 'gauge', 'Node root disk size', 'maxdisk'),
+    ('pve_node_uptime_seconds', 'gauge', 'Node uptime', 'uptime'),
+)
+STORAGE_METRICS = (
+    ('pve_storage_up', 'gauge', 'Storage is available', None),
+    ('pve_storage_used_bytes', 'gauge', 'Storage usage', 'disk'),
+    ('pve_storage_size_bytes', 'gauge', 'Storage size', 'maxdisk'),
+)
+
+
+def escape(value):
+    """Escape a label value."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**values):
+    """Render a label set."""
+    return '{' + ','.join('{}="{}"'.format(key, escape(value))
+                          for key, value in values.items()) + '}'
+
+
+def render_family(lines, name, kind, doc, samples):
+    """Append one metric family to lines. samples: list of (labels, value)."""
+    lines.append('# TYPE {} {}'.format(name, kind))
+    lines.append('# HELP {} {}'.format(name, doc))
+    suffix = '_total' if kind == 'counter' else ''
+    for label_set, value in samples:
+        lines.append('{}{}{} {}'.format(name, suffix, label_set, _number(value)))
+
+
+def _number(value):
+    """A sample value as OpenMetrics text: NaN, +Inf and -Inf spelled its way."""
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+class ProxmoxExporter:
+    """
+    Build the cluster metrics in the background and serve them.
+
+    interval: seconds between two 'cluster/resources' sweeps
+    node_status_interval: seconds between two 'get_node_status' of a node
+    collectors: objects whose openmetrics() lines are added to every scrape,
+    such as AdaptiveLimiter
+    Sweeps are sent with the 'background' priority class.
+    """
+    def __init__(self, prox, interval=30, node_status_interval=120, collectors=None):
+        self.prox = prox
+        self.collectors = list(collectors or [])
+        self.interval = interval
+        self.node_status_interval = node_status_interval
+        self.node_status = {}
+        self._body = b''
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.refresh_duration = 0.0
+        self.last_refresh = 0.0
+        self.refresh_errors = 0
+        self.scrapes = 0
+        self.scrape_seconds = 0.0
+
+    def refresh(self):
+        """Run one sweep and render the cached metrics."""
+        start = time.monotonic()
+        data = self.prox.connect('get', 'cluster/resources', None)
+        resources = (data or {}).get('data')
+        if not isinstance(resources, list):
+            raise AssertionError('Exporter Error: no cluster resources: \n {}'.format(
+                (data or {}).get('status')))
+        self._refresh_node_status(resources)
+        body = self.render(resources)
+        with self._lock:
+            self._body = body
+            self.refresh_duration = time.monotonic() - start
+            self.last_refresh = time.time()
+
+    def _refresh_node_status(self, resources):
+        now = time.monotonic()
+        for resource in resources:
+            if resource.get('type') != 'node' or resource.get('status') != 'online':
+                continue
+            node = resource['node']
+            cached = self.node_status.get(node)
+            if cached and now - cached[0] < self.node_status_interval:
+                continue
+            try:
+                status = json.loads(self.prox.get_node_status(node))['data']
+            except (TypeError, KeyError, ValueError):
+                continue
+            if isinstance(status, dict):
+                self.node_status[node] = (now, status)
+
+    def render(self, resources):
+        """OpenMetrics text (without the exporter metrics) for a resources list."""
+        guests = [res for res in resources if res.get('type') in ('qemu', 'lxc')
+                  and not res.get('template')]
+        nodes = [res for res in resources if res.get('type') == 'node']
+        storages = [res for res in resources if res.get('type') == 'storage']
+        guest_labels = [labels(vmid=guest['vmid'], name=guest.get('name', ''),
+                               node=guest.get('node', ''), type=guest['type'])
+                        for guest in guests]
+        lines = []
+        for name, kind, doc, field in GUEST_METRICS:
+            samples = []
+            for guest, label_set in zip(guests, guest_labels):
+                if field is None:
+                    samples.append((label_set, int(guest.get('status') == 'running')))
+                elif field in guest:
+                    samples.append((label_set, guest[field]))
+            render_family(lines, name, kind, doc, samples)
+        for name, kind, doc, field in NODE_METRICS:
+            samples = []
+            for node in nodes:
+                label_set = labels(node=node['node'])
+                if field is None:
+                    samples.append((label_set, int(node.get('status') == 'online')))
+                elif field in node:
+                    samples.append((label_set, node[field]))
+            render_family(lines, name, kind, doc, samples)
+        self._render_node_status(lines)
+        for name, kind, doc, field in STORAGE_METRICS:
+            samples = []
+            for storage in storages:
+                label_set = labels(node=storage['node'], storage=storage['storage'])
+                if field is None:
+                    samples.append((label_set, int(storage.get('status') == 'available')))
+                elif field in storage:
+                    samples.append((label_set, storage[field]))
+            render_family(lines, name, kind, doc, samples)
+        return ('\n'.join(lines) + '\n').encode()
+
+    def _render_node_status(self, lines):
+        load = []
+        swap = []
+        swap_max = []
+        for node, (_, status) in sorted(self.node_status.items()):
+            for position, value in enumerate(status.get('loadavg') or []):
+                load.append((labels(node=node, period=('1m', '5m', '15m')[position]),
+                             float(value)))
+            if 'swap' in status:
+                swap.append((labels(node=node), status['swap'].get('used', 0)))
+                swap_max.append((labels(node=node), status['swap'].get('total', 0)))
+        render_family(lines, 'pve_node_load', 'gauge', 'Node load average', load)
+        render_family(lines, 'pve_node_swap_bytes', 'gauge', 'Node swap usage', swap)
+        render_family(lines, 'pve_node_swap_max_bytes', 'gauge', 'Node swap size', swap_max)
+
+    def scrape(self):
+        """The body served to a scrape: cached metrics, exporter metrics, EOF."""
+        start = time.monotonic()
+        with self._lock:
+            body = self._body
+            lines = []
+            render_family(lines, 'pve_exporter_refresh_duration_seconds', 'gauge',
+                          'Duration of the last cluster sweep', [('', self.refresh_duration)])
+            render_family(lines, 'pve_exporter_last_refresh_timestamp_seconds', 'gauge',
+                          'Time of the last successful cluster sweep', [('', self.last_refresh)])
+            render_family(lines, 'pve_exporter_refresh_errors', 'counter',
+                          'Failed cluster sweeps', [('', self.refresh_errors)])
+            lines.append('# TYPE pve_exporter_scrape_duration_seconds summary')
+            lines.append('# HELP pve_exporter_scrape_duration_seconds Time spent serving scrapes')
+            lines.append('pve_exporter_scrape_duration_seconds_count {}'.format(self.scrapes))
+            lines.append('pve_exporter_scrape_duration_seconds_sum {}'.format(
+                repr(self.scrape_seconds)))
+            instrumentation = getattr(self.prox, 'instrumentation', None)
+            if instrumentation is not None and instrumentation.enabled:
+                lines.extend(instrumentation.openmetrics())
+            for collector in self.collectors:
+                lines.extend(collector.openmetrics())
+            lines.append('# EOF')
+            self.scrapes += 1
+            self.scrape_seconds += time.monotonic() - start
+        return body + ('\n'.join(lines) + '\n').encode()
+
+    def start(self):
+        """Refresh in a background thread every interval seconds."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='exporter-refresh')
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background refresh."""
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                with priority(BACKGROUND):
+                    self.refresh()
+            except Exception as error:  # pylint: disable=broad-except
+                self.refresh_errors += 1
+                print("Exporter refresh failed: {}".format(error))
+            if self._stop.wait(self.interval):
+                return
+
+    def serve(self, host='', port=9221):
+        """Start the refresh thread and serve /metrics forever."""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Serve the cached metrics."""
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Answer /metrics."""
+                if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = exporter.scrape()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self.start()
+        server = ThreadingHTTPServer((host, port), Handler)
+        try:
+            server.serve_forever()
+        finally:
+            self.stop()
+            server.server_close()
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Proxmox OpenMetrics exporter')
+    parser.add_argument('--config', default='./proxmox_api.ini',
+                        help='ini file with an [api] section (ipaddress, user, passwd)')
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=9221)
+    parser.add_argument('--interval', type=float, default=30,
+                        help='seconds between two cluster sweeps')
+    parser.add_argument('--node-status-interval', type=float, default=120,
+                        help='seconds between two node status reads')
+    args = parser.parse_args(argv)
+
+    config = ConfigParser()
+    if not config.read(args.config):
+        print("Config file not found!")
+        print("Need the config file in {}".format(args.config))
+        return 1
+    auth = ProxAuth(config.get('api', 'ipaddress'), config.get('api', 'user'),
+                    config.get('api', 'passwd'))
+    exporter = ProxmoxExporter(PyProxmox(auth), args.interval, args.node_status_interval)
+    exporter.serve(args.host, args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
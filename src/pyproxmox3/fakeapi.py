@@ -0,0 +1,1036 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-process stand-in for the Proxmox API, for tests and benchmarks.
+
+FakeCluster is an in-memory cluster (nodes, guests, storages, tasks)
+answering the endpoints this library wraps; FakeProxmoxServer serves it
+over HTTP(S) from a background thread:
+
+cluster = FakeCluster(nodes=3, guests_per_node=20, task_duration=0.5)
+with FakeProxmoxServer(cluster, latency=0.005) as server:
+    b = server.client()              # a PyProxmox logged in as root@pam
+    b.get_cluster_resources()
+    server.inject('status/start', code=500, count=3)
+
+Tasks complete asynchronously: a task started by a request is 'running'
+until task_duration seconds have passed, then its effect (guest started,
+migrated, cloned...) is applied.
+
+It also runs standalone:
+
+python -m pyproxmox3.fakeapi --port 8006 --nodes 4 --guests-per-node 50
+"""
+
+import re
+import ssl
+import sys
+import json
+import math
+import time
+import heapq
+import random
+import argparse
+import threading
+from collections import deque
+from urllib.parse import urlsplit, parse_qsl, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_USERS = {'root@pam': 'secret'}
+GIB = 1024 ** 3
+MIB = 1024 ** 2
+RRD_STEPS = {'hour': 60, 'day': 1200, 'week': 10800, 'month': 43200, 'year': 604800}
+RRD_SAMPLES = 70
+
+
+class ApiError(Exception):
+    """An error answered by the API with an HTTP status code."""
+    def __init__(self, code, reason, errors=None):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+        self.errors = errors
+
+
+class Page(list):
+    """A list answered with a 'total' next to 'data', like the task log."""
+    def __init__(self, items, total):
+        super().__init__(items)
+        self.total = total
+
+
+class FakeTask:
+    """A worker task of the fake cluster."""
+    __slots__ = ('upid', 'node', 'type', 'id', 'user', 'pid', 'starttime', 'done_at',
+                 'endtime', 'exitstatus', 'log', 'log_at', 'effect')
+
+    def __init__(self, upid, node, task_type, task_id, user, pid, starttime, done_at, effect,
+                 log_at=None):
+        self.upid = upid
+        self.node = node
+        self.type = task_type
+        self.id = task_id
+        self.user = user
+        self.pid = pid
+        self.starttime = starttime
+        self.done_at = done_at
+        self.endtime = None
+        self.exitstatus = None
+        self.log = ['starting task {}'.format(upid)]
+        # the log file is empty until then
+        self.log_at = starttime if log_at is None else log_at
+        self.effect = effect
+
+    def entry(self):
+        """The task as listed by 'nodes/{node}/tasks'."""
+        entry = {'upid': self.upid, 'node': self.node, 'type': self.type, 'id': self.id,
+                 'user': self.user, 'pid': self.pid, 'pstart': self.pid,
+                 'starttime': self.starttime}
+        if self.endtime is not None:
+            entry['endtime'] = self.endtime
+            entry['status'] = self.exitstatus
+        return entry
+
+    def status(self):
+        """The task status answered by 'nodes/{node}/tasks/{upid}/status'."""
+        status = self.entry()
+        if self.endtime is None:
+            status['status'] = 'running'
+        else:
+            status['status'] = 'stopped'
+            status['exitstatus'] = self.exitstatus
+        return status
+
+
+class FakeCluster:
+    """
+    A stateful in-memory Proxmox cluster.
+
+    nodes: number of nodes (named pve1, pve2...), guests_per_node: guests
+    created on each, lxc_ratio: share of them being containers.
+    task_duration: seconds a task runs, a float or a {task type: seconds}
+    dict ('default' key for the others). task_failure_rate: share of the
+    tasks ending in error. agent_failure_rate: share of the guests whose
+    agent is enabled but not running, agent_hang_rate: share of those whose
+    agent hangs (see FakeProxmoxServer hang). task_history: finished tasks
+    kept. log_delay: seconds a new task log stays empty (answered with the
+    'no content' line, as pveproxy does), capped by the task duration.
+    """
+    def __init__(self, nodes=3, guests_per_node=10, lxc_ratio=0.3, task_duration=0.5,
+                 task_failure_rate=0.0, agent_failure_rate=0.1, agent_hang_rate=0.0,
+                 task_history=10000, users=None, seed=0, log_delay=0.1):
+        self.task_duration = task_duration
+        self.log_delay = log_delay
+        self.task_failure_rate = task_failure_rate
+        self.task_history = task_history
+        self.users = dict(DEFAULT_USERS if users is None else users)
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.nodes = {}
+        self.guests = {}
+        self.storages = {'local': {'storage': 'local', 'type': 'dir', 'shared': 0,
+                                   'content': 'iso,vztmpl,backup', 'total': 100 * GIB},
+                         'local-lvm': {'storage': 'local-lvm', 'type': 'lvmthin', 'shared': 0,
+                                       'content': 'images,rootdir', 'total': 500 * GIB},
+                         'ceph': {'storage': 'ceph', 'type': 'rbd', 'shared': 1,
+                                  'content': 'images,rootdir', 'total': 10240 * GIB}}
+        self.tasks = {}
+        self.tickets = {}
+        self._pending = []
+        self._finished = deque()
+        self._pid = 0x1000
+        self.started = time.time()
+        for index in range(1, nodes + 1):
+            self.add_node('pve{}'.format(index))
+        vmid = 100
+        for node in list(self.nodes):
+            for _ in range(guests_per_node):
+                kind = 'lxc' if self.random.random() < lxc_ratio else 'qemu'
+                draw = self.random.random()
+                agent = 'ok'
+                if draw < agent_hang_rate:
+                    agent = 'hung'
+                elif draw < agent_hang_rate + agent_failure_rate:
+                    agent = 'missing'
+                self.add_guest(vmid, node, kind, status='running' if self.random.random() < 0.8
+                               else 'stopped', agent=agent)
+                vmid += 1
+
+    # Model
+    def add_node(self, name, maxcpu=32, maxmem=256 * GIB):
+        """Add an online node."""
+        with self.lock:
+            self.nodes[name] = {'node': name, 'status': 'online', 'maxcpu': maxcpu,
+                                'maxmem': maxmem, 'maxdisk': 100 * GIB, 'disk': 10 * GIB,
+                                'index': len(self.nodes) + 1}
+
+    def add_guest(self, vmid, node, kind='qemu', status='stopped', name=None, cores=2,
+                  memory=2048, template=0, agent='ok', config=None):
+        """
+        Add a guest. agent is 'ok', 'missing' (enabled, not running), 'hung'
+        or 'off' (disabled in the config).
+        """
+        with self.lock:
+            mac = 'BC:24:11:{:02X}:{:02X}:{:02X}'.format((vmid >> 16) & 0xFF,
+                                                         (vmid >> 8) & 0xFF, vmid & 0xFF)
+            address = self.address(node, vmid)
+            guest_config = {'name' if kind == 'qemu' else 'hostname': name or
+                            '{}-{}'.format('vm' if kind == 'qemu' else 'ct', vmid),
+                            'cores': cores, 'memory': memory, 'digest': '0' * 40}
+            if kind == 'qemu':
+                guest_config.update({'net0': 'virtio={},bridge=vmbr0'.format(mac),
+                                     'scsi0': 'ceph:vm-{}-disk-0,size=32G'.format(vmid),
+                                     'scsihw': 'virtio-scsi-pci', 'ostype': 'l26',
+                                     'agent': '0' if agent == 'off' else '1'})
+            else:
+                guest_config.update({'net0': 'name=eth0,bridge=vmbr0,hwaddr={},ip={}/16,'
+                                             'gw=10.0.0.1'.format(mac, address),
+                                     'rootfs': 'ceph:vm-{}-disk-0,size=8G'.format(vmid),
+                                     'ostype': 'debian'})
+            if template:
+                guest_config['template'] = 1
+            guest_config.update(config or {})
+            self.guests[vmid] = {'vmid': vmid, 'node': node, 'type': kind, 'status': status,
+                                 'template': template, 'agent': agent, 'mac': mac,
+                                 'address': address, 'config': guest_config,
+                                 'snapshots': ['current'], 'started': time.time()}
+
+    @staticmethod
+    def address(node, vmid):
+        """The IPv4 address of a guest: 10.<node index>.x.y."""
+        index = int(re.sub(r'\D', '', node) or 0) % 256
+        return '10.{}.{}.{}'.format(index, (vmid >> 8) & 0xFF, vmid & 0xFF)
+
+    def guest(self, node, vmid, kind=None):
+        """A guest on a node, ApiError 500 like pveproxy if it is not there."""
+        guest = self.guests.get(int(vmid))
+        if guest is None or guest['node'] != node or (kind and guest['type'] != kind):
+            raise ApiError(500, "Configuration file 'nodes/{}/{}/{}.conf' does not exist".format(
+                node, 'qemu-server' if kind == 'qemu' else 'lxc', vmid))
+        return guest
+
+    def node(self, node):
+        """A node, ApiError 595 if unknown or offline."""
+        if node not in self.nodes or self.nodes[node]['status'] != 'online':
+            raise ApiError(595, "no such cluster node '{}'".format(node))
+        return self.nodes[node]
+
+    def guest_usage(self, guest, now):
+        """Deterministic live usage of a guest."""
+        running = guest['status'] == 'running'
+        vmid = guest['vmid']
+        config = guest['config']
+        maxmem = int(config.get('memory', 512)) * MIB
+        wave = (math.sin(now / 60.0 + vmid) + 1) / 2
+        return {'cpu': (0.05 + 0.5 * wave) if running else 0,
+                'maxcpu': int(config.get('cores', 1)),
+                'mem': int(maxmem * (0.3 + 0.4 * wave)) if running else 0,
+                'maxmem': maxmem, 'disk': 0, 'maxdisk': 32 * GIB,
+                'netin': int((now - self.started) * 1000 * (vmid % 7 + 1)) if running else 0,
+                'netout': int((now - self.started) * 500 * (vmid % 5 + 1)) if running else 0,
+                'diskread': int((now - self.started) * 4096 * (vmid % 3 + 1)) if running else 0,
+                'diskwrite': int((now - self.started) * 8192) if running else 0,
+                'uptime': int(now - guest['started']) if running else 0}
+
+    def node_usage(self, node, now):
+        """Usage of a node: the sum of its running guests."""
+        cpu = mem = 0
+        for guest in self.guests.values():
+            if guest['node'] == node['node'] and guest['status'] == 'running':
+                usage = self.guest_usage(guest, now)
+                cpu += usage['cpu'] * usage['maxcpu']
+                mem += usage['mem']
+        return {'cpu': min(1.0, cpu / node['maxcpu']), 'mem': mem + 4 * GIB,
+                'uptime': int(now - self.started) + 86400}
+
+    # Tasks
+    def start_task(self, node, task_type, task_id, user, effect=None, duration=None):
+        """Start a task, effect(task) is applied when it completes. Returns the UPID."""
+        now = time.time()
+        if duration is None:
+            duration = self.task_duration
+            if isinstance(duration, dict):
+                duration = duration.get(task_type, duration.get('default', 0.5))
+        self._pid += 1
+        upid = 'UPID:{}:{:08X}:{:08X}:{:08X}:{}:{}:{}:'.format(
+            node, self._pid, self._pid, int(now), task_type, task_id, user)
+        task = FakeTask(upid, node, task_type, str(task_id), user, self._pid, int(now),
+                        now + duration, effect, now + min(self.log_delay, duration))
+        self.tasks[upid] = task
+        heapq.heappush(self._pending, (task.done_at, self._pid, upid))
+        return upid
+
+    def settle(self, now=None):
+        """Complete the tasks whose time has come."""
+        now = time.time() if now is None else now
+        with self.lock:
+            while self._pending and self._pending[0][0] <= now:
+                _, _, upid = heapq.heappop(self._pending)
+                task = self.tasks.get(upid)
+                if task is None:
+                    continue
+                error = None
+                if self.task_failure_rate and self.random.random() < self.task_failure_rate:
+                    error = 'injected task failure'
+                elif task.effect is not None:
+                    try:
+                        task.effect(task)
+                    except ApiError as failure:
+                        error = failure.reason
+                task.exitstatus = 'OK' if error is None else error
+                task.endtime = int(now)
+                task.log.append('TASK OK' if error is None else 'TASK ERROR: {}'.format(error))
+                self._finished.append(upid)
+                while len(self._finished) > self.task_history:
+                    self.tasks.pop(self._finished.popleft(), None)
+
+    # Request dispatch
+    def handle(self, method, path, params, cookie=None, csrf=None):
+        """Answer one API request. Returns (code, reason, data dict) or raises ApiError."""
+        self.settle()
+        for route_method, pattern, handler in ROUTES:
+            if route_method != method:
+                continue
+            match = pattern.fullmatch(path)
+            if match is None:
+                continue
+            user = None
+            if handler != 'ticket':
+                user = self.check_ticket(cookie, csrf, method != 'GET')
+            with self.lock:
+                return getattr(self, 'api_' + handler)(params, user=user, **match.groupdict())
+        raise ApiError(501, "Method '{} /{}' not implemented".format(method, path))
+
+    def check_ticket(self, cookie, csrf=None, write=False):
+        """
+        The user of a valid ticket, ApiError 401 otherwise. write: the
+        request changes something and needs the CSRF token of the ticket.
+        """
+        entry = self.tickets.get(cookie)
+        if entry is None:
+            raise ApiError(401, 'No ticket')
+        if write and csrf != entry[1]:
+            raise ApiError(401, 'Permission denied - invalid csrf token')
+        return entry[0]
+
+    def api_ticket(self, params, user=None):
+        """POST access/ticket"""
+        username = params.get('username')
+        if self.users and self.users.get(username) != params.get('password'):
+            raise ApiError(401, 'authentication failure')
+        ticket = 'PVE:{}:{:08X}::{:032x}'.format(username, int(time.time()),
+                                                 self.random.getrandbits(128))
+        csrf = '{:08X}:{:032x}'.format(int(time.time()), self.random.getrandbits(128))
+        self.tickets[ticket] = (username, csrf)
+        return {'ticket': ticket, 'CSRFPreventionToken': csrf, 'username': username}
+
+    def api_version(self, params, user=None):
+        """GET version"""
+        return {'version': '8.2.4', 'release': '8.2', 'repoid': 'fake'}
+
+    def api_cluster_status(self, params, user=None):
+        """GET cluster/status"""
+        status = [{'type': 'cluster', 'id': 'cluster', 'name': 'fake', 'nodes': len(self.nodes),
+                   'quorate': 1, 'version': 1}]
+        for node in self.nodes.values():
+            status.append({'type': 'node', 'id': 'node/' + node['node'], 'name': node['node'],
+                           'nodeid': node['index'], 'online': int(node['status'] == 'online'),
+                           'local': int(node['index'] == 1),
+                           'ip': '192.168.0.{}'.format(node['index'])})
+        return status
+
+    def api_cluster_resources(self, params, user=None):
+        """GET cluster/resources"""
+        kind = params.get('type')
+        now = time.time()
+        resources = []
+        if kind in (None, 'node'):
+            for node in self.nodes.values():
+                entry = {'id': 'node/' + node['node'], 'type': 'node', 'node': node['node'],
+                         'status': node['status'], 'maxcpu': node['maxcpu'],
+                         'maxmem': node['maxmem'], 'disk': node['disk'],
+                         'maxdisk': node['maxdisk'], 'level': ''}
+                if node['status'] == 'online':
+                    entry.update(self.node_usage(node, now))
+                resources.append(entry)
+        if kind in (None, 'vm'):
+            for guest in self.guests.values():
+                entry = {'id': '{}/{}'.format(guest['type'], guest['vmid']),
+                         'type': guest['type'], 'vmid': guest['vmid'], 'node': guest['node'],
+                         'name': guest['config'].get('name', guest['config'].get('hostname')),
+                         'status': guest['status'], 'template': guest['template']}
+                entry.update(self.guest_usage(guest, now))
+                resources.append(entry)
+        if kind in (None, 'storage'):
+            for node in self.nodes.values():
+                for storage in self.storages.values():
+                    resources.append({'id': 'storage/{}/{}'.format(node['node'],
+                                                                   storage['storage']),
+                                      'type': 'storage', 'node': node['node'],
+                                      'storage': storage['storage'], 'status': 'available',
+                                      'plugintype': storage['type'],
+                                      'content': storage['content'], 'shared': storage['shared'],
+                                      'maxdisk': storage['total'],
+                                      'disk': storage['total'] // 4})
+        return resources
+
+    def api_nextid(self, params, user=None):
+        """GET cluster/nextid"""
+        vmid = 100
+        while vmid in self.guests:
+            vmid += 1
+        return str(vmid)
+
+    def api_cluster_tasks(self, params, user=None):
+        """GET cluster/tasks"""
+        return [task.entry() for task in sorted(self.tasks.values(),
+                                                key=lambda task: -task.starttime)[:50]]
+
+    def api_storage(self, params, user=None):
+        """GET storage"""
+        return [{'storage': storage['storage'], 'type': storage['type'],
+                 'content': storage['content'], 'shared': storage['shared']}
+                for storage in self.storages.values()]
+
+    def api_nodes(self, params, user=None):
+        """GET nodes"""
+        now = time.time()
+        nodes = []
+        for node in self.nodes.values():
+            entry = {'node': node['node'], 'status': node['status'], 'maxcpu': node['maxcpu'],
+                     'maxmem': node['maxmem'], 'disk': node['disk'], 'maxdisk': node['maxdisk']}
+            entry.update(self.node_usage(node, now))
+            nodes.append(entry)
+        return nodes
+
+    def api_node_status(self, params, user=None, node=None):
+        """GET nodes/{node}/status"""
+        node = self.node(node)
+        usage = self.node_usage(node, time.time())
+        load = usage['cpu'] * node['maxcpu']
+        return {'cpu': usage['cpu'], 'uptime': usage['uptime'],
+                'loadavg': ['{:.2f}'.format(load), '{:.2f}'.format(load * 0.9),
+                            '{:.2f}'.format(load * 0.8)],
+                'memory': {'total': node['maxmem'], 'used': usage['mem'],
+                           'free': node['maxmem'] - usage['mem']},
+                'swap': {'total': 8 * GIB, 'used': 0, 'free': 8 * GIB},
+                'rootfs': {'total': node['maxdisk'], 'used': node['disk'],
+                           'free': node['maxdisk'] - node['disk']},
+                'cpuinfo': {'cpus': node['maxcpu'], 'sockets': 2, 'model': 'Fake CPU'},
+                'pveversion': 'pve-manager/8.2.4/fake'}
+
+    def api_node_rrddata(self, params, user=None, node=None):
+        """GET nodes/{node}/rrddata"""
+        node = self.node(node)
+        return self.rrddata(params, node['index'], {
+            'cpu': (0.3, 0.2), 'maxcpu': (node['maxcpu'], 0), 'memused': (node['maxmem'] / 2, 0.2),
+            'memtotal': (node['maxmem'], 0), 'loadavg': (4.0, 0.5), 'iowait': (0.01, 0.5),
+            'netin': (1e6, 0.5), 'netout': (5e5, 0.5), 'rootused': (node['disk'], 0),
+            'roottotal': (node['maxdisk'], 0)})
+
+    def api_node_storages(self, params, user=None, node=None):
+        """GET nodes/{node}/storage"""
+        self.node(node)
+        return [{'storage': storage['storage'], 'type': storage['type'],
+                 'content': storage['content'], 'shared': storage['shared'], 'active': 1,
+                 'enabled': 1, 'total': storage['total'], 'used': storage['total'] // 4,
+                 'avail': storage['total'] - storage['total'] // 4}
+                for storage in self.storages.values()]
+
+    def api_storage_status(self, params, user=None, node=None, storage=None):
+        """GET nodes/{node}/storage/{storage}/status"""
+        self.node(node)
+        if storage not in self.storages:
+            raise ApiError(500, "storage '{}' does not exist".format(storage))
+        entry = self.storages[storage]
+        return {'type': entry['type'], 'content': entry['content'], 'shared': entry['shared'],
+                'active': 1, 'enabled': 1, 'total': entry['total'],
+                'used': entry['total'] // 4, 'avail': entry['total'] - entry['total'] // 4}
+
+    def api_storage_content(self, params, user=None, node=None, storage=None):
+        """GET nodes/{node}/storage/{storage}/content"""
+        self.node(node)
+        if storage not in self.storages:
+            raise ApiError(500, "storage '{}' does not exist".format(storage))
+        return [{'volid': '{}:vm-{}-disk-0'.format(storage, guest['vmid']), 'format': 'raw',
+                 'size': 32 * GIB, 'vmid': guest['vmid'], 'content': 'images'}
+                for guest in self.guests.values() if guest['node'] == node or
+                self.storages[storage]['shared']]
+
+    def api_storage_rrddata(self, params, user=None, node=None, storage=None):
+        """GET nodes/{node}/storage/{storage}/rrddata"""
+        self.node(node)
+        if storage not in self.storages:
+            raise ApiError(500, "storage '{}' does not exist".format(storage))
+        total = self.storages[storage]['total']
+        return self.rrddata(params, len(storage), {'total': (total, 0), 'used': (total / 4, 0.1)})
+
+    def rrddata(self, params, seed, fields):
+        """RRD samples: fields maps a name to (base value, relative amplitude)."""
+        step = RRD_STEPS.get(params.get('timeframe', 'hour'), 60)
+        last = int(time.time()) // step * step
+        samples = []
+        for position in range(RRD_SAMPLES):
+            timestamp = last - (RRD_SAMPLES - 1 - position) * step
+            sample = {'time': timestamp}
+            wave = math.sin(timestamp / (step * 10.0) + seed)
+            for name, (base, amplitude) in fields.items():
+                sample[name] = base * (1 + amplitude * wave)
+            samples.append(sample)
+        return samples
+
+    def api_node_tasks(self, params, user=None, node=None):
+        """GET nodes/{node}/tasks"""
+        self.node(node)
+        source = params.get('source', 'archive')
+        vmid = params.get('vmid')
+        typefilter = params.get('typefilter')
+        entries = []
+        for task in self.tasks.values():
+            if task.node != node:
+                continue
+            if source == 'active' and task.endtime is not None:
+                continue
+            if source == 'archive' and task.endtime is None:
+                continue
+            if vmid is not None and task.id != str(vmid):
+                continue
+            if typefilter and task.type != typefilter:
+                continue
+            entries.append(task.entry())
+        entries.sort(key=lambda entry: -entry['starttime'])
+        start = int(params.get('start', 0))
+        return entries[start:start + int(params.get('limit', 50))]
+
+    def task(self, node, upid):
+        """A task, ApiError 500 if unknown."""
+        self.node(node)
+        task = self.tasks.get(upid)
+        if task is None or task.node != node:
+            raise ApiError(500, "no such task '{}'".format(upid))
+        return task
+
+    def api_task_status(self, params, user=None, node=None, upid=None):
+        """GET nodes/{node}/tasks/{upid}/status"""
+        return self.task(node, upid).status()
+
+    def api_task_log(self, params, user=None, node=None, upid=None):
+        """
+        GET nodes/{node}/tasks/{upid}/log. An empty log is answered with one
+        'no content' line and total 1, whatever start is.
+        """
+        task = self.task(node, upid)
+        start = int(params.get('start', 0))
+        limit = int(params.get('limit', 50))
+        log = task.log if time.time() >= task.log_at or task.endtime is not None else []
+        if not log:
+            return Page([{'n': 1, 't': 'no content'}], 1)
+        return Page([{'n': start + index + 1, 't': line}
+                     for index, line in enumerate(log[start:start + limit])], len(log))
+
+    def api_node_bulk(self, params, user=None, node=None, action=None):
+        """POST nodes/{node}/startall, stopall and migrateall"""
+        self.node(node)
+        vms = {int(vmid) for vmid in re.split(r'[,; ]+', str(params.get('vms', ''))) if vmid}
+        target = params.get('target')
+        if action == 'migrateall':
+            self.node(target)
+
+        def effect(task):
+            for guest in list(self.guests.values()):
+                if guest['node'] != node or guest['template'] or (vms and
+                                                                  guest['vmid'] not in vms):
+                    continue
+                if action == 'startall':
+                    self.set_power(guest, 'running')
+                elif action == 'stopall':
+                    self.set_power(guest, 'stopped')
+                else:
+                    guest['node'] = target
+                task.log.append('{} guest {}'.format(action, guest['vmid']))
+        return self.start_task(node, action, '', user, effect)
+
+    def api_guests(self, params, user=None, node=None, kind=None):
+        """GET nodes/{node}/qemu and nodes/{node}/lxc"""
+        self.node(node)
+        now = time.time()
+        guests = []
+        for guest in self.guests.values():
+            if guest['node'] == node and guest['type'] == kind:
+                entry = {'vmid': guest['vmid'], 'status': guest['status'],
+                         'name': guest['config'].get('name', guest['config'].get('hostname')),
+                         'template': guest['template']}
+                entry.update(self.guest_usage(guest, now))
+                guests.append(entry)
+        return guests
+
+    def api_create(self, params, user=None, node=None, kind=None):
+        """POST nodes/{node}/qemu and nodes/{node}/lxc"""
+        self.node(node)
+        vmid = int(params.get('vmid', 0))
+        if vmid < 100:
+            raise ApiError(400, 'Parameter verification failed.', {'vmid': 'invalid vmid'})
+        if vmid in self.guests:
+            raise ApiError(500, 'unable to create {} {}: config file already exists'.format(
+                'VM' if kind == 'qemu' else 'CT', vmid))
+        config = {key: value for key, value in params.items() if key not in ('vmid', 'node')}
+        self.add_guest(vmid, node, kind, name=params.get('name') or params.get('hostname'),
+                       cores=int(params.get('cores', 1)), memory=int(params.get('memory', 512)),
+                       config=config)
+        guest = self.guests[vmid]
+        guest['config']['lock'] = 'create'
+        return self.start_task(node, 'qmcreate' if kind == 'qemu' else 'vzcreate', vmid, user,
+                               lambda task: guest['config'].pop('lock', None))
+
+    def api_guest(self, params, user=None, node=None, kind=None, vmid=None):
+        """GET nodes/{node}/{kind}/{vmid}"""
+        self.guest(node, vmid, kind)
+        return [{'subdir': name} for name in ('config', 'status', 'rrddata', 'snapshot')]
+
+    def api_guest_status(self, params, user=None, node=None, kind=None, vmid=None):
+        """GET nodes/{node}/{kind}/{vmid}/status/current"""
+        guest = self.guest(node, vmid, kind)
+        status = {'vmid': guest['vmid'], 'status': guest['status'],
+                  'name': guest['config'].get('name', guest['config'].get('hostname')),
+                  'qmpstatus': guest['status'], 'template': guest['template']}
+        if kind == 'qemu':
+            status['agent'] = int(guest['agent'] != 'off')
+        status.update(self.guest_usage(guest, time.time()))
+        return status
+
+    def set_power(self, guest, status):
+        """Change the power state of a guest."""
+        if guest['status'] != 'running' and status == 'running':
+            guest['started'] = time.time()
+        guest['status'] = status
+
+    def api_guest_action(self, params, user=None, node=None, kind=None, vmid=None,
+                         action=None):
+        """POST nodes/{node}/{kind}/{vmid}/status/{action}"""
+        guest = self.guest(node, vmid, kind)
+        prefix = 'qm' if kind == 'qemu' else 'vz'
+        wanted = {'start': 'running', 'stop': 'stopped', 'shutdown': 'stopped',
+                  'reset': 'running', 'reboot': 'running', 'suspend': 'paused',
+                  'resume': 'running'}[action]
+
+        def effect(_):
+            if guest['template']:
+                raise ApiError(500, 'you cannot start a template')
+            if action == 'start' and guest['status'] == 'running':
+                raise ApiError(500, 'VM {} already running'.format(guest['vmid']))
+            if action in ('reset', 'suspend', 'resume', 'reboot') and \
+                    guest['status'] == 'stopped':
+                raise ApiError(500, 'VM {} not running'.format(guest['vmid']))
+            self.set_power(guest, wanted)
+        return self.start_task(node, prefix + action, guest['vmid'], user, effect)
+
+    def api_config(self, params, user=None, node=None, kind=None, vmid=None):
+        """GET nodes/{node}/{kind}/{vmid}/config"""
+        return dict(self.guest(node, vmid, kind)['config'])
+
+    def api_set_config(self, params, user=None, node=None, kind=None, vmid=None):
+        """PUT and POST nodes/{node}/{kind}/{vmid}/config"""
+        guest = self.guest(node, vmid, kind)
+        if guest['config'].get('lock'):
+            raise ApiError(500, "VM is locked ({})".format(guest['config']['lock']))
+        for key in str(params.get('delete', '')).split(','):
+            guest['config'].pop(key.strip(), None)
+        guest['config'].update({key: value for key, value in params.items()
+                                if key not in ('delete', 'digest')})
+        return None
+
+    def api_clone(self, params, user=None, node=None, kind=None, vmid=None):
+        """POST nodes/{node}/qemu/{vmid}/clone"""
+        source = self.guest(node, vmid, kind)
+        newid = int(params.get('newid', 0))
+        if newid in self.guests or newid < 100:
+            raise ApiError(500, 'unable to create VM {}: config file already exists'.format(newid))
+        target = params.get('target') or node
+        self.node(target)
+        config = dict(source['config'], name=params.get('name') or 'Copy-of-VM-{}'.format(vmid))
+        config.pop('template', None)
+        config.pop('net0', None)
+        self.add_guest(newid, target, kind, config=config)
+        clone = self.guests[newid]
+        clone['config']['lock'] = 'clone'
+        return self.start_task(node, 'qmclone', vmid, user,
+                               lambda task: clone['config'].pop('lock', None))
+
+    def api_migrate(self, params, user=None, node=None, kind=None, vmid=None):
+        """POST nodes/{node}/{kind}/{vmid}/migrate"""
+        guest = self.guest(node, vmid, kind)
+        target = params.get('target')
+        self.node(target)
+        if target == node:
+            raise ApiError(400, 'Parameter verification failed.',
+                           {'target': 'target is local node.'})
+        if guest['status'] == 'running' and kind == 'qemu' and not params.get('online'):
+            raise ApiError(500, "can't migrate running VM without --online")
+        if guest['status'] == 'running' and kind == 'lxc' and not (params.get('restart') or
+                                                                    params.get('online')):
+            raise ApiError(500, "can't migrate running container without --online or --restart")
+
+        def effect(task):
+            guest['node'] = target
+            task.log.append('migration finished successfully')
+        return self.start_task(node, 'qmigrate' if kind == 'qemu' else 'vzmigrate',
+                               guest['vmid'], user, effect)
+
+    def api_delete(self, params, user=None, node=None, kind=None, vmid=None):
+        """DELETE nodes/{node}/{kind}/{vmid}"""
+        guest = self.guest(node, vmid, kind)
+        if guest['status'] == 'running':
+            raise ApiError(500, 'VM {} is running - destroy failed'.format(vmid))
+
+        def effect(_):
+            self.guests.pop(guest['vmid'], None)
+        return self.start_task(node, 'qmdestroy' if kind == 'qemu' else 'vzdestroy',
+                               guest['vmid'], user, effect)
+
+    def api_guest_rrddata(self, params, user=None, node=None, kind=None, vmid=None):
+        """GET nodes/{node}/{kind}/{vmid}/rrddata"""
+        guest = self.guest(node, vmid, kind)
+        usage = self.guest_usage(guest, time.time())
+        return self.rrddata(params, guest['vmid'], {
+            'cpu': (usage['cpu'] or 0.01, 0.5), 'maxcpu': (usage['maxcpu'], 0),
+            'mem': (usage['mem'], 0.2), 'maxmem': (usage['maxmem'], 0),
+            'netin': (1e4 * (guest['vmid'] % 7 + 1), 0.5), 'netout': (5e3, 0.5),
+            'diskread': (4096, 0.5), 'diskwrite': (8192, 0.5), 'maxdisk': (usage['maxdisk'], 0)})
+
+    def api_snapshots(self, params, user=None, node=None, kind=None, vmid=None):
+        """GET nodes/{node}/{kind}/{vmid}/snapshot"""
+        guest = self.guest(node, vmid, kind)
+        return [{'name': name, 'description': ''} for name in guest['snapshots']]
+
+    def api_agent(self, params, user=None, node=None, vmid=None, command=None):
+        """GET and POST nodes/{node}/qemu/{vmid}/agent/{command}"""
+        guest = self.guest(node, vmid, 'qemu')
+        if guest['agent'] == 'off' or str(guest['config'].get('agent', '0'))[:1] == '0':
+            raise ApiError(500, 'No QEMU guest agent configured')
+        if guest['status'] != 'running' or guest['agent'] == 'missing':
+            raise ApiError(500, 'QEMU guest agent is not running')
+        if command == 'network-get-interfaces':
+            result = [{'name': 'lo', 'hardware-address': '00:00:00:00:00:00',
+                       'ip-addresses': [{'ip-address': '127.0.0.1', 'ip-address-type': 'ipv4',
+                                         'prefix': 8},
+                                        {'ip-address': '::1', 'ip-address-type': 'ipv6',
+                                         'prefix': 128}]},
+                      {'name': 'eth0', 'hardware-address': guest['mac'].lower(),
+                       'ip-addresses': [{'ip-address': guest['address'],
+                                         'ip-address-type': 'ipv4', 'prefix': 16},
+                                        {'ip-address': 'fd00::{:x}'.format(guest['vmid']),
+                                         'ip-address-type': 'ipv6', 'prefix': 64}]}]
+        elif command == 'get-osinfo':
+            result = {'id': 'debian', 'name': 'Debian GNU/Linux', 'version-id': '12',
+                      'kernel-release': '6.1.0-18-amd64', 'machine': 'x86_64'}
+        elif command == 'get-fsinfo':
+            result = [{'name': 'sda1', 'mountpoint': '/', 'type': 'ext4',
+                       'total-bytes': 32 * GIB, 'used-bytes': 8 * GIB,
+                       'disk': [{'serial': 'drive-scsi0', 'bus-type': 'scsi'}]}]
+        elif command in ('ping', 'fsfreeze-status', 'info', 'get-host-name', 'get-time'):
+            result = {'get-host-name': {'host-name': guest['config'].get('name', '')},
+                      'get-time': int(time.time() * 1e9),
+                      'fsfreeze-status': 'thawed'}.get(command, {})
+        else:
+            raise ApiError(501, "Method '{}' not implemented".format(command))
+        return {'result': result}
+
+
+def _route(method, path, handler):
+    path = (path.replace('{node}', '(?P<node>[^/]+)')
+            .replace('{vmid}', r'(?P<vmid>\d+)')
+            .replace('{kind}', '(?P<kind>qemu|lxc)')
+            .replace('{storage}', '(?P<storage>[^/]+)')
+            .replace('{upid}', '(?P<upid>UPID:[^/]+)'))
+    return (method, re.compile(path), handler)
+
+
+ROUTES = [
+    _route('POST', 'access/ticket', 'ticket'),
+    _route('GET', 'version', 'version'),
+    _route('GET', 'cluster/status', 'cluster_status'),
+    _route('GET', 'cluster/resources', 'cluster_resources'),
+    _route('GET', 'cluster/nextid', 'nextid'),
+    _route('GET', 'cluster/tasks', 'cluster_tasks'),
+    _route('GET', 'storage', 'storage'),
+    _route('GET', 'nodes', 'nodes'),
+    _route('GET', 'nodes/{node}/status', 'node_status'),
+    _route('GET', 'nodes/{node}/rrddata', 'node_rrddata'),
+    _route('GET', 'nodes/{node}/storage', 'node_storages'),
+    _route('GET', 'nodes/{node}/storage/{storage}/status', 'storage_status'),
+    _route('GET', 'nodes/{node}/storage/{storage}/content', 'storage_content'),
+    _route('GET', 'nodes/{node}/storage/{storage}/rrddata', 'storage_rrddata'),
+    _route('GET', 'nodes/{node}/tasks', 'node_tasks'),
+    _route('GET', 'nodes/{node}/tasks/{upid}(?:/status)?', 'task_status'),
+    _route('GET', 'nodes/{node}/tasks/{upid}/log', 'task_log'),
+    _route('POST', 'nodes/{node}/(?P<action>startall|stopall|migrateall)', 'node_bulk'),
+    _route('GET', 'nodes/{node}/{kind}', 'guests'),
+    _route('POST', 'nodes/{node}/{kind}', 'create'),
+    _route('GET', 'nodes/{node}/{kind}/{vmid}', 'guest'),
+    _route('DELETE', 'nodes/{node}/{kind}/{vmid}', 'delete'),
+    _route('GET', 'nodes/{node}/{kind}/{vmid}/status/current', 'guest_status'),
+    _route('POST', 'nodes/{node}/{kind}/{vmid}/status/'
+                   '(?P<action>start|stop|shutdown|reset|reboot|suspend|resume)',
+           'guest_action'),
+    _route('GET', 'nodes/{node}/{kind}/{vmid}/config', 'config'),
+    _route('PUT', 'nodes/{node}/{kind}/{vmid}/config', 'set_config'),
+    _route('POST', 'nodes/{node}/{kind}/{vmid}/config', 'set_config'),
+    _route('POST', 'nodes/{node}/(?P<kind>qemu)/{vmid}/clone', 'clone'),
+    _route('POST', 'nodes/{node}/{kind}/{vmid}/migrate', 'migrate'),
+    _route('GET', 'nodes/{node}/{kind}/{vmid}/rrddata', 'guest_rrddata'),
+    _route('GET', 'nodes/{node}/{kind}/{vmid}/snapshot', 'snapshots'),
+    _route('GET', 'nodes/{node}/qemu/{vmid}/agent/(?P<command>[a-z-]+)', 'agent'),
+    _route('POST', 'nodes/{node}/qemu/{vmid}/agent/(?P<command>[a-z-]+)', 'agent'),
+]
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # the default backlog of 5 drops the connections of a wide fan-out
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeProxmoxServer:
+    """
+    Serve a FakeCluster on host:port (0: any free port) from a background
+    thread, over HTTPS when certfile is given.
+
+    latency: seconds added to every request, a float or a
+    callable(method, path) returning one; jitter: random extra seconds.
+    error_rate: share of the requests answered with a 500.
+    workers: maximum requests processed at once, like the pveproxy worker
+    count; the others wait. hang: seconds an agent of a hung VM ('hung'
+    agent state) takes before its request fails with a 596.
+    """
+    def __init__(self, cluster=None, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, workers=None, certfile=None, keyfile=None, hang=10.0,
+                 seed=0):
+        self.cluster = cluster if cluster is not None else FakeCluster()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang = hang
+        self.random = random.Random(seed)
+        self.rules = []
+        self.requests = 0
+        self._rules_lock = threading.Lock()
+        self._workers = threading.BoundedSemaphore(workers) if workers else None
+        self.httpd = _HTTPServer((host, port), self._handler())
+        self.scheme = 'http'
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+            self.scheme = 'https'
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base url of the API."""
+        return '{}://{}:{}/api2/json'.format(self.scheme, self.host, self.port)
+
+    def start(self):
+        """Serve from a daemon thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True,
+                                        name='fake-proxmox')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def client(self, username='root@pam', password=None):
+        """A PyProxmox logged in on this server."""
+        from . import ProxAuth, PyProxmox  # pylint: disable=import-outside-toplevel
+        if password is None:
+            password = self.cluster.users.get(username, '')
+        return PyProxmox(ProxAuth(self.host, username, password, port=self.port,
+                                  scheme=self.scheme))
+
+    def inject(self, pattern, code=500, reason='Injected error', count=None, rate=1.0,
+               method=None, delay=0.0):
+        """
+        Answer the requests whose path matches the pattern regex with an
+        error code (596 for a timeout...), after delay seconds. count limits
+        the number of errors, rate is the share of matching requests hit.
+        Returns the rule, to give to clear().
+        """
+        rule = {'pattern': re.compile(pattern), 'code': code, 'reason': reason,
+                'count': count, 'rate': rate, 'method': method, 'delay': delay}
+        with self._rules_lock:
+            self.rules.append(rule)
+        return rule
+
+    def clear(self, rule=None):
+        """Remove an injected error rule, or all of them."""
+        with self._rules_lock:
+            if rule is None:
+                self.rules = []
+            elif rule in self.rules:
+                self.rules.remove(rule)
+
+    def _injected(self, method, path):
+        """The rule hitting a request, or None."""
+        with self._rules_lock:
+            if self.error_rate and self.random.random() < self.error_rate:
+                return {'code': 500, 'reason': 'Injected error', 'delay': 0.0}
+            for rule in self.rules:
+                if rule['method'] and rule['method'] != method:
+                    continue
+                if not rule['pattern'].search(path):
+                    continue
+                if rule['rate'] < 1.0 and self.random.random() >= rule['rate']:
+                    continue
+                if rule['count'] is not None:
+                    if rule['count'] <= 0:
+                        continue
+                    rule['count'] -= 1
+                return rule
+        return None
+
+    def answer(self, method, path, params, cookie, csrf):
+        """(code, reason, body bytes) of one request."""
+        self.requests += 1
+        if self._workers is not None:
+            self._workers.acquire()
+        try:
+            latency = self.latency(method, path) if callable(self.latency) else self.latency
+            if self.jitter:
+                latency += self.random.random() * self.jitter
+            if latency:
+                time.sleep(latency)
+            rule = self._injected(method, path)
+            if rule is not None:
+                if rule['delay']:
+                    time.sleep(rule['delay'])
+                return rule['code'], rule['reason'], json.dumps({'data': None}).encode()
+            try:
+                data = self.cluster.handle(method, path, params, cookie, csrf)
+            except ApiError as error:
+                if error.code == 401:
+                    return 401, error.reason, b''
+                body = {'data': None}
+                if error.errors:
+                    body['errors'] = error.errors
+                return error.code, error.reason, json.dumps(body).encode()
+            if self._hung(path):
+                time.sleep(self.hang)
+                return 596, 'Connection timed out', json.dumps({'data': None}).encode()
+            body = {'data': data}
+            if isinstance(data, Page):
+                body['total'] = data.total
+            return 200, 'OK', json.dumps(body).encode()
+        finally:
+            if self._workers is not None:
+                self._workers.release()
+
+    def _hung(self, path):
+        """True for an agent request to a VM whose agent is 'hung'."""
+        if '/agent/' not in path:
+            return False
+        match = re.search(r'/qemu/(\d+)/agent/', path)
+        guest = self.cluster.guests.get(int(match.group(1))) if match else None
+        return guest is not None and guest['agent'] == 'hung'
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Parse a request and answer it from the fake cluster."""
+            protocol_version = 'HTTP/1.1'
+            # headers and body go out in separate writes: without this the
+            # body waits for the client delayed ACK (~40 ms per request)
+            disable_nagle_algorithm = True
+
+            def _serve(self, method):
+                parts = urlsplit(self.path)
+                path = unquote(parts.path)
+                if not path.startswith('/api2/json/'):
+                    self._reply(404, 'Not Found', b'')
+                    return
+                params = dict(parse_qsl(parts.query, keep_blank_values=True))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length).decode()
+                    params.update(parse_qsl(body, keep_blank_values=True))
+                cookie = None
+                for item in (self.headers.get('Cookie') or '').split(';'):
+                    name, _, value = item.strip().partition('=')
+                    if name == 'PVEAuthCookie':
+                        cookie = unquote(value)
+                code, reason, body = server.answer(method, path[len('/api2/json/'):].strip('/'),
+                                                   params, cookie,
+                                                   self.headers.get('CSRFPreventionToken'))
+                self._reply(code, reason, body)
+
+            def _reply(self, code, reason, body):
+                self.send_response(code, reason)
+                self.send_header('Content-Type', 'application/json;charset=UTF-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """GET"""
+                self._serve('GET')
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """POST"""
+                self._serve('POST')
+
+            def do_PUT(self):  # pylint: disable=invalid-name
+                """PUT"""
+                self._serve('PUT')
+
+            def do_DELETE(self):  # pylint: disable=invalid-name
+                """DELETE"""
+                self._serve('DELETE')
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        return Handler
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Fake Proxmox API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8006)
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--guests-per-node', type=int, default=10)
+    parser.add_argument('--task-duration', type=float, default=0.5)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='requests processed at once, like pveproxy workers')
+    parser.add_argument('--certfile', help='serve HTTPS with this certificate')
+    parser.add_argument('--keyfile')
+    args = parser.parse_args(argv)
+
+    cluster = FakeCluster(args.nodes, args.guests_per_node, task_duration=args.task_duration)
+    server = FakeProxmoxServer(cluster, args.host, args.port, args.latency, args.jitter,
+                               args.error_rate, args.workers, args.certfile, args.keyfile)
+    print("Serving {} (users: {})".format(server.url, ', '.join(
+        '{}/{}'.format(user, password) for user, password in cluster.users.items())))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Many clusters behind one client.
+
+Federation holds a PyProxmox per cluster and runs queries against all of
+them concurrently. Results are merged into one list, each entry labelled
+with its 'cluster' (and 'node' for the node scoped queries); clusters that
+failed are reported in 'errors' instead of failing the whole query:
+
+fed = Federation({'paris': b, 'lyon': c})    # or Federation.from_config('clusters.ini')
+fed.resources('vm')['data']                  # guests of every cluster
+fed.get_nodes('nodes/{node}/tasks', {'source': 'active'})
+fed.call('get_virtual_status', 'web01')      # routed by name (or vmid)
+
+Guests are routed with a global index of vmids and names, built from
+'cluster/resources' and refreshed when a guest is not found. A call
+answered that the guest does not exist on its node (it moved since the
+index was built) refreshes the index of its cluster and is routed again,
+once. A vmid or name used in several clusters needs cluster= to be routed.
+"""
+
+import json
+import threading
+from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Federation:
+    """
+    clients: {cluster name: PyProxmox}. workers: threads running the
+    queries of all clusters and nodes.
+    """
+    def __init__(self, clients, workers=16):
+        self.clients = dict(clients)
+        self.by_vmid = {}
+        self.by_name = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    @classmethod
+    def from_config(cls, path, workers=16):
+        """
+        A Federation from an ini file: each section with an 'ipaddress' is a
+        cluster named after the section (user, passwd, optional port).
+        """
+        from . import ProxAuth, PyProxmox  # pylint: disable=import-outside-toplevel
+        config = ConfigParser()
+        if not config.read(path):
+            raise AssertionError('Federation Error: config file not found: \n {}'.format(path))
+        clients = {}
+        for name in config.sections():
+            section = config[name]
+            if section.get('ipaddress'):
+                auth = ProxAuth(section['ipaddress'], section['user'], section['passwd'],
+                                port=section.getint('port', 8006))
+                clients[name] = PyProxmox(auth)
+        return cls(clients, workers)
+
+    def close(self):
+        """Stop the query threads."""
+        self._executor.shutdown()
+
+    def map(self, func, clusters=None):
+        """
+        Run func(name, prox) for every cluster (or the named ones) at once.
+        Returns {cluster: result}, the exception raised as result on failure.
+        """
+        names = list(self.clients) if clusters is None else list(clusters)
+        futures = {name: self._executor.submit(func, name, self.clients[name])
+                   for name in names}
+        results = {}
+        for name, future in futures.items():
+            error = future.exception()
+            results[name] = error if error is not None else future.result()
+        return results
+
+    @staticmethod
+    def _error(data):
+        """Why a connect result has no data, None when it has."""
+        if isinstance(data, BaseException):
+            return '{}: {}'.format(type(data).__name__, data)
+        if not data:
+            return 'no response'
+        status = data.get('status') or {}
+        if not status.get('ok', True) or data.get('data') is None:
+            return '{} {}'.format(status.get('code'), status.get('reason'))
+        return None
+
+    def get(self, option, post_data=None, clusters=None):
+        """
+        GET a cluster scoped path on every cluster. Returns {'data': list of
+        entries labelled with their 'cluster', 'errors': {cluster: reason}};
+        a path answering a single object gives one entry per cluster.
+        """
+        results = self.map(lambda name, prox: prox.connect('get', option, post_data), clusters)
+        merged, errors = [], {}
+        for name, data in results.items():
+            error = self._error(data)
+            if error is not None:
+                errors[name] = error
+                continue
+            entries = data['data'] if isinstance(data['data'], list) else [data['data']]
+            for entry in entries:
+                merged.append(dict(entry, cluster=name) if isinstance(entry, dict)
+                              else {'cluster': name, 'value': entry})
+        return {'data': merged, 'errors': errors}
+
+    def get_nodes(self, option, post_data=None, clusters=None):
+        """
+        GET a node scoped path ('nodes/{node}/...') on every online node of
+        every cluster at once. Same result as get, entries labelled with
+        their 'cluster' and 'node'.
+        """
+        nodes = self.get('nodes', None, clusters)
+        errors = dict(nodes['errors'])
+        futures = {}
+        for entry in nodes['data']:
+            if entry.get('status', 'online') != 'online':
+                continue
+            prox = self.clients[entry['cluster']]
+            path = option.format(node=entry['node'])
+            futures[(entry['cluster'], entry['node'])] = self._executor.submit(
+                prox.connect, 'get', path, post_data)
+        merged = []
+        for (name, node), future in futures.items():
+            data = future.exception() or future.result()
+            error = self._error(data)
+            if error is not None:
+                errors['{}/{}'.format(name, node)] = error
+                continue
+            entries = data['data'] if isinstance(data['data'], list) else [data['data']]
+            for entry in entries:
+                merged.append(dict(entry, cluster=name, node=node) if isinstance(entry, dict)
+                              else {'cluster': name, 'node': node, 'value': entry})
+        return {'data': merged, 'errors': errors}
+
+    def resources(self, kind=None, clusters=None):
+        """'cluster/resources' of every cluster, optionally of one type ('vm', 'node'...)."""
+        return self.get('cluster/resources', {'type': kind} if kind else None, clusters)
+
+    def refresh_index(self, clusters=None):
+        """
+        Rebuild the vmid and name index from the guests of every cluster
+        (or the named ones). Returns the errors of the clusters that could
+        not be read; their guests stay routed from the previous index.
+        """
+        resources = self.resources('vm', clusters)
+        by_vmid, by_name = {}, {}
+        with self._lock:
+            kept = [entry for entries in self.by_vmid.values() for entry in entries
+                    if entry['cluster'] in resources['errors'] or
+                    (clusters is not None and entry['cluster'] not in clusters)]
+        for entry in resources['data'] + kept:
+            by_vmid.setdefault(entry['vmid'], []).append(entry)
+            if entry.get('name'):
+                by_name.setdefault(entry['name'], []).append(entry)
+        with self._lock:
+            self.by_vmid, self.by_name = by_vmid, by_name
+        return resources['errors']
+
+    def _lookup(self, guest, cluster):
+        with self._lock:
+            if isinstance(guest, int) or str(guest).isdigit():
+                entries = self.by_vmid.get(int(guest), [])
+            else:
+                entries = self.by_name.get(guest, [])
+        return [entry for entry in entries if cluster is None or entry['cluster'] == cluster]
+
+    def locate(self, guest, cluster=None):
+        """
+        The 'cluster/resources' entry (with its 'cluster') of a guest given
+        by vmid or name. Refreshes the index once when the guest is unknown.
+        Raises LookupError when it is not found or found in several clusters.
+        """
+        entries = self._lookup(guest, cluster)
+        if not entries:
+            self.refresh_index()
+            entries = self._lookup(guest, cluster)
+        if not entries:
+            raise LookupError('Guest not found: {}'.format(guest))
+        if len(entries) > 1:
+            raise LookupError('Guest {} is ambiguous, in clusters: {}'.format(
+                guest, ', '.join(sorted(entry['cluster'] for entry in entries))))
+        return entries[0]
+
+    def route(self, guest, cluster=None):
+        """(PyProxmox, node, vmid) serving a guest given by vmid or name."""
+        entry = self.locate(guest, cluster)
+        return self.clients[entry['cluster']], entry['node'], entry['vmid']
+
+    @staticmethod
+    def _moved(status):
+        """True when an HTTP status says the guest is not on the node it was sent to."""
+        if not isinstance(status, dict):
+            return False
+        return ((status.get('code') == 500 and 'does not exist' in str(status.get('reason')))
+                or status.get('code') == 595)
+
+    @staticmethod
+    def _status(result):
+        """The HTTP status of a guest method result (JSON text or dict), None if unknown."""
+        if isinstance(result, str):
+            try:
+                result = json.loads(result)
+            except ValueError:
+                return None
+        return result.get('status') if isinstance(result, dict) else None
+
+    def call(self, method, guest, *args, cluster=None, **kwargs):
+        """
+        Call a PyProxmox guest method (taking node and vmid first) on the
+        cluster and node of a guest: call('stop_lxc_container', 'dns01').
+        When the guest is no longer on its indexed node, the index of its
+        cluster is refreshed and the call sent once more to the new node.
+        """
+        entry = self.locate(guest, cluster)
+        try:
+            result = getattr(self.clients[entry['cluster']], method)(
+                entry['node'], entry['vmid'], *args, **kwargs)
+        except AssertionError as error:
+            # the task methods raise with the HTTP status of the call
+            if not self._moved(getattr(error, 'status', None)):
+                raise
+            moved = error
+        else:
+            if not self._moved(self._status(result)):
+                return result
+            moved = None
+        self.refresh_index([entry['cluster']])
+        current = self.locate(guest, cluster)
+        if (current['cluster'], current['node']) == (entry['cluster'], entry['node']):
+            # not a stale route after all: the first answer stands
+            if moved is not None:
+                raise moved
+            return result
+        return getattr(self.clients[current['cluster']], method)(
+            current['node'], current['vmid'], *args, **kwargs)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Request instrumentation.
+
+Instrumentation counts the requests sent by PyProxmox.connect per
+endpoint template ('nodes/{node}/qemu/{vmid}/status/start'): requests,
+status codes, errors, latency histogram and request/response bytes. Pre
+and post hooks get a dict describing each request, to plug in tracing:
+
+metrics = Instrumentation()
+metrics.add_hooks(pre=lambda info: info.update(span=tracer.start(info['endpoint'])),
+                  post=lambda info: info['span'].finish())
+b.instrumentation = metrics
+...
+metrics.snapshot()['GET nodes/{node}/qemu/{vmid}/status/current']['count']
+print('\n'.join(metrics.openmetrics()))
+
+With b.instrumentation left to None, or metrics.enabled set to False,
+connect skips all of it.
+"""
+
+import time
+import bisect
+import threading
+from .transport import PHASES
+
+# Latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Path segment following one of these is a name, replaced by a placeholder
+NAMED_SEGMENTS = {
+    'nodes': '{node}',
+    'storage': '{storage}',
+    'network': '{iface}',
+    'snapshot': '{snapname}',
+    'pools': '{poolid}',
+    'services': '{service}',
+    'users': '{userid}',
+    'groups': '{groupid}',
+    'roles': '{roleid}',
+    'domains': '{realm}',
+    'resources': '{sid}',
+    'content': '{volume}',
+}
+TEMPLATE_CACHE_SIZE = 4096
+
+
+def endpoint_template(path):
+    """
+    The endpoint template of an API path: node, storage... names, vmids
+    and UPIDs replaced by placeholders.
+    """
+    segments = path.split('?', 1)[0].strip('/').split('/')
+    previous = None
+    for index, segment in enumerate(segments):
+        placeholder = NAMED_SEGMENTS.get(previous)
+        if previous == 'content':
+            # volume ids may contain slashes
+            del segments[index + 1:]
+            segments[index] = placeholder
+            break
+        if placeholder is not None:
+            segments[index] = placeholder
+        elif segment.isdigit():
+            segments[index] = '{vmid}'
+        elif segment.startswith('UPID:'):
+            segments[index] = '{upid}'
+        previous = segment
+    return '/'.join(segments)
+
+
+class EndpointStats:
+    """Counters of one (method, endpoint template)."""
+    __slots__ = ('count', 'errors', 'codes', 'buckets', 'seconds', 'request_bytes',
+                 'response_bytes', 'timed', 'phases')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.codes = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.seconds = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.timed = 0
+        self.phases = {}
+
+    def as_dict(self):
+        """Plain dict copy, buckets keyed by their upper bound."""
+        bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+        return {'count': self.count, 'errors': self.errors, 'codes': dict(self.codes),
+                'buckets': dict(zip(bounds, self.buckets)), 'seconds': self.seconds,
+                'request_bytes': self.request_bytes, 'response_bytes': self.response_bytes,
+                'timed': self.timed, 'phases': dict(self.phases)}
+
+
+class Instrumentation:
+    """
+    Per endpoint request metrics and request hooks.
+
+    pre hooks are called with an info dict ('method', 'path', 'endpoint',
+    'rate_wait': seconds spent in the rate limiter) before the request is
+    sent, then 'start' is set; post hooks get the same dict
+    completed with 'status' (None when the request raised), 'seconds',
+    'request_bytes', 'response_bytes', 'error' and 'timing' (the phases
+    dict of a TimingTransport, else None). Hooks may add their own
+    keys to the dict. An exception raised by a hook is not caught.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.pre_hooks = []
+        self.post_hooks = []
+        self._stats = {}
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def add_hooks(self, pre=None, post=None):
+        """Register a pre and/or a post request hook."""
+        if pre is not None:
+            self.pre_hooks.append(pre)
+        if post is not None:
+            self.post_hooks.append(post)
+
+    def remove_hooks(self, pre=None, post=None):
+        """Unregister hooks added with add_hooks."""
+        if pre is not None:
+            self.pre_hooks.remove(pre)
+        if post is not None:
+            self.post_hooks.remove(post)
+
+    def template(self, path):
+        """Cached endpoint_template of a path."""
+        template = self._templates.get(path)
+        if template is None:
+            template = endpoint_template(path)
+            if len(self._templates) >= TEMPLATE_CACHE_SIZE:
+                self._templates.clear()
+            self._templates[path] = template
+        return template
+
+    def before(self, method, path, rate_wait=0.0, queue_wait=0.0, priority=None):
+        """
+        Start timing a request. rate_wait and queue_wait are the seconds it
+        waited for the rate limiter and the scheduler, priority its class.
+        Returns the info dict to give to after().
+        """
+        info = {'method': method.upper(), 'path': path, 'endpoint': self.template(path),
+                'rate_wait': rate_wait, 'queue_wait': queue_wait, 'priority': priority}
+        for hook in self.pre_hooks:
+            hook(info)
+        info['start'] = time.perf_counter()
+        return info
+
+    def after(self, info, response=None, error=None):
+        """Record a finished request from its response, or the exception raised."""
+        seconds = time.perf_counter() - info['start']
+        status = None
+        request_bytes = response_bytes = 0
+        timing = None
+        if response is not None:
+            timing = getattr(response, 'timing', None)
+            status = response.status_code
+            body = getattr(getattr(response, 'request', None), 'body', None)
+            request_bytes = len(body) if body else 0
+            response_bytes = len(response.content or b'')
+        info.update(status=status, seconds=seconds, request_bytes=request_bytes,
+                    response_bytes=response_bytes, error=error, timing=timing)
+        self.record(info['method'], info['endpoint'], status, seconds,
+                    request_bytes, response_bytes, timing)
+        for hook in self.post_hooks:
+            hook(info)
+        return info
+
+    def record(self, method, endpoint, status, seconds, request_bytes=0, response_bytes=0,
+               timing=None):
+        """
+        Account one request. status None is a request that raised (connection
+        error, replay miss...), timing an optional {phase: seconds} breakdown.
+        """
+        key = (method, endpoint)
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = EndpointStats()
+            stats.count += 1
+            stats.buckets[bucket] += 1
+            stats.seconds += seconds
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+            if status is None or status >= 500:
+                stats.errors += 1
+            stats.codes[status] = stats.codes.get(status, 0) + 1
+            if timing:
+                stats.timed += 1
+                for phase in PHASES:
+                    stats.phases[phase] = stats.phases.get(phase, 0.0) + timing.get(phase, 0.0)
+
+    def reset(self):
+        """Forget all the counters."""
+        with self._lock:
+            self._stats = {}
+
+    def snapshot(self):
+        """{'METHOD endpoint': stats dict} copy of the counters."""
+        with self._lock:
+            return {'{} {}'.format(method, endpoint): stats.as_dict()
+                    for (method, endpoint), stats in sorted(self._stats.items())}
+
+    def slowest(self, count=10):
+        """The count endpoints with the highest mean latency, as (name, mean seconds)."""
+        means = [(name, stats['seconds'] / stats['count'])
+                 for name, stats in self.snapshot().items() if stats['count']]
+        return sorted(means, key=lambda item: -item[1])[:count]
+
+    def timing_report(self):
+        """
+        Mean seconds per phase of the requests sent through a TimingTransport,
+        per endpoint: {'METHOD endpoint': {'requests': n, 'phases': {phase:
+        mean}, 'dominant': phase}}, the slowest endpoints first.
+        """
+        report = {}
+        for name, stats in self.snapshot().items():
+            if not stats['timed']:
+                continue
+            means = {phase: stats['phases'].get(phase, 0.0) / stats['timed'] for phase in PHASES}
+            report[name] = {'requests': stats['timed'], 'phases': means,
+                            'dominant': max(PHASES, key=means.get)}
+        return dict(sorted(report.items(), key=lambda item: -sum(item[1]['phases'].values())))
+
+    def format_timing_report(self):
+        """timing_report as a text table, milliseconds."""
+        lines = ['{:<50} {:>7} '.format('endpoint', 'count') +
+                 ' '.join('{:>8}'.format(phase) for phase in PHASES) + '  dominant']
+        for name, entry in self.timing_report().items():
+            lines.append('{:<50} {:>7} '.format(name[:50], entry['requests']) +
+                         ' '.join('{:8.2f}'.format(entry['phases'][phase] * 1000)
+                                  for phase in PHASES) + '  ' + entry['dominant'])
+        return '\n'.join(lines)
+
+    def openmetrics(self, prefix='pyproxmox_client'):
+        """The counters as a list of OpenMetrics lines (no '# EOF')."""
+        with self._lock:
+            items = sorted((key, stats.as_dict()) for key, stats in self._stats.items())
+        lines = ['# TYPE {}_requests counter'.format(prefix),
+                 '# HELP {}_requests API requests sent'.format(prefix)]
+        for (method, endpoint), stats in items:
+            for code, count in sorted(stats['codes'].items(), key=lambda item: str(item[0])):
+                lines.append('{}_requests_total{{method="{}",endpoint="{}",code="{}"}} {}'.format(
+                    prefix, method, endpoint, '' if code is None else code, count))
+        lines.append('# TYPE {}_request_duration_seconds histogram'.format(prefix))
+        lines.append('# HELP {}_request_duration_seconds API request latency'.format(prefix))
+        for (method, endpoint), stats in items:
+            label = 'method="{}",endpoint="{}"'.format(method, endpoint)
+            cumulated = 0
+            for bound, count in stats['buckets'].items():
+                cumulated += count
+                lines.append('{}_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(
+                    prefix, label, bound, cumulated))
+            lines.append('{}_request_duration_seconds_count{{{}}} {}'.format(
+                prefix, label, stats['count']))
+            lines.append('{}_request_duration_seconds_sum{{{}}} {}'.format(
+                prefix, label, repr(stats['seconds'])))
+        for name, field, doc in (('request_size_bytes', 'request_bytes', 'Bytes sent'),
+                                 ('response_size_bytes', 'response_bytes', 'Bytes received')):
+            lines.append('# TYPE {}_{} counter'.format(prefix, name))
+            lines.append('# HELP {}_{} {}'.format(prefix, name, doc))
+            for (method, endpoint), stats in items:
+                lines.append('{}_{}_total{{method="{}",endpoint="{}"}} {}'.format(
+                    prefix, name, method, endpoint, stats[field]))
+        return lines
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load generation harness.
+
+LoadHarness runs N simulated automation clients, each with its own
+PyProxmox and connection, looping over a weighted mix of API calls, and
+ramps N up step by step. Each step reports throughput, error rate and
+latency percentiles; find_knee picks the concurrency past which latency
+grows faster than throughput.
+
+harness = LoadHarness({'host': 'vnode01', 'username': 'root@pam', 'password': '...'},
+                      mix='read')
+steps = harness.ramp([1, 2, 4, 8, 16, 32], duration=10)
+find_knee(steps)
+
+Clients run as threads, asyncio tasks (driving the synchronous client from
+executor threads) or processes. From the command line, against the stand-in
+server or a real cluster (read-only mixes unless --allow-writes):
+
+python -m pyproxmox3.loadgen --fake --workers 3 --latency 0.005 --levels 1,2,4,8,16,32
+python -m pyproxmox3.loadgen --config proxmox_api.ini --mix read --duration 20
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+import multiprocessing
+from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor
+from .benchmark import percentile
+
+MODES = ('threads', 'async', 'processes')
+
+
+def _guest(state):
+    return state['rng'].choice(state['guests'])
+
+
+def _resources(prox, state):
+    prox.connect('get', 'cluster/resources', None)
+
+
+def _guest_status(prox, state):
+    kind, node, vmid = _guest(state)
+    prox.connect('get', 'nodes/{}/{}/{}/status/current'.format(node, kind, vmid), None)
+
+
+def _guest_config(prox, state):
+    kind, node, vmid = _guest(state)
+    prox.connect('get', 'nodes/{}/{}/{}/config'.format(node, kind, vmid), None)
+
+
+def _node_status(prox, state):
+    prox.get_node_status(state['rng'].choice(state['nodes']))
+
+
+def _node_tasks(prox, state):
+    prox.connect('get', 'nodes/{}/tasks'.format(state['rng'].choice(state['nodes'])),
+                 {'limit': 50})
+
+
+def _guest_rrd(prox, state):
+    kind, node, vmid = _guest(state)
+    prox.connect('get', 'nodes/{}/{}/{}/rrddata'.format(node, kind, vmid), {'timeframe': 'hour'})
+
+
+def _power(prox, state):
+    kind, node, vmid = _guest(state)
+    action = state['rng'].choice(('start', 'stop'))
+    prox.connect('post', 'nodes/{}/{}/{}/status/{}'.format(node, kind, vmid, action), None)
+
+
+# name: (function, writes)
+ACTIONS = {
+    'resources': (_resources, False),
+    'status': (_guest_status, False),
+    'config': (_guest_config, False),
+    'node_status': (_node_status, False),
+    'tasks': (_node_tasks, False),
+    'rrd': (_guest_rrd, False),
+    'power': (_power, True),
+}
+MIXES = {
+    'read': {'resources': 1, 'status': 4, 'config': 2, 'node_status': 1, 'tasks': 1},
+    'portal': {'status': 8, 'config': 1, 'resources': 1},
+    'sweep': {'resources': 1, 'config': 4, 'rrd': 4, 'node_status': 1},
+    'mixed': {'resources': 1, 'status': 4, 'config': 2, 'tasks': 1, 'rrd': 1, 'power': 1},
+}
+
+
+def parse_mix(mix):
+    """A mix name, a {action: weight} dict or 'status=5,config=1' text. Returns the dict."""
+    if isinstance(mix, dict):
+        weights = dict(mix)
+    elif mix in MIXES:
+        weights = dict(MIXES[mix])
+    else:
+        weights = {}
+        for item in str(mix).split(','):
+            name, _, weight = item.partition('=')
+            weights[name.strip()] = float(weight or 1)
+    for name in weights:
+        if name not in ACTIONS:
+            raise ValueError('Unknown action {} (known: {})'.format(name, ', '.join(ACTIONS)))
+    return weights
+
+
+def mix_writes(mix):
+    """True if a mix contains mutating calls."""
+    return any(ACTIONS[name][1] for name, weight in parse_mix(mix).items() if weight)
+
+
+def _client(target):
+    """A PyProxmox connected to a target dict."""
+    from . import ProxAuth, PyProxmox  # pylint: disable=import-outside-toplevel
+    from .transport import Transport  # pylint: disable=import-outside-toplevel
+    auth = target.get('auth')
+    if auth is None:
+        auth = ProxAuth(target['host'], target['username'], target['password'],
+                        port=target.get('port', 8006), scheme=target.get('scheme', 'https'))
+    prox = PyProxmox(auth)
+    prox.transport = Transport(pool_size=1)
+    return prox
+
+
+def _inventory(prox):
+    """(guests as (type, node, vmid), online nodes) for the actions."""
+    data = prox.connect('get', 'cluster/resources', None)
+    guests = []
+    nodes = []
+    for entry in (data or {}).get('data') or []:
+        if entry.get('type') in ('qemu', 'lxc') and not entry.get('template'):
+            guests.append((entry['type'], entry['node'], entry['vmid']))
+        elif entry.get('type') == 'node' and entry.get('status', 'online') == 'online':
+            nodes.append(entry['node'])
+    if not guests or not nodes:
+        raise AssertionError('Load Error: no guest or node found on the target')
+    return guests, nodes
+
+
+def run_clients(target, mix, count, duration, mode='threads', think_time=0.0, seed=0):
+    """
+    Run count clients for duration seconds. Returns the samples as a list
+    of (latency seconds, HTTP status or None on a connection error).
+    """
+    from . import Instrumentation  # pylint: disable=import-outside-toplevel
+    weights = parse_mix(mix)
+    names = list(weights)
+    cumulated = [weights[name] for name in names]
+    setup = _client(target)
+    target = dict(target, auth=setup.auth_class)
+    guests, nodes = _inventory(setup)
+    samples = []
+    instrumentation = Instrumentation()
+    instrumentation.add_hooks(post=lambda info: samples.append((info['seconds'],
+                                                                info['status'])))
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        prox = _client(target)
+        prox.instrumentation = instrumentation
+        state = {'rng': random.Random(seed * 100003 + index), 'guests': guests, 'nodes': nodes}
+        while time.monotonic() < deadline:
+            name = state['rng'].choices(names, cumulated)[0]
+            try:
+                ACTIONS[name][0](prox, state)
+            except Exception:  # pylint: disable=broad-except
+                # connection errors are already counted by the post hook
+                pass
+            if think_time:
+                time.sleep(think_time)
+        prox.transport.close()
+
+    if mode == 'threads':
+        threads = [threading.Thread(target=client, args=(index,), daemon=True)
+                   for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elif mode == 'async':
+        async def main():
+            loop = asyncio.get_running_loop()
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                await asyncio.gather(*(loop.run_in_executor(executor, client, index)
+                                       for index in range(count)))
+        asyncio.run(main())
+    else:
+        raise ValueError('Unknown mode: {}'.format(mode))
+    return samples
+
+
+def _process_clients(args):
+    target, mix, duration, think_time, seed = args
+    return run_clients(target, mix, 1, duration, 'threads', think_time, seed)
+
+
+class LoadHarness:
+    """
+    Ramp simulated clients against a target.
+
+    target: dict with host, username, password and optionally port and
+    scheme (see FakeProxmoxServer for a local one). mix: a MIXES name, a
+    {action: weight} dict or 'status=5,config=1'. think_time: seconds each
+    client waits between two calls.
+    """
+    def __init__(self, target, mix='read', mode='threads', think_time=0.0, seed=0):
+        if mode not in MODES:
+            raise ValueError('Unknown mode: {}'.format(mode))
+        self.target = dict(target)
+        self.mix = parse_mix(mix)
+        self.mode = mode
+        self.think_time = think_time
+        self.seed = seed
+
+    def step(self, concurrency, duration):
+        """Run concurrency clients for duration seconds. Returns the step report."""
+        if self.mode == 'processes':
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(concurrency) as pool:
+                parts = pool.map(_process_clients,
+                                 [(self.target, self.mix, duration, self.think_time,
+                                   self.seed * 1000 + index) for index in range(concurrency)])
+            samples = [sample for part in parts for sample in part]
+        else:
+            samples = run_clients(self.target, self.mix, concurrency, duration, self.mode,
+                                  self.think_time, self.seed)
+        latencies = [seconds for seconds, _ in samples]
+        errors = sum(1 for _, status in samples if status is None or status >= 400)
+        return {'concurrency': concurrency, 'requests': len(samples),
+                'throughput': round(len(samples) / duration, 2),
+                'errors': errors,
+                'error_rate': round(errors / len(samples), 4) if samples else None,
+                'p50_ms': _ms(percentile(latencies, 50)),
+                'p95_ms': _ms(percentile(latencies, 95)),
+                'p99_ms': _ms(percentile(latencies, 99))}
+
+    def ramp(self, levels=(1, 2, 4, 8, 16, 32), duration=10, report=None):
+        """Run one step per concurrency level. report(step) is called after each."""
+        steps = []
+        for concurrency in levels:
+            step = self.step(concurrency, duration)
+            steps.append(step)
+            if report is not None:
+                report(step)
+        return steps
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def find_knee(steps, gain=0.1):
+    """
+    The knee of a ramp: the step with the best throughput / p99 latency
+    ratio, and the first step after which adding clients gains less than
+    gain (10%) throughput. Returns {'knee': step, 'saturation': step}.
+    """
+    usable = [step for step in steps if step['requests'] and step['p99_ms']]
+    if not usable:
+        return {'knee': None, 'saturation': None}
+    knee = max(usable, key=lambda step: step['throughput'] / step['p99_ms'])
+    saturation = usable[-1]
+    for current, following in zip(usable, usable[1:]):
+        if following['throughput'] < current['throughput'] * (1 + gain):
+            saturation = current
+            break
+    return {'knee': knee, 'saturation': saturation}
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='pyproxmox3 load generator')
+    parser.add_argument('--config', help='ini file with an [api] section to load a real cluster')
+    parser.add_argument('--fake', action='store_true', help='load a local stand-in server')
+    parser.add_argument('--nodes', type=int, default=3, help='stand-in nodes')
+    parser.add_argument('--guests-per-node', type=int, default=50, help='stand-in guests')
+    parser.add_argument('--latency', type=float, default=0.0, help='stand-in latency')
+    parser.add_argument('--workers', type=int, default=None, help='stand-in worker count')
+    parser.add_argument('--mix', default='read',
+                        help='{} or action=weight,... among {}'.format(', '.join(MIXES),
+                                                                      ', '.join(ACTIONS)))
+    parser.add_argument('--mode', default='threads', choices=MODES)
+    parser.add_argument('--levels', default='1,2,4,8,16,32')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--think-time', type=float, default=0.0)
+    parser.add_argument('--allow-writes', action='store_true',
+                        help='allow mixes with mutating calls against a real cluster')
+    parser.add_argument('--output', help='write the JSON report to this file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    levels = [int(level) for level in args.levels.split(',') if level]
+    server = None
+    if args.fake:
+        from .fakeapi import FakeCluster, FakeProxmoxServer  # pylint: disable=import-outside-toplevel
+        cluster = FakeCluster(args.nodes, args.guests_per_node)
+        server = FakeProxmoxServer(cluster, latency=args.latency, workers=args.workers).start()
+        target = {'host': server.host, 'port': server.port, 'scheme': server.scheme,
+                  'username': 'root@pam', 'password': cluster.users['root@pam']}
+    else:
+        config = ConfigParser()
+        if not args.config or not config.read(args.config):
+            parser.error('--config with an [api] section or --fake is needed')
+        if mix_writes(args.mix) and not args.allow_writes:
+            parser.error('the {} mix changes guests, add --allow-writes'.format(args.mix))
+        target = {'host': config.get('api', 'ipaddress'), 'username': config.get('api', 'user'),
+                  'password': config.get('api', 'passwd')}
+
+    harness = LoadHarness(target, args.mix, args.mode, args.think_time)
+    try:
+        steps = harness.ramp(levels, args.duration, report=lambda step: print(
+            '{concurrency:>5} clients {throughput:>9} req/s errors {error_rate} '
+            'p50 {p50_ms} ms p95 {p95_ms} ms p99 {p99_ms} ms'.format(**step), file=sys.stderr))
+    finally:
+        if server is not None:
+            server.stop()
+    knee = find_knee(steps)
+    report = {'mix': harness.mix, 'mode': args.mode, 'duration': args.duration,
+              'steps': steps,
+              'knee': knee['knee'] and knee['knee']['concurrency'],
+              'saturation': knee['saturation'] and knee['saturation']['concurrency']}
+    text = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            output.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Coordinated migrations.
+
+MigrationScheduler runs a set of (vmid, target) moves with a limited number
+of migrations in flight per source node, per target node and for the whole
+cluster, so the migration network is kept busy without being saturated:
+
+scheduler = MigrationScheduler(b, source_concurrency=2, target_concurrency=2,
+                               cluster_concurrency=6, bwlimit=512000)
+result = scheduler.migrate([(101, 'vnode02'), (102, 'vnode03')])
+while not result.done():
+    print(result.progress())
+    time.sleep(10)
+"""
+
+from .bulk import BulkResult, TaskDispatcher, locate_guests, missing_guest, noop_guest
+from .tasks import TaskTracker
+
+
+class MigrationResult(BulkResult):
+    """The futures of the migrations, one per vmid."""
+    def progress(self):
+        """State of each move: queued, running or the task exit status."""
+        states = {}
+        for vmid, future in self.futures.items():
+            if not future.done():
+                states[vmid] = 'running' if getattr(future, 'task', None) else 'queued'
+            elif future.cancelled():
+                states[vmid] = 'cancelled'
+            elif future.exception() is not None:
+                states[vmid] = str(future.exception())
+            else:
+                states[vmid] = future.result().get('exitstatus')
+        return states
+
+
+class MigrationScheduler:
+    """
+    Migrate many guests with per source, per target and cluster wide limits.
+
+    bwlimit (KiB/s) is passed to every migration. Moves are ordered so that
+    the node receiving the next migration is always the one with the most
+    memory left, which keeps the peak memory pressure on targets low.
+    Migration tasks are followed by a single TaskTracker. adaptive: an
+    AdaptiveLimiter setting the per source and per target limits instead of
+    source_concurrency and target_concurrency. close() it (or use it in a
+    with block) once done.
+    """
+    def __init__(self, prox, source_concurrency=2, target_concurrency=2, cluster_concurrency=8,
+                 bwlimit=None, tracker=None, workers=4, adaptive=None):
+        self.prox = prox
+        self.bwlimit = bwlimit
+        self.tracker = tracker or TaskTracker(prox)
+        self.dispatcher = TaskDispatcher({'source': source_concurrency,
+                                          'target': target_concurrency,
+                                          'cluster': cluster_concurrency}, workers,
+                                         {'source': adaptive, 'target': adaptive}
+                                         if adaptive else None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self, cancel=False):
+        """Stop the launch threads once the queued moves are launched (or cancelled)."""
+        self.dispatcher.close(cancel)
+
+    def node_free_memory(self):
+        """Free memory (bytes) per online node, from 'cluster/resources'."""
+        data = self.prox.connect('get', 'cluster/resources', {'type': 'node'})
+        return {node['node']: node.get('maxmem', 0) - node.get('mem', 0)
+                for node in (data or {}).get('data') or []
+                if node.get('type') == 'node' and node.get('status', 'online') == 'online'}
+
+    def order(self, moves, guests, free):
+        """
+        Order moves for the lowest memory pressure: repeatedly send to the
+        target with the most free memory the biggest guest it is waiting for.
+        free is updated with the projected free memory once all moved.
+        """
+        by_target = {}
+        for vmid, target in moves:
+            by_target.setdefault(target, []).append(vmid)
+        for vmids in by_target.values():
+            vmids.sort(key=lambda vmid: guests[vmid].get('maxmem', 0))
+        ordered = []
+        while by_target:
+            target = max(by_target, key=lambda node: free.get(node, 0))
+            vmid = by_target[target].pop()
+            if not by_target[target]:
+                del by_target[target]
+            memory = guests[vmid].get('maxmem', 0)
+            free[target] = free.get(target, 0) - memory
+            free[guests[vmid]['node']] = free.get(guests[vmid]['node'], 0) + memory
+            ordered.append((vmid, target))
+        return ordered
+
+    def migrate(self, moves, online=True, with_local_disks=False):
+        """
+        Run (vmid, target) moves. Guests already on their target are not
+        sent and resolve at once with exitstatus OK. Returns a
+        MigrationResult keyed by vmid.
+        """
+        moves = [(int(vmid), target) for vmid, target in moves]
+        guests = locate_guests(self.prox, [vmid for vmid, _ in moves])
+        futures = {}
+        for vmid, target in moves:
+            if vmid not in guests:
+                futures[vmid] = missing_guest(vmid)
+            elif guests[vmid]['node'] == target:
+                futures[vmid] = noop_guest(vmid, target)
+        moves = [(vmid, target) for vmid, target in moves
+                 if vmid in guests and guests[vmid]['node'] != target]
+        for vmid, target in self.order(moves, guests, self.node_free_memory()):
+            resource = guests[vmid]
+            source = resource['node']
+            futures[vmid] = self.dispatcher.submit(
+                self._launcher(resource, target, online, with_local_disks),
+                [('source', source), ('target', target), ('cluster', '')])
+        return MigrationResult(futures)
+
+    def _launcher(self, resource, target, online, with_local_disks):
+        post_data = {}
+        if self.bwlimit:
+            post_data['bwlimit'] = self.bwlimit
+        running = resource.get('status') == 'running'
+        if resource['type'] == 'lxc':
+            if running:
+                post_data['restart'] = 1
+
+            def launch():
+                return self.prox.migrate_lxc_container(resource['node'], resource['vmid'], target,
+                                                       future=self.tracker, post_data=post_data)
+        else:
+            post_data['target'] = target
+            if online and running:
+                post_data['online'] = 1
+            if with_local_disks:
+                post_data['with-local-disks'] = 1
+
+            def launch():
+                return self.prox.migrate_virtual_machine(resource['node'], resource['vmid'],
+                                                         post_data, future=self.tracker)
+        return launch
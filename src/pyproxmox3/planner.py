@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Placement and rebalancing planner.
+
+Planner reads the nodes and guests from one 'cluster/resources' call plus
+one 'get_node_status' per node, models CPU, memory and storage capacity,
+then places new guests or computes a rebalancing plan with bin-packing
+heuristics:
+
+planner = Planner(b)
+planner.refresh()
+placement = planner.place([{'name': 'web01', 'cores': 2, 'memory': 4096, 'disk': 32}])
+moves = planner.rebalance(max_moves=20)
+MigrationScheduler(b).migrate(planner.moves_for_scheduler(moves))
+
+Memory and disk sizes of new guests are given in MiB and GiB, like the
+'memory' option and disk sizes of create_virtual_machine.
+"""
+
+import heapq
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+
+class NodeCapacity:
+    """Capacity and usage of a node. Memory and disk in bytes, cpu in cores."""
+    __slots__ = ('node', 'maxcpu', 'cpu', 'maxmem', 'mem', 'maxdisk', 'disk', 'guests')
+
+    def __init__(self, node, maxcpu, cpu, maxmem, mem, maxdisk, disk):
+        self.node = node
+        self.maxcpu = maxcpu
+        self.cpu = cpu
+        self.maxmem = maxmem
+        self.mem = mem
+        self.maxdisk = maxdisk
+        self.disk = disk
+        self.guests = []
+
+    def __repr__(self):
+        return '<NodeCapacity {} cpu={:.0%} mem={:.0%} disk={:.0%}>'.format(
+            self.node, self.cpu_load(), self.mem_load(), self.disk_load())
+
+    def cpu_load(self):
+        """Used cpu share."""
+        return self.cpu / self.maxcpu if self.maxcpu else 1.0
+
+    def mem_load(self):
+        """Used memory share."""
+        return self.mem / self.maxmem if self.maxmem else 1.0
+
+    def disk_load(self):
+        """Used disk share."""
+        return self.disk / self.maxdisk if self.maxdisk else 0.0
+
+    def load(self):
+        """Node load: the most used resource between cpu and memory."""
+        return max(self.cpu_load(), self.mem_load())
+
+    def fits(self, cpu, mem, disk, headroom):
+        """True if the node keeps headroom free once the guest added."""
+        limit = 1.0 - headroom
+        return ((self.mem + mem) <= self.maxmem * limit and
+                (self.cpu + cpu) <= self.maxcpu * limit and
+                (not self.maxdisk or (self.disk + disk) <= self.maxdisk * limit))
+
+    def add(self, cpu, mem, disk):
+        """Account for a guest arriving."""
+        self.cpu += cpu
+        self.mem += mem
+        self.disk += disk
+
+    def remove(self, cpu, mem, disk):
+        """Account for a guest leaving."""
+        self.cpu -= cpu
+        self.mem -= mem
+        self.disk -= disk
+
+
+class Planner:
+    """
+    Compute placements and rebalancing plans.
+
+    headroom is the share of each resource kept free on every node.
+    A guest cpu demand is its measured usage ('cpu' x 'maxcpu' cores) and
+    its memory demand its configured memory ('maxmem'). Disk is only checked
+    when placing new guests, migrated guests are expected on shared storage.
+    Only running guests are moved: a stopped one frees nothing on its node.
+    workers: node status reads sent at once.
+    """
+    def __init__(self, prox, headroom=0.1, workers=8):
+        self.prox = prox
+        self.headroom = headroom
+        self.workers = workers
+        self.nodes = {}
+        self.guests = {}
+
+    def refresh(self):
+        """Read nodes and guests in one sweep."""
+        data = self.prox.connect('get', 'cluster/resources', None)
+        nodes = {}
+        guests = {}
+        for resource in (data or {}).get('data') or []:
+            if resource.get('type') == 'node' and resource.get('status', 'online') == 'online':
+                nodes[resource['node']] = NodeCapacity(
+                    resource['node'], resource.get('maxcpu', 0),
+                    resource.get('cpu', 0) * resource.get('maxcpu', 0),
+                    resource.get('maxmem', 0), resource.get('mem', 0),
+                    resource.get('maxdisk', 0), resource.get('disk', 0))
+            elif resource.get('type') in ('qemu', 'lxc') and not resource.get('template'):
+                guests[resource['vmid']] = resource
+        if nodes:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(nodes))) as executor:
+                list(executor.map(self._node_status, nodes.values()))
+        for vmid, guest in guests.items():
+            if guest.get('node') in nodes:
+                nodes[guest['node']].guests.append(vmid)
+        self.nodes = nodes
+        self.guests = guests
+
+    def _node_status(self, node):
+        """Refine a node capacity with 'get_node_status' (real memory and cpu count)."""
+        try:
+            status = json.loads(self.prox.get_node_status(node.node))['data']
+        except (TypeError, KeyError, ValueError):
+            return
+        if not isinstance(status, dict):
+            return
+        memory = status.get('memory') or {}
+        if memory.get('total'):
+            node.maxmem = memory['total']
+            node.mem = memory.get('used', node.mem)
+        cpuinfo = status.get('cpuinfo') or {}
+        if cpuinfo.get('cpus'):
+            node.maxcpu = cpuinfo['cpus']
+            node.cpu = status.get('cpu', 0) * node.maxcpu
+
+    @staticmethod
+    def guest_demand(guest):
+        """(cpu cores, memory bytes) a guest needs on its node."""
+        return guest.get('cpu', 0) * guest.get('maxcpu', 0), guest.get('maxmem', 0)
+
+    def place(self, requests):
+        """
+        Place new guests, best fit decreasing on memory.
+
+        requests: list of dict with 'cores', 'memory' (MiB), 'disk' (GiB)
+        and any other keys (name...) kept in the answer.
+        Returns a list of (request, node or None when it fits nowhere), in
+        the requests order, to hand to create_virtual_machine(node, ...).
+        The node capacities are updated.
+        """
+        order = sorted(range(len(requests)), key=lambda index: -requests[index].get('memory', 0))
+        placement = [None] * len(requests)
+        for index in order:
+            request = requests[index]
+            cpu = float(request.get('cores', 1))
+            mem = int(request.get('memory', 512)) * 1024 ** 2
+            disk = int(request.get('disk', 0)) * 1024 ** 3
+            best = None
+            for node in self.nodes.values():
+                if node.fits(cpu, mem, disk, self.headroom):
+                    # best fit: the node left with the least free memory
+                    left = node.maxmem - node.mem - mem
+                    if best is None or left < best[0]:
+                        best = (left, node)
+            if best is not None:
+                best[1].add(cpu, mem, disk)
+            placement[index] = (request, best[1].node if best else None)
+        return placement
+
+    def rebalance(self, threshold=None, max_moves=None):
+        """
+        Minimal move rebalancing: while the most loaded node is above
+        threshold (default: the mean load plus headroom / 2), move its
+        biggest guest that fits to the least loaded node.
+
+        Returns a list of (vmid, source, target). The node capacities are
+        updated as if the moves were done.
+        """
+        if not self.nodes:
+            return []
+        if threshold is None:
+            mean = sum(node.load() for node in self.nodes.values()) / len(self.nodes)
+            threshold = mean + self.headroom / 2
+        # running guests per node, sorted by memory, the biggest last; the
+        # used memory of a node does not count its stopped guests
+        candidates = {name: sorted((vmid for vmid in node.guests
+                                    if self.guests[vmid].get('status') == 'running'),
+                                   key=lambda vmid: self.guests[vmid].get('maxmem', 0))
+                      for name, node in self.nodes.items()}
+        hot = [(-node.load(), name) for name, node in self.nodes.items()]
+        heapq.heapify(hot)
+        moves = []
+        while hot and (max_moves is None or len(moves) < max_moves):
+            load, name = heapq.heappop(hot)
+            source = self.nodes[name]
+            if -load != source.load():
+                # stale entry, push back with its current load
+                heapq.heappush(hot, (-source.load(), name))
+                continue
+            if source.load() <= threshold:
+                break
+            move = self._move_one(source, candidates[name], threshold)
+            if move is None:
+                continue
+            moves.append(move)
+            heapq.heappush(hot, (-source.load(), name))
+        return moves
+
+    def _move_one(self, source, candidates, threshold):
+        """Move the biggest guest of source that fits under threshold elsewhere."""
+        targets = sorted((node for node in self.nodes.values() if node is not source),
+                         key=lambda node: node.load())
+        for position in range(len(candidates) - 1, -1, -1):
+            vmid = candidates[position]
+            cpu, mem = self.guest_demand(self.guests[vmid])
+            for target in targets:
+                if not target.fits(cpu, mem, 0, self.headroom):
+                    continue
+                target.add(cpu, mem, 0)
+                if target.load() > threshold:
+                    target.remove(cpu, mem, 0)
+                    continue
+                source.remove(cpu, mem, 0)
+                del candidates[position]
+                source.guests.remove(vmid)
+                target.guests.append(vmid)
+                self.guests[vmid] = dict(self.guests[vmid], node=target.node)
+                return (vmid, source.node, target.node)
+        return None
+
+    @staticmethod
+    def moves_for_scheduler(moves):
+        """(vmid, target) pairs for MigrationScheduler.migrate."""
+        return [(vmid, target) for vmid, _, target in moves]
+
+    def migration_post_data(self, moves, online=True):
+        """
+        (node, vmid, post_data) for each move, ready for migrate_virtual_machine
+        (qemu guests only).
+        """
+        calls = []
+        for vmid, source, target in moves:
+            guest = self.guests[vmid]
+            if guest.get('type') != 'qemu':
+                continue
+            post_data = {'target': target}
+            if online and guest.get('status') == 'running':
+                post_data['online'] = 1
+            calls.append((source, vmid, post_data))
+        return calls
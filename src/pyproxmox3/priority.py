@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Priority classes for requests.
+
+A PriorityScheduler in the request path bounds the requests in flight;
+when they queue, it lets them through by class, weighted so that
+interactive calls jump ahead of background sweeps while every busy class
+keeps a minimum share of the throughput:
+
+b.scheduler = PriorityScheduler(concurrency=8,
+                                weights={'interactive': 9, 'background': 1})
+with priority('background'):
+    collector.collect()                # RRD scraping yields to...
+b.get_virtual_status(node, vmid)       # ...user calls, 'interactive' by default
+
+When every class has requests waiting, a class of weight w gets w / (sum of
+the weights) of the slots freed; an idle class gives its share to the
+others and does not save it up. The class of a request is the one set by
+the innermost priority() block of its thread (or task), else
+classify(method, path), else the scheduler default. With a RateLimiter
+too, connect takes the rate limit token before queueing for a slot, so no
+slot is held by a request sleeping for its token.
+"""
+
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+_PRIORITY = contextvars.ContextVar('pyproxmox3_priority', default=None)
+
+
+@contextmanager
+def priority(name):
+    """Send the requests made in the block with the priority class name."""
+    token = _PRIORITY.set(name)
+    try:
+        yield name
+    finally:
+        _PRIORITY.reset(token)
+
+
+def current_priority():
+    """Priority class set by the enclosing priority() block, None outside."""
+    return _PRIORITY.get()
+
+
+class _Ticket:
+    __slots__ = ('granted',)
+
+    def __init__(self):
+        self.granted = False
+
+
+class PriorityScheduler:
+    """
+    Weighted fair queueing of the requests of a client.
+
+    concurrency: requests in flight at once. weights: {class: weight}.
+    default: class of the requests without one. classify(method, path): an
+    optional function giving the class of a request outside priority()
+    blocks (None to use the default).
+    """
+    def __init__(self, concurrency=8, weights=None, default=INTERACTIVE, classify=None):
+        self.concurrency = concurrency
+        self.weights = dict(weights or {INTERACTIVE: 9, BACKGROUND: 1})
+        if default not in self.weights:
+            raise ValueError('Default class {} has no weight'.format(default))
+        for name, weight in self.weights.items():
+            if weight <= 0:
+                raise ValueError('Weight of {} must be positive: {}'.format(name, weight))
+        self.default = default
+        self.classify = classify
+        self.inflight = 0
+        self._queues = {name: deque() for name in self.weights}
+        # stride scheduling: the waiting class with the lowest pass goes next
+        self._pass = {name: 0.0 for name in self.weights}
+        self._virtual = 0.0
+        self._stats = {name: {'granted': 0, 'queued': 0, 'waited': 0.0} for name in self.weights}
+        self._cond = threading.Condition()
+
+    def request_class(self, method, path):
+        """Priority class of a request."""
+        name = current_priority()
+        if name is None and self.classify is not None:
+            name = self.classify(method, path)
+        if name is None:
+            return self.default
+        if name not in self.weights:
+            raise ValueError('Unknown priority class: {}'.format(name))
+        return name
+
+    def acquire(self, method, path):
+        """Wait for a slot, to give back with release(). Returns (class, seconds waited)."""
+        name = self.request_class(method, path)
+        start = time.perf_counter()
+        with self._cond:
+            queue = self._queues[name]
+            if not queue:
+                # back from idle: no credit for the time it did not ask
+                self._pass[name] = max(self._pass[name], self._virtual)
+            ticket = _Ticket()
+            queue.append(ticket)
+            self._dispatch()
+            if not ticket.granted:
+                self._stats[name]['queued'] += 1
+                while not ticket.granted:
+                    self._cond.wait()
+            waited = time.perf_counter() - start
+            self._stats[name]['waited'] += waited
+            return name, waited
+
+    def release(self):
+        """Give back the slot of a request."""
+        with self._cond:
+            self.inflight -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, method, path):
+        """Hold a slot around a request. Yields its class."""
+        name, _ = self.acquire(method, path)
+        try:
+            yield name
+        finally:
+            self.release()
+
+    def _dispatch(self):
+        """Grant free slots to the waiting classes, lowest pass first."""
+        granted = False
+        while self.inflight < self.concurrency:
+            waiting = [name for name, queue in self._queues.items() if queue]
+            if not waiting:
+                break
+            name = min(waiting, key=lambda name: (self._pass[name], -self.weights[name]))
+            self._virtual = self._pass[name]
+            self._pass[name] += 1.0 / self.weights[name]
+            self._queues[name].popleft().granted = True
+            self._stats[name]['granted'] += 1
+            self.inflight += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def waiting(self):
+        """Requests queued, per class."""
+        with self._cond:
+            return {name: len(queue) for name, queue in self._queues.items()}
+
+    def stats(self):
+        """{class: {'granted', 'queued', 'waited', 'waiting'}}: totals since creation."""
+        with self._cond:
+            return {name: dict(stats, waiting=len(self._queues[name]))
+                    for name, stats in self._stats.items()}
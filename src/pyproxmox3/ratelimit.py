@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Client side rate limiting.
+
+RateLimiter holds token buckets for the whole cluster, for each node and
+for each endpoint class ('read', 'write', 'heavy'). PyProxmox.connect
+takes one token from every bucket a request falls in before sending it:
+
+b.rate_limiter = RateLimiter(cluster=(50, 100), node=(10, 20),
+                             classes={'heavy': (1, 2)})
+
+Rates are in requests per second, bursts in requests. A request waits for
+its tokens (blocking, default), or raises RateLimitExceeded right away
+when they are missing (blocking=False) or when the wait would exceed
+timeout. acquire_async does the same from a coroutine. The time spent
+waiting is added up in stats() and given to the instrumentation hooks as
+'rate_wait'.
+"""
+
+import re
+import time
+import asyncio
+import threading
+
+# POST/DELETE endpoints starting long or expensive tasks
+HEAVY_ENDPOINTS = re.compile(
+    r'^nodes/[^/]+/(?:qemu|lxc)(?:/\d+/(?:clone|migrate|template))?$|'
+    r'^nodes/[^/]+/(?:startall|stopall|migrateall|vzdump)$|'
+    r'^nodes/[^/]+/(?:qemu|lxc)/\d+/(?:snapshot|snapshot/[^/]+/rollback)$')
+
+
+def endpoint_class(method, path):
+    """'read' for GET, 'heavy' for clones, migrations, creations... 'write' otherwise."""
+    method = method.lower()
+    if method == 'get':
+        return 'read'
+    path = path.strip('/')
+    if HEAVY_ENDPOINTS.match(path) or (method == 'delete' and
+                                       re.match(r'^nodes/[^/]+/(?:qemu|lxc)/\d+$', path)):
+        return 'heavy'
+    return 'write'
+
+
+def request_node(path):
+    """The node of a 'nodes/{node}/...' path, None for cluster wide paths."""
+    parts = path.strip('/').split('/', 2)
+    if len(parts) > 1 and parts[0] == 'nodes':
+        return parts[1]
+    return None
+
+
+class RateLimitExceeded(RuntimeError):
+    """No token available in time. wait is the delay until there would be."""
+    def __init__(self, message, wait):
+        super().__init__(message)
+        self.wait = wait
+
+
+class TokenBucket:
+    """
+    rate tokens per second, up to burst tokens. Not locked: RateLimiter
+    guards its buckets with its own lock.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'waited', 'waits', 'rejected')
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('Rate must be positive: {}'.format(rate))
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self.waits = 0
+        self.rejected = 0
+
+    def refill(self, now):
+        """Add the tokens earned since the last update."""
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, tokens=1):
+        """Seconds until tokens are available (after refill)."""
+        missing = tokens - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+
+class RateLimiter:
+    """
+    Token buckets per cluster, per node and per endpoint class.
+
+    cluster, node: (rate, burst) or None; node buckets are created for each
+    node on first use. classes: {class: (rate, burst)} cluster wide per
+    endpoint class. classify(method, path) returns the class of a request
+    (endpoint_class by default). blocking and timeout are the defaults of
+    acquire.
+    """
+    def __init__(self, cluster=None, node=None, classes=None, classify=endpoint_class,
+                 blocking=True, timeout=None):
+        self.node_limit = node
+        self.classify = classify
+        self.blocking = blocking
+        self.timeout = timeout
+        self.buckets = {}
+        self.waited = 0.0
+        self.waits = 0
+        self.rejected = 0
+        if cluster is not None:
+            self.buckets['cluster'] = TokenBucket(*cluster)
+        for name, limit in (classes or {}).items():
+            self.buckets['class/' + name] = TokenBucket(*limit)
+        self._lock = threading.Lock()
+
+    def keys(self, method, path):
+        """Keys of the buckets a request takes a token from."""
+        keys = []
+        if 'cluster' in self.buckets:
+            keys.append('cluster')
+        if self.node_limit is not None:
+            node = request_node(path)
+            if node is not None:
+                keys.append('node/' + node)
+        kind = 'class/' + self.classify(method, path)
+        if kind in self.buckets:
+            keys.append(kind)
+        return keys
+
+    def reserve(self, method, path, blocking=None, timeout=None, tokens=1):
+        """
+        Take the tokens of a request now and return the seconds to wait
+        before sending it. Raises RateLimitExceeded (taking nothing) if the
+        wait is not allowed.
+        """
+        blocking = self.blocking if blocking is None else blocking
+        timeout = self.timeout if timeout is None else timeout
+        keys = self.keys(method, path)
+        if not keys:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            buckets = []
+            for key in keys:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = self.buckets[key] = TokenBucket(*self.node_limit)
+                bucket.refill(now)
+                buckets.append(bucket)
+            wait = max(bucket.delay(tokens) for bucket in buckets)
+            if wait > 0 and (not blocking or (timeout is not None and wait > timeout)):
+                self.rejected += 1
+                for bucket in buckets:
+                    if bucket.delay(tokens) > 0:
+                        bucket.rejected += 1
+                raise RateLimitExceeded('Rate limit reached for {} {}, retry in {:.3f}s'.format(
+                    method.upper(), path, wait), wait)
+            if wait > 0:
+                self.waited += wait
+                self.waits += 1
+            for bucket in buckets:
+                own = bucket.delay(tokens)
+                if own > 0:
+                    bucket.waited += own
+                    bucket.waits += 1
+                # tokens may go below zero: later requests wait for them
+                bucket.tokens -= tokens
+            return wait
+
+    def acquire(self, method, path, blocking=None, timeout=None, tokens=1):
+        """Wait for the tokens of a request. Returns the seconds waited."""
+        wait = self.reserve(method, path, blocking, timeout, tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, method, path, blocking=None, timeout=None, tokens=1):
+        """acquire for coroutines: waits with asyncio.sleep."""
+        wait = self.reserve(method, path, blocking, timeout, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def stats(self):
+        """
+        {bucket key: {'tokens', 'rate', 'burst', 'waited', 'waits', 'rejected'}}.
+        The totals of the limiter are its waited, waits and rejected attributes.
+        """
+        with self._lock:
+            now = time.monotonic()
+            stats = {}
+            for key, bucket in sorted(self.buckets.items()):
+                bucket.refill(now)
+                stats[key] = {'tokens': bucket.tokens, 'rate': bucket.rate,
+                              'burst': bucket.burst, 'waited': bucket.waited,
+                              'waits': bucket.waits, 'rejected': bucket.rejected}
+            return stats
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Record and replay API traffic.
+
+RecordingTransport sends the requests through another transport and
+writes each request/response pair to a JSON lines file (gzip compressed
+when the name ends with .gz), with the secrets redacted:
+
+b.transport = RecordingTransport('traffic.jsonl.gz')
+...run the workflow...
+b.transport.close()
+
+ReplayTransport answers the recorded responses without any network, in a
+deterministic order, optionally paced like the recording with its times
+scaled by speed:
+
+replay = ReplayTransport('traffic.jsonl.gz', speed=None)
+b = replay.client()
+...run the same workflow, profile it...
+
+A request is matched on method, path and parameters; requests recorded
+several times are answered in their recorded order, the last answer being
+repeated once they are used up.
+"""
+
+import re
+import gzip
+import json
+import time
+import threading
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from .transport import Transport
+
+FORMAT_VERSION = 1
+REDACTED = '<redacted>'
+# field names whose values are never written
+REDACT_KEYS = re.compile(r'pass|ticket|csrf|token|secret|sshkeys|^key$', re.IGNORECASE)
+API_PREFIX = '/api2/json/'
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def api_path(url):
+    """The API path of a url ('nodes/vnode01/status'), without host nor query."""
+    url = url.split('?', 1)[0]
+    position = url.find(API_PREFIX)
+    if position >= 0:
+        url = url[position + len(API_PREFIX):]
+    return url.strip('/')
+
+
+def redact(value, keys=REDACT_KEYS):
+    """A copy of a JSON value with the values of the secret keys replaced."""
+    if isinstance(value, dict):
+        return {key: REDACTED if keys.search(str(key)) else redact(item, keys)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item, keys) for item in value]
+    return value
+
+
+def canonical(fields):
+    """Sorted [key, value] string pairs of request parameters, for matching."""
+    if not fields:
+        return []
+    if isinstance(fields, (str, bytes)):
+        return [['', fields.decode() if isinstance(fields, bytes) else fields]]
+    return sorted([str(key), str(value)] for key, value in dict(fields).items())
+
+
+class RecordingTransport:
+    """
+    Send requests through transport (a pooled Transport by default) and
+    record them to path. keys: regex of the field names to redact.
+    """
+    def __init__(self, path, transport=None, keys=REDACT_KEYS):
+        self.path = path
+        self.transport = transport if transport is not None else Transport()
+        self.keys = keys
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = _open(path, 'w')
+        self._start = time.monotonic()
+        self._file.write(json.dumps({'format': FORMAT_VERSION, 'created': int(time.time())},
+                                    separators=(',', ':')) + '\n')
+
+    def request(self, method, url, params=None, data=None, cookies=None, headers=None,
+                timeout=None):
+        """Send a request through the wrapped transport and record it."""
+        start = time.monotonic()
+        extra = {} if timeout is None else {'timeout': timeout}
+        response = self.transport.request(method, url, params=params, data=data,
+                                          cookies=cookies, headers=headers, **extra)
+        duration = time.monotonic() - start
+        content = response.content or b''
+        try:
+            content = json.dumps(redact(json.loads(content), self.keys), separators=(',', ':'))
+        except ValueError:
+            content = content.decode('utf-8', 'replace')
+        record = {'t': round(start - self._start, 6), 'd': round(duration, 6),
+                  'm': method.upper(), 'p': api_path(url),
+                  'q': self._fields(params), 'b': self._fields(data),
+                  's': response.status_code, 'r': response.reason, 'c': content}
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self.records += 1
+        return response
+
+    def _fields(self, fields):
+        """Redacted canonical parameters."""
+        return [[key, REDACTED if self.keys.search(key) else value]
+                for key, value in canonical(fields)]
+
+    def close(self):
+        """Flush the recording and close the wrapped transport."""
+        with self._lock:
+            self._file.close()
+        close = getattr(self.transport, 'close', None)
+        if close is not None:
+            close()
+
+
+class ReplayAuth:
+    """Stand-in for ProxAuth when replaying: no login, empty ticket."""
+    def __init__(self, url='replay'):
+        self.url = url
+        self.base_url = 'https://{}:8006/api2/json'.format(url)
+        self.ticket = {}
+        self.csrf = ''
+
+    def setup_connection(self):
+        """Nothing to log into."""
+
+
+class ReplayTransport:
+    """
+    Answer requests from a recording.
+
+    speed: None answers at once; otherwise each answer comes when it came
+    in the recording, times divided by speed (1.0 for the original timing,
+    2.0 twice as fast) and counted from the first request replayed, and
+    never sooner than its recorded duration after the request.
+    strict: raise LookupError for a request that was not recorded, instead
+    of answering a 404.
+    """
+    def __init__(self, path, speed=None, strict=False, keys=REDACT_KEYS):
+        self.path = path
+        self.speed = speed
+        self.strict = strict
+        self.keys = keys
+        self.missed = 0
+        self._exact = {}
+        self._loose = {}
+        self._lock = threading.Lock()
+        with _open(path, 'r') as recording:
+            header = json.loads(recording.readline())
+            if header.get('format') != FORMAT_VERSION:
+                raise ValueError('Unknown recording format: {}'.format(header.get('format')))
+            for line in recording:
+                record = json.loads(line)
+                record['c'] = record['c'].encode('utf-8')
+                exact = self._key(record['m'], record['p'], record['q'], record['b'])
+                self._exact.setdefault(exact, []).append(record)
+                self._loose.setdefault((record['m'], record['p']), []).append(record)
+        self._positions = {}
+        # monotonic time the recording started at, set by the first request
+        self._origin = None
+
+    def _key(self, method, path, params, data):
+        return (method, path, json.dumps(params), json.dumps(data))
+
+    def client(self):
+        """A PyProxmox answering from this recording."""
+        from . import PyProxmox  # pylint: disable=import-outside-toplevel
+        prox = PyProxmox(ReplayAuth())
+        prox.transport = self
+        return prox
+
+    def request(self, method, url, params=None, data=None, cookies=None, headers=None,
+                timeout=None):
+        """The recorded response of a request. timeout is ignored."""
+        method = method.upper()
+        path = api_path(url)
+        fields = [[key, REDACTED if self.keys.search(key) else value]
+                  for key, value in canonical(params)]
+        body = [[key, REDACTED if self.keys.search(key) else value]
+                for key, value in canonical(data)]
+        record = self._next(self._exact, self._key(method, path, fields, body))
+        if record is None:
+            record = self._next(self._loose, (method, path))
+        if record is None:
+            with self._lock:
+                self.missed += 1
+            if self.strict:
+                raise LookupError('Request not recorded: {} {}'.format(method, path))
+            return self._response(url, 404, 'Not recorded', b'{"data":null}')
+        if self.speed:
+            self._pace(record)
+        return self._response(url, record['s'], record['r'], record['c'])
+
+    def _pace(self, record):
+        """Sleep until the recorded answer time of a record, scaled by speed."""
+        now = time.monotonic()
+        with self._lock:
+            if self._origin is None:
+                self._origin = now - record['t'] / self.speed
+            due = self._origin + (record['t'] + record['d']) / self.speed
+        time.sleep(max(record['d'] / self.speed, due - now))
+
+    def _next(self, index, key):
+        """The next record of a key, the last one again once all were used."""
+        records = index.get(key)
+        if not records:
+            return None
+        with self._lock:
+            position = self._positions.get((id(index), key), 0)
+            self._positions[(id(index), key)] = position + 1
+        return records[min(position, len(records) - 1)]
+
+    def rewind(self):
+        """Answer from the start of the recording again."""
+        with self._lock:
+            self._positions = {}
+            self._origin = None
+            self.missed = 0
+
+    @staticmethod
+    def _response(url, status, reason, content):
+        response = Response()
+        response.status_code = status
+        response.reason = reason
+        response.url = url
+        response.encoding = 'utf-8'
+        response.headers = CaseInsensitiveDict({'Content-Type': 'application/json;charset=UTF-8',
+                                                'Content-Length': str(len(content))})
+        response._content = content  # pylint: disable=protected-access
+        return response
+
+    def close(self):
+        """Nothing to close."""
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar RRD data.
+
+The rrddata endpoints answer a list of samples, one dict per timestamp.
+RRDSeries keeps them as one typed column per metric plus a shared 'time'
+column (NumPy arrays when NumPy is installed, array('d') otherwise), with
+vectorised aggregation helpers:
+
+series = b.get_virtual_rrd_data('vnode01', 101, {'timeframe': 'day'}, columnar=True)
+series.mean('cpu'), series.max('netin'), series.percentile('cpu', 95)
+hourly = series.resample(3600)
+cluster_cpu = rollup(all_series, 'cpu', how='sum')
+
+Missing values are NaN and ignored by the aggregations. Samples without a
+time are kept (NaN time) but left out of resample and rollup buckets.
+"""
+
+import json
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NAN = float('nan')
+
+
+def _column(values):
+    """Typed float column from a list of values."""
+    if numpy is not None:
+        return numpy.asarray(values, dtype=numpy.float64)
+    return array('d', values)
+
+
+def _valid(column):
+    """Values of a pure python column which are not NaN."""
+    return [value for value in column if value == value]
+
+
+class RRDSeries:
+    """
+    RRD samples stored by column.
+
+    time is the timestamps column, columns maps each metric name to its
+    column, all the same length.
+    """
+    __slots__ = ('time', 'columns')
+
+    def __init__(self, time, columns):
+        self.time = time
+        self.columns = columns
+
+    @classmethod
+    def from_rrd_data(cls, data):
+        """
+        Build a series from a rrddata answer: the JSON string or dict the
+        get_*_rrd_data methods return, or the bare list of samples.
+        """
+        if isinstance(data, (str, bytes)):
+            data = json.loads(data)
+        if isinstance(data, dict):
+            data = data.get('data') or []
+        names = []
+        seen = set()
+        for sample in data:
+            for name in sample:
+                if name not in seen and name != 'time':
+                    seen.add(name)
+                    names.append(name)
+        times = [sample.get('time', NAN) for sample in data]
+        columns = {}
+        for name in names:
+            columns[name] = _column([_number(sample.get(name)) for sample in data])
+        return cls(_column(times), columns)
+
+    def __len__(self):
+        return len(self.time)
+
+    def __repr__(self):
+        return '<RRDSeries {} samples: {}>'.format(len(self), ', '.join(self.columns))
+
+    def names(self):
+        """Metric names."""
+        return list(self.columns)
+
+    def column(self, name):
+        """Column of a metric ('time' for the timestamps)."""
+        if name == 'time':
+            return self.time
+        return self.columns[name]
+
+    def mean(self, name):
+        """Mean of a metric, NaN when no value."""
+        column = self.columns[name]
+        if numpy is not None:
+            return float(numpy.nanmean(column)) if numpy.any(~numpy.isnan(column)) else NAN
+        values = _valid(column)
+        return math.fsum(values) / len(values) if values else NAN
+
+    def max(self, name):
+        """Max of a metric, NaN when no value."""
+        column = self.columns[name]
+        if numpy is not None:
+            return float(numpy.nanmax(column)) if numpy.any(~numpy.isnan(column)) else NAN
+        values = _valid(column)
+        return max(values) if values else NAN
+
+    def min(self, name):
+        """Min of a metric, NaN when no value."""
+        column = self.columns[name]
+        if numpy is not None:
+            return float(numpy.nanmin(column)) if numpy.any(~numpy.isnan(column)) else NAN
+        values = _valid(column)
+        return min(values) if values else NAN
+
+    def sum(self, name):
+        """Sum of a metric."""
+        column = self.columns[name]
+        if numpy is not None:
+            return float(numpy.nansum(column))
+        return math.fsum(_valid(column))
+
+    def percentile(self, name, percent):
+        """Percentile (0-100) of a metric with linear interpolation, NaN when no value."""
+        column = self.columns[name]
+        if numpy is not None:
+            if not numpy.any(~numpy.isnan(column)):
+                return NAN
+            return float(numpy.nanpercentile(column, percent))
+        values = sorted(_valid(column))
+        if not values:
+            return NAN
+        rank = (len(values) - 1) * percent / 100.0
+        low = int(math.floor(rank))
+        high = min(low + 1, len(values) - 1)
+        return values[low] + (values[high] - values[low]) * (rank - low)
+
+    def resample(self, step, how='mean'):
+        """
+        Aggregate the samples by buckets of step seconds (mean, max, min or
+        sum). Returns a new RRDSeries timed at the start of each bucket, NaN
+        for the buckets without any value.
+        """
+        reduce_values = _pure_reduce(how)
+        if numpy is not None:
+            timed = ~numpy.isnan(self.time)
+            buckets = numpy.floor(self.time[timed] / step) * step
+            keys, index = numpy.unique(buckets, return_inverse=True)
+            columns = {name: _reduce(column[timed], index, len(keys), how)
+                       for name, column in self.columns.items()}
+            return RRDSeries(keys, columns)
+        buckets = {}
+        for position, timestamp in enumerate(self.time):
+            if timestamp != timestamp:
+                continue
+            buckets.setdefault(math.floor(timestamp / step) * step, []).append(position)
+        keys = sorted(buckets)
+        columns = {}
+        for name, column in self.columns.items():
+            values = []
+            for key in keys:
+                bucket = _valid([column[position] for position in buckets[key]])
+                values.append(reduce_values(bucket) if bucket else NAN)
+            columns[name] = array('d', values)
+        return RRDSeries(array('d', keys), columns)
+
+    def to_records(self):
+        """
+        Back to a list of sample dicts, like the API answer. A sample
+        without a time (NaN) has no 'time' key, like a missing value.
+        """
+        names = list(self.columns)
+        records = []
+        for position, timestamp in enumerate(self.time):
+            record = {'time': int(timestamp)} if timestamp == timestamp else {}
+            for name in names:
+                value = float(self.columns[name][position])
+                if value == value:
+                    record[name] = value
+            records.append(record)
+        return records
+
+
+def _number(value):
+    """Float value of a sample field, NaN when missing."""
+    if value is None:
+        return NAN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+_PURE_REDUCE = {
+    'mean': lambda values: math.fsum(values) / len(values),
+    'max': max,
+    'min': min,
+    'sum': math.fsum,
+}
+
+
+def _pure_reduce(how):
+    """Pure python reducer of a list of values. Raises ValueError for an unknown how."""
+    if how not in _PURE_REDUCE:
+        raise ValueError('Unknown aggregation: {}'.format(how))
+    return _PURE_REDUCE[how]
+
+
+def _reduce(column, index, size, how):
+    """Reduce a NumPy column by bucket index, ignoring NaN."""
+    valid = ~numpy.isnan(column)
+    if how in ('mean', 'sum'):
+        sums = numpy.zeros(size)
+        numpy.add.at(sums, index[valid], column[valid])
+        counts = numpy.bincount(index[valid], minlength=size)
+        # a bucket without any value is NaN, not a sum of 0
+        if how == 'sum':
+            return numpy.where(counts > 0, sums, numpy.nan)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return numpy.where(counts > 0, sums / numpy.maximum(counts, 1), numpy.nan)
+    if how == 'max':
+        result = numpy.full(size, -numpy.inf)
+        numpy.maximum.at(result, index[valid], column[valid])
+        return numpy.where(numpy.isinf(result), numpy.nan, result)
+    if how == 'min':
+        result = numpy.full(size, numpy.inf)
+        numpy.minimum.at(result, index[valid], column[valid])
+        return numpy.where(numpy.isinf(result), numpy.nan, result)
+    raise ValueError('Unknown aggregation: {}'.format(how))
+
+
+def rollup(series_list, name, how='sum', step=None):
+    """
+    Combine one metric of many series (e.g. all the guests of a cluster)
+    by timestamp, or by buckets of step seconds. Returns an RRDSeries with
+    a single column named after the metric, NaN for the timestamps without
+    any value. how: mean, max, min or sum.
+    """
+    reduce_values = _pure_reduce(how)
+    series_list = [series for series in series_list if name in series.columns]
+    if not series_list:
+        return RRDSeries(_column([]), {name: _column([])})
+    if numpy is not None:
+        times = numpy.concatenate([numpy.asarray(series.time) for series in series_list])
+        values = numpy.concatenate([numpy.asarray(series.columns[name])
+                                    for series in series_list])
+        timed = ~numpy.isnan(times)
+        times, values = times[timed], values[timed]
+        if step:
+            times = numpy.floor(times / step) * step
+        keys, index = numpy.unique(times, return_inverse=True)
+        return RRDSeries(keys, {name: _reduce(values, index, len(keys), how)})
+    buckets = {}
+    for series in series_list:
+        column = series.columns[name]
+        for position, timestamp in enumerate(series.time):
+            if timestamp != timestamp:
+                continue
+            if step:
+                timestamp = math.floor(timestamp / step) * step
+            value = column[position]
+            if value == value:
+                buckets.setdefault(timestamp, []).append(value)
+            else:
+                buckets.setdefault(timestamp, [])
+    keys = sorted(buckets)
+    return RRDSeries(array('d', keys),
+                     {name: array('d', [reduce_values(buckets[key]) if buckets[key] else NAN
+                                        for key in keys])})
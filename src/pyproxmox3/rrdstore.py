@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local RRD history.
+
+RRDStore keeps one fixed size, memory mapped ring buffer file per series
+(a guest, a node or a storage). RRDCollector fetches the rrddata of every
+guest, node and storage concurrently and appends only the samples newer
+than what is already stored, refreshing the newest stored one (its bucket
+was still filling when it was read):
+
+store = RRDStore('/var/lib/pverrd', capacity=20160)
+collector = RRDCollector(b, store)
+collector.collect()                          # every few minutes
+series = store.query('qemu/101', since=time.time() - 7 * 86400)
+series.mean('cpu')
+
+A ring file is a header, the column names, then capacity records of
+(time, value...) doubles in native byte order. Once full, the oldest
+records are overwritten. The columns are fixed when the file is created:
+columns appearing later in the rrddata (a newer pve) are not stored.
+Files are named after the percent-encoded series key.
+"""
+
+import os
+import mmap
+import struct
+import bisect
+import threading
+from urllib.parse import quote, unquote
+import contextvars
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from .rrd import RRDSeries, _column
+from .priority import BACKGROUND, priority
+
+MAGIC = b'PXRR'
+VERSION = 1
+HEADER = struct.Struct('=4sHHIQQ')
+NAME_SIZE = 32
+
+
+class RingSeries:
+    """
+    One series in a memory mapped ring buffer file.
+
+    columns and capacity are only used when the file is created; an
+    existing file keeps its own.
+    """
+    def __init__(self, path, columns=None, capacity=10080):
+        self.path = path
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            if not columns:
+                raise ValueError('Columns needed to create {}'.format(path))
+            self._create(path, list(columns), capacity)
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, ncols, capacity, _, _ = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a ring series file: {}'.format(path))
+        self.capacity = capacity
+        self.columns = []
+        for index in range(ncols):
+            offset = HEADER.size + index * NAME_SIZE
+            self.columns.append(self._map[offset:offset + NAME_SIZE].rstrip(b'\0').decode())
+        self._width = len(self.columns) + 1
+        self._data = HEADER.size + ncols * NAME_SIZE
+
+    @staticmethod
+    def _create(path, columns, capacity):
+        names = b''.join(name.encode()[:NAME_SIZE].ljust(NAME_SIZE, b'\0') for name in columns)
+        size = HEADER.size + len(names) + capacity * (len(columns) + 1) * 8
+        with open(path, 'wb') as ring:
+            ring.write(HEADER.pack(MAGIC, VERSION, len(columns), capacity, 0, 0))
+            ring.write(names)
+            ring.truncate(size)
+
+    def __len__(self):
+        return HEADER.unpack_from(self._map, 0)[5]
+
+    def close(self):
+        """Flush and unmap the file."""
+        with self._lock:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+
+    def last_time(self):
+        """Timestamp of the newest record, None when empty."""
+        with self._lock:
+            head, count = HEADER.unpack_from(self._map, 0)[4:6]
+            return self._last(head, count)
+
+    def _last(self, head, count):
+        if not count:
+            return None
+        slot = (head - 1) % self.capacity
+        return struct.unpack_from('=d', self._map, self._data + slot * self._width * 8)[0]
+
+    def append(self, series):
+        """
+        Append the samples of an RRDSeries newer than the last stored one.
+        A sample at the time of the last stored one replaces it: the newest
+        rrddata bucket is still being filled when it is first read. Samples
+        without a time or without any value are skipped, and so are the columns of series the
+        file was not created with. Returns the number of records written.
+        """
+        sources = [series.columns.get(name) for name in self.columns]
+        nan = float('nan')
+        record = struct.Struct('={}d'.format(self._width))
+        written = 0
+        with self._lock:
+            magic, version, ncols, capacity, head, count = HEADER.unpack_from(self._map, 0)
+            last = self._last(head, count)
+            for position, timestamp in enumerate(series.time):
+                if timestamp != timestamp or (last is not None and timestamp < last):
+                    continue
+                values = [nan if source is None else float(source[position])
+                          for source in sources]
+                if all(value != value for value in values):
+                    continue
+                if timestamp == last:
+                    # read while its bucket was still filling: keep the newer values
+                    slot = (head - 1) % capacity
+                else:
+                    slot = head
+                    head = (head + 1) % capacity
+                    count = min(count + 1, capacity)
+                    last = timestamp
+                record.pack_into(self._map, self._data + slot * self._width * 8,
+                                 timestamp, *values)
+                written += 1
+            HEADER.pack_into(self._map, 0, magic, version, ncols, capacity, head, count)
+        return written
+
+    def read(self, since=None, until=None):
+        """Stored records between since and until (timestamps, inclusive) as an RRDSeries."""
+        with self._lock:
+            head, count = HEADER.unpack_from(self._map, 0)[4:6]
+            first = (head - count) % self.capacity
+            values = array('d')
+            if first + count <= self.capacity:
+                values.frombytes(self._region(first, count))
+            else:
+                values.frombytes(self._region(first, self.capacity - first))
+                values.frombytes(self._region(0, head))
+        times = values[0::self._width]
+        start = 0 if since is None else bisect.bisect_left(times, since)
+        stop = len(times) if until is None else bisect.bisect_right(times, until)
+        columns = {name: _column(values[index + 1::self._width][start:stop])
+                   for index, name in enumerate(self.columns)}
+        return RRDSeries(_column(times[start:stop]), columns)
+
+    def _region(self, slot, count):
+        offset = self._data + slot * self._width * 8
+        return self._map[offset:offset + count * self._width * 8]
+
+
+class RRDStore:
+    """
+    A directory of RingSeries, one file per series key ('qemu/101',
+    'node/vnode01', 'storage/vnode01/local'...).
+    """
+    def __init__(self, directory, capacity=10080):
+        self.directory = directory
+        self.capacity = capacity
+        self._series = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        """File of a series key: the key percent-encoded, '/' included."""
+        return os.path.join(self.directory, quote(key, safe='') + '.rrd')
+
+    def keys(self):
+        """Keys of the stored series."""
+        return sorted(unquote(name[:-4]) for name in os.listdir(self.directory)
+                      if name.endswith('.rrd'))
+
+    def series(self, key, columns=None):
+        """The RingSeries of a key, created with columns if it does not exist."""
+        with self._lock:
+            ring = self._series.get(key)
+            if ring is None:
+                ring = RingSeries(self.path(key), columns, self.capacity)
+                self._series[key] = ring
+            return ring
+
+    def append(self, key, series):
+        """Append an RRDSeries to a stored series. Returns the records written."""
+        if not len(series):
+            return 0
+        return self.series(key, series.names()).append(series)
+
+    def query(self, key, since=None, until=None):
+        """Read a stored series between two timestamps. Returns an RRDSeries."""
+        return self.series(key).read(since, until)
+
+    def close(self):
+        """Close every open series."""
+        with self._lock:
+            for ring in self._series.values():
+                ring.close()
+            self._series = {}
+
+
+class RRDCollector:
+    """
+    Scrape the rrddata of all guests, nodes and storages into an RRDStore.
+
+    timeframe and cf are passed to the rrddata endpoints; 'hour' gives one
+    sample per minute, so collect() should run at least every hour.
+    limiter: an AdaptiveLimiter bounding the requests in flight per node.
+    request_class: priority class of the requests, for a PriorityScheduler.
+    """
+    def __init__(self, prox, store, timeframe='hour', cf='AVERAGE', workers=16, limiter=None,
+                 request_class=BACKGROUND):
+        self.prox = prox
+        self.store = store
+        self.post_data = {'timeframe': timeframe, 'cf': cf}
+        self.workers = workers
+        self.limiter = limiter
+        self.request_class = request_class
+
+    def targets(self):
+        """(key, rrddata path) of every guest, node and storage."""
+        data = self.prox.connect('get', 'cluster/resources', None)
+        targets = []
+        for resource in (data or {}).get('data') or []:
+            kind = resource.get('type')
+            if kind in ('qemu', 'lxc') and not resource.get('template'):
+                targets.append(('{}/{}'.format(kind, resource['vmid']),
+                                'nodes/{}/{}/{}/rrddata'.format(resource['node'], kind,
+                                                                resource['vmid'])))
+            elif kind == 'node' and resource.get('status', 'online') == 'online':
+                targets.append(('node/{}'.format(resource['node']),
+                                'nodes/{}/rrddata'.format(resource['node'])))
+            elif kind == 'storage':
+                targets.append(('storage/{}/{}'.format(resource['node'], resource['storage']),
+                                'nodes/{}/storage/{}/rrddata'.format(resource['node'],
+                                                                     resource['storage'])))
+        return targets
+
+    def collect(self, targets=None):
+        """Fetch and store every target concurrently. Returns {key: records written}."""
+        with priority(self.request_class):
+            targets = self.targets() if targets is None else targets
+            # the pool threads run in copies of this context, priority included
+            contexts = [contextvars.copy_context() for _ in targets]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                written = executor.map(lambda context, target: context.run(self._collect_one,
+                                                                           target),
+                                       contexts, targets)
+                return dict(zip((key for key, _ in targets), written))
+
+    def _collect_one(self, target):
+        key, path = target
+        try:
+            if self.limiter is None:
+                data = self.prox.connect('get', path, self.post_data)
+            else:
+                with self.limiter.slot(path.split('/')[1]) as slot:
+                    data = self.prox.connect('get', path, self.post_data)
+                    slot.status = (data or {}).get('status', {}).get('code')
+        except requests.RequestException:
+            return 0
+        if not data or not isinstance(data.get('data'), list):
+            return 0
+        return self.store.append(key, RRDSeries.from_rrd_data(data))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fleet sweeps across a process pool.
+
+SweepExecutor fetches per guest details (configs, snapshots, agent
+data...) of every guest of one or many clusters. The guests are split in
+small units of one cluster and node, spread over a pool of processes so
+that the JSON decoding is not bound to one core. Each worker keeps one
+pooled Transport per cluster and reuses the parent's login ticket; the
+results stream back unit by unit as they complete:
+
+sweep = SweepExecutor({'paris': b, 'lyon': c}, processes=8)
+for result in sweep.run(transform=summarize):
+    store(result.cluster, result.vmid, result.items['config'])
+
+Responses are decoded in the workers: an item is the 'data' of its
+response (None when it failed). With transform, a module level function
+transform(item, data) runs in the worker on that data and only its return
+value is sent back: reduce the payloads there. With raw=True an item is
+the response body (bytes) as received, for a parent storing it as is.
+Every request gives up after timeout seconds, so a hung node only costs
+its own items.
+
+An item is a path below the guest ('config', 'snapshot', 'status/current')
+or 'agent/<command>', sent only to qemu guests whose config enables the
+agent. Tickets are valid two hours, long enough for most sweeps.
+"""
+
+import os
+import json
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .agent import agent_enabled
+
+DEFAULT_ITEMS = ('config', 'snapshot', 'agent/network-get-interfaces')
+
+# items: {item: (HTTP status or None when not fetched, payload)}
+SweepResult = namedtuple('SweepResult', 'cluster node type vmid items')
+
+# per worker process state, set by _init_worker
+_WORKER = {}
+
+
+def _init_worker(clusters, threads, timeout):
+    _WORKER['clusters'] = clusters
+    _WORKER['threads'] = threads
+    _WORKER['timeout'] = timeout
+    _WORKER['transports'] = {}
+
+
+def _transport(cluster):
+    from .transport import Transport  # pylint: disable=import-outside-toplevel
+    transport = _WORKER['transports'].get(cluster)
+    if transport is None:
+        transport = _WORKER['transports'][cluster] = Transport(pool_size=_WORKER['threads'])
+    return transport
+
+
+def _fetch(transport, base_url, ticket, path):
+    """(status, body bytes) of a GET, (None, error text) on a connection error."""
+    import requests  # pylint: disable=import-outside-toplevel
+    try:
+        response = transport.request('get', '{}/{}'.format(base_url, path), cookies=ticket,
+                                     timeout=_WORKER['timeout'])
+    except requests.RequestException as error:
+        return None, str(error).encode()
+    return response.status_code, response.content
+
+
+def _decode(status, body):
+    if status != 200:
+        return None
+    try:
+        return json.loads(body).get('data')
+    except ValueError:
+        return None
+
+
+def _sweep_guest(cluster, node, kind, vmid, items, transform, raw):
+    base_url, ticket = _WORKER['clusters'][cluster]
+    transport = _transport(cluster)
+    prefix = 'nodes/{}/{}/{}'.format(node, kind, vmid)
+    results = {}
+    config = None
+    if any(item.startswith('agent/') for item in items) and kind == 'qemu':
+        status, body = _fetch(transport, base_url, ticket, prefix + '/config')
+        config = (status, body)
+    for item in items:
+        if item == 'config' and config is not None:
+            status, body = config
+        elif item.startswith('agent/'):
+            if kind != 'qemu' or not agent_enabled(_decode(*config)):
+                results[item] = (None, None)
+                continue
+            status, body = _fetch(transport, base_url, ticket, '{}/{}'.format(prefix, item))
+        else:
+            status, body = _fetch(transport, base_url, ticket, '{}/{}'.format(prefix, item))
+        if transform is not None:
+            body = transform(item, _decode(status, body))
+        elif not raw:
+            body = _decode(status, body)
+        results[item] = (status, body)
+    return SweepResult(cluster, node, kind, vmid, results)
+
+
+def _sweep_unit(unit):
+    """Sweep the guests of a unit in the worker. Returns their SweepResults."""
+    cluster, node, guests, items, transform, raw = unit
+    if len(guests) == 1 or _WORKER['threads'] <= 1:
+        return [_sweep_guest(cluster, node, kind, vmid, items, transform, raw)
+                for kind, vmid in guests]
+    with ThreadPoolExecutor(max_workers=_WORKER['threads']) as executor:
+        return list(executor.map(lambda guest: _sweep_guest(cluster, node, guest[0], guest[1],
+                                                            items, transform, raw), guests))
+
+
+class SweepExecutor:
+    """
+    Sweep every guest of many clusters in a process pool.
+
+    clients: {cluster name: PyProxmox} or a Federation. processes: worker
+    processes (CPU count by default), each running threads requests at
+    once. chunk: guests per unit of work. items: what to fetch per guest.
+    timeout: seconds allowed to each request.
+    """
+    def __init__(self, clients, processes=None, threads=4, chunk=25, items=DEFAULT_ITEMS,
+                 timeout=30.0):
+        self.clients = dict(getattr(clients, 'clients', clients))
+        self.processes = processes or os.cpu_count() or 1
+        self.threads = threads
+        self.chunk = chunk
+        self.items = tuple(items)
+        self.timeout = timeout
+        self.errors = {}
+
+    def units(self):
+        """
+        (cluster, node, [(type, vmid)]) units of every guest, interleaved
+        so the nodes are swept side by side. Clusters whose inventory
+        failed are left in errors.
+        """
+        per_node = []
+        self.errors = {}
+        for name, prox in self.clients.items():
+            data = prox.connect('get', 'cluster/resources', {'type': 'vm'})
+            resources = (data or {}).get('data')
+            if not isinstance(resources, list):
+                self.errors[name] = (data or {}).get('status')
+                continue
+            nodes = {}
+            for resource in resources:
+                if resource.get('type') in ('qemu', 'lxc') and not resource.get('template'):
+                    nodes.setdefault(resource['node'], []).append((resource['type'],
+                                                                   resource['vmid']))
+            for node, guests in sorted(nodes.items()):
+                per_node.append([(name, node, guests[start:start + self.chunk])
+                                 for start in range(0, len(guests), self.chunk)])
+        units = []
+        for position in range(max((len(chunks) for chunks in per_node), default=0)):
+            units.extend(chunks[position] for chunks in per_node if position < len(chunks))
+        return units
+
+    def run(self, transform=None, units=None, raw=False):
+        """
+        Sweep the units (all guests by default). Yields SweepResults as they
+        come, items decoded (or transformed) unless raw.
+        """
+        units = self.units() if units is None else units
+        if not units:
+            return
+        clusters = {name: (prox.base_url, prox.ticket) for name, prox in self.clients.items()}
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(min(self.processes, len(units)), _init_worker,
+                          (clusters, self.threads, self.timeout)) as pool:
+            for results in pool.imap_unordered(
+                    _sweep_unit, [(cluster, node, guests, self.items, transform, raw)
+                                  for cluster, node, guests in units]):
+                yield from results
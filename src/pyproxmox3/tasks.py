@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Task helpers for the Proxmox API.
+
+Most mutating calls (start, clone, migrate...) answer with a UPID, the id of
+the worker task doing the job on the node. A TaskFuture wraps that UPID and
+resolves with the final task status once the task has stopped:
+
+task = b.start_virtual_machine('vnode01', 101, future=True)
+task.add_done_callback(lambda t: print(t.result()['exitstatus']))
+status = task.wait(timeout=60)
+"""
+
+import time
+import threading
+from concurrent.futures import Future, InvalidStateError, wait
+import requests
+from .ratelimit import RateLimitExceeded
+from .upid import parse_upid
+
+
+# (first poll interval, max poll interval) in seconds, per task type.
+# Power operations are usually done in well under a second, clones and
+# migrations take minutes and backups can take hours.
+TASK_POLL_INTERVALS = {
+    'qmstart': (0.1, 1.0),
+    'qmstop': (0.1, 1.0),
+    'qmreset': (0.1, 1.0),
+    'qmsuspend': (0.1, 1.0),
+    'qmresume': (0.1, 1.0),
+    'qmshutdown': (0.5, 5.0),
+    'vzstart': (0.2, 2.0),
+    'vzstop': (0.2, 2.0),
+    'vzshutdown': (0.5, 5.0),
+    'qmcreate': (0.5, 5.0),
+    'vzcreate': (1.0, 10.0),
+    'qmdestroy': (0.5, 5.0),
+    'vzdestroy': (0.5, 5.0),
+    'qmsnapshot': (0.5, 5.0),
+    'qmdelsnapshot': (0.5, 5.0),
+    'qmrollback': (0.5, 5.0),
+    'qmclone': (1.0, 10.0),
+    'qmigrate': (2.0, 15.0),
+    'vzmigrate': (2.0, 15.0),
+    'vzdump': (5.0, 30.0),
+    'startall': (1.0, 10.0),
+    'stopall': (1.0, 10.0),
+    'migrateall': (2.0, 15.0),
+}
+DEFAULT_POLL_INTERVAL = (0.5, 5.0)
+POLL_BACKOFF = 1.5
+# status reads failing in a row before a TaskFuture gives up on its task
+MAX_STATUS_FAILURES = 10
+
+
+def poll_intervals(upid):
+    """Yield the successive poll intervals for a task, growing up to the max."""
+    interval, max_interval = TASK_POLL_INTERVALS.get(parse_upid(upid).type,
+                                                     DEFAULT_POLL_INTERVAL)
+    while True:
+        yield interval
+        interval = min(interval * POLL_BACKOFF, max_interval)
+
+
+def _when_allowed(read, *args, stop=None):
+    """
+    read(*args) once the rate limiter of the client lets it through: a refused
+    read is not a failed one, it waits for the limiter's retry delay. None
+    when stop (an Event) is set meanwhile.
+    """
+    while True:
+        try:
+            return read(*args)
+        except RateLimitExceeded as error:
+            if stop is None:
+                time.sleep(error.wait)
+            elif stop.wait(error.wait):
+                return None
+
+
+class TaskFuture(Future):
+    """
+    A concurrent.futures.Future bound to a Proxmox task.
+
+    The future resolves with the task status dict (status, exitstatus, type,
+    node, upid...) once the task has stopped, whatever its exit status:
+    use ok() or check 'exitstatus' to know if it succeeded.
+
+    With poll=True (default) a daemon thread polls the task status with a
+    backoff tuned to the task type. With poll=False someone else (e.g. a
+    TaskTracker) is expected to resolve it. After max_failures status reads
+    failing in a row (unknown task, node gone...) the future fails with an
+    AssertionError instead of polling forever. Reads refused by the rate
+    limiter of the client wait for it and do not count as failures.
+    """
+    def __init__(self, prox, upid, node=None, poll=True, max_failures=MAX_STATUS_FAILURES):
+        super().__init__()
+        self.prox = prox
+        self.upid = str(upid)
+        self.node = node or parse_upid(upid).node
+        self.max_failures = max_failures
+        self._failures = 0
+        self._stop_poll = threading.Event()
+        if poll:
+            self._poller = threading.Thread(target=self._poll, daemon=True,
+                                            name='task-{}'.format(parse_upid(upid).type))
+            self._poller.start()
+
+    def __repr__(self):
+        return '<TaskFuture {} done={}>'.format(self.upid, self.done())
+
+    def wait(self, timeout=None):
+        """Block until the task stopped. Returns the task status, raises TimeoutError."""
+        return self.result(timeout)
+
+    def ok(self):
+        """True if the task is finished and exited with OK."""
+        return self.done() and not self.cancelled() and self.result().get('exitstatus') == 'OK'
+
+    def cancel(self):
+        """Stop watching the task. The task itself keeps running on the node."""
+        self._stop_poll.set()
+        return super().cancel()
+
+    def fetch_status(self):
+        """
+        Read the task status once. Returns a dict or None if it can't be
+        read, raises RateLimitExceeded when the rate limiter refused it.
+        """
+        try:
+            data = self.prox.connect('get', 'nodes/{}/tasks/{}/status'.format(self.node,
+                                                                              self.upid), None)
+        except requests.RequestException:
+            return None
+        if not data or not isinstance(data.get('data'), dict):
+            return None
+        return data['data']
+
+    def set_status(self, status):
+        """Resolve the future with a task status, if not already done."""
+        self._stop_poll.set()
+        try:
+            self.set_result(status)
+        except InvalidStateError:
+            pass
+
+    def count_read(self, ok):
+        """
+        Account a status read that succeeded or not. The future fails after
+        max_failures failed reads in a row. Returns True when it failed.
+        """
+        if ok:
+            self._failures = 0
+            return False
+        self._failures += 1
+        if self._failures < self.max_failures:
+            return False
+        self._stop_poll.set()
+        try:
+            self.set_exception(AssertionError(
+                'Task Error: status unreadable {} times in a row: \n {}'.format(
+                    self._failures, self.upid)))
+        except InvalidStateError:
+            pass
+        return True
+
+    def _poll(self):
+        """Poll the task status until it stopped, waiting between polls."""
+        for interval in poll_intervals(self.upid):
+            if self._stop_poll.wait(interval):
+                return
+            status = _when_allowed(self.fetch_status, stop=self._stop_poll)
+            if self._stop_poll.is_set():
+                return
+            if self.count_read(status is not None):
+                return
+            if status and status.get('status') == 'stopped':
+                self.set_status(status)
+                return
+
+
+class TaskTracker:
+    """
+    Watch many tasks with a single poller thread.
+
+    Tracked tasks are grouped by node. Each cycle lists the node active tasks
+    once ('nodes/{node}/tasks' with source=active) and only reads the status
+    of the tracked tasks missing from that listing or marked as ended in it.
+    Each TaskFuture resolves as soon as its task is seen stopped, or fails
+    once its status (or its node listing) could not be read max_failures
+    times in a row. Reads refused by the rate limiter of the client wait
+    for it, like the TaskFuture polls.
+
+    tracker = TaskTracker(b)
+    tasks = [b.start_virtual_machine(node, vmid, future=tracker) for ...]
+    tracker.wait_all(timeout=600)
+    """
+    def __init__(self, prox, interval=0.5, max_interval=10.0):
+        self.prox = prox
+        self.interval = interval
+        self.max_interval = max_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._next_poll = 0
+        self._thread = None
+
+    def pending(self):
+        """Number of tasks still tracked."""
+        with self._lock:
+            return sum(len(tasks) for tasks in self._pending.values())
+
+    def track(self, upid, node=None):
+        """Start tracking a UPID. Returns its TaskFuture."""
+        task = TaskFuture(self.prox, upid, node, poll=False)
+        with self._lock:
+            self._pending.setdefault(task.node, {})[task.upid] = task
+            # a new task brings the next poll back to the shortest interval
+            self._next_poll = min(self._next_poll, time.monotonic() + self.interval)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='task-tracker')
+                self._thread.start()
+        self._wakeup.set()
+        return task
+
+    def futures(self):
+        """All TaskFuture still pending."""
+        with self._lock:
+            return [task for tasks in self._pending.values() for task in tasks.values()]
+
+    def wait_all(self, timeout=None):
+        """Wait for the pending tasks. Returns (done, not_done) like concurrent.futures.wait."""
+        return wait(self.futures(), timeout)
+
+    def poll_once(self):
+        """Run one polling cycle over all nodes. Returns the number of tasks resolved."""
+        resolved = 0
+        with self._lock:
+            nodes = {node: dict(tasks) for node, tasks in self._pending.items() if tasks}
+        for node, tasks in nodes.items():
+            running = _when_allowed(self._active_upids, node, len(tasks))
+            if running is None:
+                # a node that cannot be listed counts against its tasks
+                for upid, task in tasks.items():
+                    if task.count_read(False):
+                        self._forget(node, upid)
+                        resolved += 1
+                continue
+            for upid, task in tasks.items():
+                if task.done():
+                    self._forget(node, upid)
+                    continue
+                if upid in running:
+                    task.count_read(True)
+                    continue
+                status = _when_allowed(task.fetch_status)
+                if task.count_read(status is not None):
+                    self._forget(node, upid)
+                    resolved += 1
+                elif status is not None and status.get('status') == 'stopped':
+                    task.set_status(status)
+                    self._forget(node, upid)
+                    resolved += 1
+        return resolved
+
+    def _active_upids(self, node, count):
+        """UPIDs listed as still running on a node, or None if the listing failed."""
+        try:
+            data = self.prox.connect('get', 'nodes/{}/tasks'.format(node),
+                                     {'source': 'active', 'limit': max(500, 2 * count)})
+        except requests.RequestException:
+            return None
+        if not data or not isinstance(data.get('data'), list):
+            return None
+        return {entry['upid'] for entry in data['data']
+                if 'upid' in entry and not entry.get('endtime')}
+
+    def _forget(self, node, upid):
+        with self._lock:
+            tasks = self._pending.get(node)
+            if tasks is not None:
+                tasks.pop(upid, None)
+                if not tasks:
+                    del self._pending[node]
+
+    def _run(self):
+        """Poll until there is nothing left to track."""
+        interval = self.interval
+        while True:
+            delay = self._next_poll - time.monotonic()
+            if delay > 0:
+                self._wakeup.wait(delay)
+                self._wakeup.clear()
+                continue
+            if self.poll_once():
+                interval = self.interval
+            else:
+                interval = min(interval * POLL_BACKOFF, self.max_interval)
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+                self._next_poll = max(self._next_poll, time.monotonic() + interval)
+
+
+def follow_task_log(prox, upid, node=None, start=0, limit=500, interval=0.5, max_interval=10.0):
+    """
+    Yield the lines of a task log as they are written, then stop once the
+    task has stopped and its last lines were read.
+
+    Only new lines are fetched, using the start/limit offsets of the log
+    endpoint. The poll interval shrinks while the log is active and backs
+    off up to max_interval while it is quiet; the task status is only read
+    when a poll brought nothing new.
+
+    for line in follow_task_log(b, upid):
+        print(line)
+    """
+    upid = parse_upid(upid)
+    node = node or upid.node
+    log_url = 'nodes/{}/tasks/{}/log'.format(node, upid.upid)
+    status_url = 'nodes/{}/tasks/{}/status'.format(node, upid.upid)
+    offset = start
+    wait_time = interval
+    finished = False
+    while True:
+        data = prox.connect('get', log_url, {'start': offset, 'limit': limit})
+        lines = (data.get('data') if data else None) or []
+        if offset == 0 and lines == [{'n': 1, 't': 'no content'}]:
+            # an empty log is answered with this filler line, not a real line 1
+            lines = []
+        # 'n' is the 1 based line number
+        new_lines = [line for line in lines if line.get('n', 0) > offset]
+        if new_lines:
+            for line in new_lines:
+                yield line.get('t', '')
+            offset = new_lines[-1]['n']
+            if len(lines) >= limit:
+                # more lines already waiting, read them right away
+                continue
+            wait_time = max(interval, wait_time / 2)
+        elif finished:
+            return
+        else:
+            status = prox.connect('get', status_url, None)
+            if status and isinstance(status.get('data'), dict) and \
+                    status['data'].get('status') == 'stopped':
+                # one last read for the lines written before it stopped
+                finished = True
+                continue
+            wait_time = min(wait_time * POLL_BACKOFF, max_interval)
+        if finished:
+            continue
+        time.sleep(wait_time)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Request transports.
+
+By default PyProxmox.connect sends each request with the requests module
+functions. Setting a transport on the client sends them through it
+instead:
+
+b.transport = Transport()          # pooled keep-alive connections
+b.transport = TimingTransport()    # same, plus a timing breakdown per request
+
+TimingTransport records the phases of every request in a 'timing' dict:
+dns, connect, tls (all 0 when a pooled connection is reused), send
+(writing the request), ttfb (request sent to response headers), download
+(response body), decode (JSON parsing, added by connect) and client (the
+rest: preparing the request, pool checkout...). The dict is returned with the
+result under 'timing' and given to the Instrumentation hooks, which sum it
+per endpoint (see Instrumentation.timing_report).
+"""
+
+import time
+import socket
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+PHASES = ('dns', 'connect', 'tls', 'send', 'ttfb', 'download', 'decode', 'client')
+
+# timing dict of the request being sent by the current thread
+_CURRENT = threading.local()
+
+
+class Transport:
+    """
+    Send requests through a requests Session, keeping up to pool_size
+    connections open per host.
+    """
+    def __init__(self, pool_size=10, verify=False):
+        self.verify = verify
+        self.session = requests.Session()
+        adapter = self.adapter(pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @staticmethod
+    def adapter(pool_size):
+        """The HTTPAdapter mounted on the session."""
+        return HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def request(self, method, url, params=None, data=None, cookies=None, headers=None,
+                timeout=None):
+        """Send one request. Returns the requests response."""
+        return self.session.request(method.upper(), url, params=params, data=data,
+                                    cookies=cookies, headers=headers, verify=self.verify,
+                                    timeout=timeout)
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+
+class _TimedConnectionMixin:
+    """Record dns, connect, send, ttfb in the timing dict of the current thread."""
+    def _new_conn(self):
+        timing = getattr(_CURRENT, 'timing', None)
+        if timing is None:
+            return super()._new_conn()
+        host = self._dns_host
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            addresses = None
+        resolved = time.perf_counter()
+        timing['dns'] = resolved - start
+        # connect to the addresses just resolved in turn, not resolving them twice
+        candidates = list(dict.fromkeys(address[4][0] for address in addresses or ())) or [host]
+        try:
+            for position, address in enumerate(candidates):
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()
+                    break
+                except (NewConnectionError, ConnectTimeoutError):
+                    if position == len(candidates) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+        timing['connect'] = time.perf_counter() - resolved
+        return sock
+
+    def request(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        timing = getattr(_CURRENT, 'timing', None)
+        if timing is None:
+            return super().request(*args, **kwargs)
+        # a new connection may be opened inside: its phases are not sending
+        opening = timing['dns'] + timing['connect'] + timing['tls']
+        start = time.perf_counter()
+        result = super().request(*args, **kwargs)
+        opened = timing['dns'] + timing['connect'] + timing['tls'] - opening
+        timing['send'] = max(0.0, time.perf_counter() - start - opened)
+        return result
+
+    def getresponse(self, *args, **kwargs):
+        timing = getattr(_CURRENT, 'timing', None)
+        start = time.perf_counter()
+        response = super().getresponse(*args, **kwargs)
+        if timing is not None:
+            timing['ttfb'] = time.perf_counter() - start
+        return response
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        timing = getattr(_CURRENT, 'timing', None)
+        start = time.perf_counter()
+        super().connect()
+        if timing is not None:
+            timing['tls'] = max(0.0, time.perf_counter() - start - timing['dns'] -
+                                timing['connect'])
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimingAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections record their phases."""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _TimedHTTPConnectionPool,
+                                                   'https': _TimedHTTPSConnectionPool}
+
+
+class TimingTransport(Transport):
+    """Transport recording the timing breakdown of each request as response.timing."""
+    @staticmethod
+    def adapter(pool_size):
+        return TimingAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def request(self, method, url, params=None, data=None, cookies=None, headers=None,
+                timeout=None):
+        timing = dict.fromkeys(PHASES, 0.0)
+        _CURRENT.timing = timing
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method.upper(), url, params=params, data=data,
+                                            cookies=cookies, headers=headers,
+                                            verify=self.verify, stream=True, timeout=timeout)
+            headers_received = time.perf_counter()
+            response.content  # pylint: disable=pointless-statement
+        finally:
+            _CURRENT.timing = None
+        end = time.perf_counter()
+        timing['download'] = end - headers_received
+        timing['client'] = max(0.0, headers_received - start - timing['dns'] -
+                               timing['connect'] - timing['tls'] - timing['send'] -
+                               timing['ttfb'])
+        timing['total'] = end - start
+        response.timing = timing
+        return response
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UPID parsing.
+
+A UPID identifies a worker task and already carries the node it runs on:
+
+UPID:vnode01:0000A1B2:0123ABCD:60A1B2C3:qmstart:101:root@pam:
+     node    pid      pstart   starttime type   id  user
+
+pid, pstart and starttime are hex encoded.
+"""
+
+
+class UPID:
+    """
+    A parsed UPID. Compares and hashes like its string so it can be used
+    wherever the raw UPID string is expected (dict keys, sets, urls).
+    """
+    __slots__ = ('upid', 'node', 'pid', 'pstart', 'starttime', 'type', 'id', 'user')
+
+    def __init__(self, upid, node, pid, pstart, starttime, task_type, task_id, user):
+        self.upid = upid
+        self.node = node
+        self.pid = pid
+        self.pstart = pstart
+        self.starttime = starttime
+        self.type = task_type
+        self.id = task_id
+        self.user = user
+
+    def __str__(self):
+        return self.upid
+
+    def __repr__(self):
+        return 'UPID({!r})'.format(self.upid)
+
+    def __eq__(self, other):
+        if isinstance(other, UPID):
+            return self.upid == other.upid
+        return self.upid == other
+
+    def __hash__(self):
+        return hash(self.upid)
+
+
+def parse_upid(upid):
+    """Parse a UPID string. Returns a UPID, raises ValueError if malformed."""
+    if isinstance(upid, UPID):
+        return upid
+    parts = upid.split(':', 8)
+    if len(parts) < 8 or parts[0] != 'UPID':
+        raise ValueError('Malformed UPID: {}'.format(upid))
+    return UPID(upid, parts[1], int(parts[2], 16), int(parts[3], 16), int(parts[4], 16),
+                parts[5], parts[6], parts[7])
+
+
+def parse_upids(upids):
+    """Parse a list of UPID strings. Returns a list of UPID."""
+    return [parse_upid(upid) for upid in upids]
+
+
+def upids_by_node(upids):
+    """Group UPIDs by node. Returns {node: [UPID, ...]}."""
+    nodes = {}
+    for upid in parse_upids(upids):
+        nodes.setdefault(upid.node, []).append(upid)
+    return nodes
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local VMID allocation.
+
+'cluster/nextid' always answers the lowest free id, so concurrent
+provisioners get the same one. VmidAllocator reads the used ids once from
+'cluster/resources' into a bitmap and hands out free ids from it, with a
+lease table so that workers of the same process never get the same id:
+
+allocator = VmidAllocator(b, ranges={'tenant-a': (10000, 19999)})
+vmid = allocator.allocate('tenant-a')
+...create the VM...
+allocator.confirm(vmid)     # or allocator.release(vmid) if not created
+
+The cluster is only read again when a collision is reported.
+"""
+
+import time
+import threading
+
+MIN_VMID = 100
+MAX_VMID = 999999
+
+
+class VmidAllocator:
+    """
+    Hand out free vmids from a bitmap of the ids in use.
+
+    ranges maps a tenant name to an inclusive (low, high) vmid range; the
+    None tenant gets the whole low..high range. Each range keeps a cursor so
+    an allocation only looks at the bits following the last id handed out.
+    Leases not confirmed nor released after lease_time seconds are taken
+    back when a range runs out of ids.
+    """
+    def __init__(self, prox, ranges=None, low=MIN_VMID, high=MAX_VMID, lease_time=3600):
+        self.prox = prox
+        self.low = low
+        self.high = high
+        self.lease_time = lease_time
+        self.ranges = {None: (low, high)}
+        for tenant, (range_low, range_high) in (ranges or {}).items():
+            if range_low < low or range_high > high or range_low > range_high:
+                raise ValueError('VMID range {}-{} of {} is out of {}-{}'.format(
+                    range_low, range_high, tenant, low, high))
+            self.ranges[tenant] = (range_low, range_high)
+        self.leases = {}
+        self._cursors = {tenant: bounds[0] for tenant, bounds in self.ranges.items()}
+        self._lock = threading.Lock()
+        self._used = None
+        self._taken = None
+
+    def sync(self):
+        """(Re)load the ids in use from 'cluster/resources'."""
+        data = self.prox.connect('get', 'cluster/resources', {'type': 'vm'})
+        used = bytearray((self.high - self.low) // 8 + 1)
+        for resource in (data or {}).get('data') or []:
+            vmid = resource.get('vmid')
+            if vmid is not None and self.low <= vmid <= self.high:
+                index = vmid - self.low
+                used[index >> 3] |= 1 << (index & 7)
+        with self._lock:
+            self._used = used
+            self._taken = bytearray(used)
+            for vmid in self.leases:
+                self._set(self._taken, vmid)
+            self._cursors = {tenant: bounds[0] for tenant, bounds in self.ranges.items()}
+
+    def allocate(self, tenant=None):
+        """Lease a free vmid from the tenant range. Raises LookupError if the range is full."""
+        if self._taken is None:
+            self.sync()
+        with self._lock:
+            vmid = self._find(tenant)
+            if vmid is None:
+                self._expire_leases()
+                self._cursors[tenant] = self.ranges[tenant][0]
+                vmid = self._find(tenant)
+            if vmid is None:
+                raise LookupError('No free VMID left in range {}-{}'.format(*self.ranges[tenant]))
+            self._set(self._taken, vmid)
+            self.leases[vmid] = (tenant, time.monotonic() + self.lease_time)
+            self._cursors[tenant] = vmid + 1
+            return vmid
+
+    def allocate_many(self, count, tenant=None):
+        """Lease count free vmids. Returns a list of int."""
+        return [self.allocate(tenant) for _ in range(count)]
+
+    def confirm(self, vmid):
+        """The guest was created: the id is now used for good."""
+        with self._lock:
+            self.leases.pop(vmid, None)
+            if self._used is not None and self.low <= vmid <= self.high:
+                self._set(self._used, vmid)
+
+    def release(self, vmid):
+        """The id was not used (creation failed or cancelled), give it back."""
+        with self._lock:
+            self.leases.pop(vmid, None)
+            if self._taken is not None and not self._get(self._used, vmid):
+                self._clear(self._taken, vmid)
+                for tenant, (low, high) in self.ranges.items():
+                    if low <= vmid <= high and vmid < self._cursors[tenant]:
+                        self._cursors[tenant] = vmid
+
+    def report_collision(self, vmid):
+        """The id turned out to be used by someone else: forget the lease and resync."""
+        with self._lock:
+            self.leases.pop(vmid, None)
+        self.sync()
+
+    def _find(self, tenant):
+        """First free id from the tenant cursor, or None."""
+        low, high = self.ranges[tenant]
+        taken = self._taken
+        index = max(self._cursors[tenant], low) - self.low
+        last = high - self.low
+        while index <= last:
+            byte = taken[index >> 3]
+            if byte == 0xFF:
+                # whole byte taken, jump to the next one
+                index = (index | 7) + 1
+                continue
+            if not byte & (1 << (index & 7)):
+                return index + self.low
+            index += 1
+        return None
+
+    def _expire_leases(self):
+        now = time.monotonic()
+        for vmid, (_, expires) in list(self.leases.items()):
+            if expires < now:
+                del self.leases[vmid]
+                if not self._get(self._used, vmid):
+                    self._clear(self._taken, vmid)
+
+    def _get(self, bits, vmid):
+        index = vmid - self.low
+        return bits[index >> 3] & (1 << (index & 7))
+
+    def _set(self, bits, vmid):
+        index = vmid - self.low
+        bits[index >> 3] |= 1 << (index & 7)
+
+    def _clear(self, bits, vmid):
+        index = vmid - self.low
+        bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
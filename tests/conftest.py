@@ -0,0 +1,23 @@
+"""Fixtures serving a FakeCluster, so the tests need no real Proxmox."""
+
+import pytest
+from pyproxmox3.fakeapi import FakeCluster, FakeProxmoxServer
+
+
+@pytest.fixture
+def cluster():
+    """A small cluster whose tasks complete quickly."""
+    return FakeCluster(nodes=3, guests_per_node=4, task_duration=0.2, seed=1)
+
+
+@pytest.fixture
+def server(cluster):
+    """The cluster served on a free local port."""
+    with FakeProxmoxServer(cluster) as fake:
+        yield fake
+
+
+@pytest.fixture
+def client(server):
+    """A PyProxmox logged in on the fake server."""
+    return server.client()
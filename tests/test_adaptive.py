@@ -0,0 +1,92 @@
+"""AdaptiveLimiter AIMD limits."""
+
+import threading
+import pytest
+from pyproxmox3 import AdaptiveLimiter, BulkPower, Instrumentation
+
+
+def test_grows_while_healthy_and_used():
+    limiter = AdaptiveLimiter(initial=2, maximum=6)
+    for _ in range(200):
+        limiter.observe('pve1', 0.01, inflight=limiter.limit('pve1'))
+    assert limiter.limit('pve1') == 6
+    assert limiter.snapshot()['pve1']['increases'] == 4
+
+
+def test_unused_limit_does_not_grow():
+    limiter = AdaptiveLimiter(initial=8)
+    for _ in range(100):
+        limiter.observe('pve1', 0.01, inflight=1)
+    assert limiter.limit('pve1') == 8
+
+
+def test_failures_back_off_once_per_round():
+    limiter = AdaptiveLimiter(initial=8, minimum=2)
+    assert limiter.observe('pve1', 0.01, status=596, inflight=8) == 4
+    # the 7 other requests in flight at that time fail too: no further decrease
+    for _ in range(7):
+        assert limiter.observe('pve1', 0.01, status=500, inflight=8) == 4
+    assert limiter.observe('pve1', 0.01, status=None, inflight=4) == 2
+    assert limiter.observe('pve1', 0.01, status=None, inflight=1) == 2
+    assert limiter.observe('pve1', 0.01, status=None, inflight=1) == 2
+    snapshot = limiter.snapshot()['pve1']
+    assert snapshot['decreases'] == 2 and snapshot['failures'] == 11
+
+
+def test_latency_over_tolerance_is_congestion():
+    limiter = AdaptiveLimiter(initial=8, tolerance=2.0, smoothing=1.0)
+    limiter.observe('pve1', 0.01, inflight=1)
+    assert limiter.healthy('pve1') == pytest.approx(0.02)
+    assert limiter.observe('pve1', 0.05, inflight=1) == 4
+    fixed = AdaptiveLimiter(initial=8, target=0.1, smoothing=1.0)
+    assert fixed.observe('pve1', 0.05, inflight=1) == 8
+    assert fixed.observe('pve1', 0.2, inflight=1) == 4
+
+
+def test_bad_limits():
+    with pytest.raises(ValueError):
+        AdaptiveLimiter(initial=8, maximum=4)
+    with pytest.raises(ValueError):
+        AdaptiveLimiter(backoff=1.5)
+
+
+def test_slots_wait_for_the_limit():
+    limiter = AdaptiveLimiter(initial=1)
+    assert limiter.acquire('pve1')
+    assert not limiter.acquire('pve1', timeout=0.05)
+    # other keys have their own limit
+    assert limiter.acquire('pve2', timeout=0.05)
+    waiter = threading.Thread(target=limiter.acquire, args=('pve1',))
+    waiter.start()
+    limiter.release('pve1')
+    waiter.join(5)
+    assert not waiter.is_alive()
+    assert limiter.snapshot()['pve1']['inflight'] == 1
+
+
+def test_slot_exception_is_a_failure():
+    limiter = AdaptiveLimiter(initial=4)
+    with pytest.raises(RuntimeError):
+        with limiter.slot('pve1'):
+            raise RuntimeError('connection reset')
+    with limiter.slot('pve1') as slot:
+        slot.status = 503
+    snapshot = limiter.snapshot()['pve1']
+    # one request at a time: each failure is a round of its own
+    assert snapshot['failures'] == 2 and snapshot['decreases'] == 2
+    assert snapshot['inflight'] == 0
+    assert 'pyproxmox_client_concurrency_limit{limiter="adaptive",key="pve1"} 1' in \
+        limiter.openmetrics()
+
+
+def test_drives_bulk_power_and_hooks(cluster, client):
+    limiter = AdaptiveLimiter(initial=1, maximum=4)
+    client.instrumentation = Instrumentation()
+    client.instrumentation.add_hooks(post=limiter.hook(
+        lambda info: info['path'].split('/')[1] if info['path'].startswith('nodes/') else None))
+    with BulkPower(client, adaptive=limiter) as bulk:
+        result = bulk.run('stop', sorted(cluster.guests))
+        _, not_done = result.wait(timeout=60)
+    assert not not_done and result.failed() == {}
+    assert set(limiter.limits()) >= set(cluster.nodes)
+    assert all(state['samples'] > 0 for state in limiter.snapshot().values())
@@ -0,0 +1,84 @@
+"""AddressIndex against the fake API."""
+
+import ipaddress
+import pytest
+import requests
+from pyproxmox3 import AddressIndex
+from pyproxmox3.addresses import agent_addresses, config_addresses
+from pyproxmox3.fakeapi import FakeCluster, FakeProxmoxServer
+
+
+@pytest.fixture
+def guests():
+    """A VM with an agent, one without, a stopped VM and a container."""
+    cluster = FakeCluster(nodes=2, guests_per_node=0)
+    cluster.add_guest(100, 'pve1', status='running')
+    cluster.add_guest(101, 'pve1', status='running', agent='missing',
+                      config={'ipconfig0': 'ip=192.168.1.101/24,gw=192.168.1.1'})
+    cluster.add_guest(102, 'pve2')
+    cluster.add_guest(103, 'pve2', kind='lxc', status='running')
+    with FakeProxmoxServer(cluster) as server:
+        yield server
+
+
+def test_config_and_agent_addresses():
+    qemu = config_addresses('qemu', {'net0': 'virtio=BC:24:11:00:00:64,bridge=vmbr0',
+                                     'ipconfig0': 'ip=10.0.0.5/24,ip6=dhcp'})
+    assert qemu == [('net0', 'bc:24:11:00:00:64', ipaddress.ip_address('10.0.0.5'))]
+    lxc = config_addresses('lxc', {'net0': 'name=eth0,hwaddr=BC:24:11:00:00:65,ip=dhcp'})
+    assert lxc == [('eth0', 'bc:24:11:00:00:65', None)]
+    agent = agent_addresses([{'name': 'lo', 'hardware-address': '00:00:00:00:00:00',
+                              'ip-addresses': [{'ip-address': '127.0.0.1'}]},
+                             {'name': 'eth0', 'hardware-address': 'BC:24:11:00:00:64',
+                              'ip-addresses': [{'ip-address': 'fe80::1'},
+                                               {'ip-address': '10.0.0.5'}]}])
+    assert agent == [('eth0', 'bc:24:11:00:00:64', ipaddress.ip_address('10.0.0.5'))]
+
+
+def test_lookups(guests):
+    index = AddressIndex(guests.client(), agent=None)
+    assert index.refresh() == {'read': 4, 'removed': 0, 'guests': 4}
+    assert {vmid: record['source'] for vmid, record in index.guests.items()} == {
+        100: 'agent', 101: 'config', 102: 'config', 103: 'config'}
+    address = guests.cluster.guests[100]['address']
+    assert [record['vmid'] for record in index.by_ip(address)] == [100]
+    assert [record['vmid'] for record in index.by_ip('fd00::64')] == [100]
+    assert [record['vmid'] for record in index.by_ip('192.168.1.101')] == [101]
+    assert [record['vmid'] for record in index.by_mac('BC:24:11:00:00:66')] == [102]
+    assert index.by_ip('10.9.9.9') == []
+    network = index.in_network('10.2.0.0/16')
+    assert {str(ip): [record['vmid'] for record in records]
+            for ip, records in network.items()} == {guests.cluster.guests[103]['address']: [103]}
+
+
+def test_refresh_is_incremental(guests):
+    cluster = guests.cluster
+    index = AddressIndex(guests.client())
+    index.refresh()
+    assert index.refresh()['read'] == 0
+    with cluster.lock:
+        cluster.guests[102]['status'] = 'running'
+        del cluster.guests[103]
+    assert index.refresh() == {'read': 1, 'removed': 1, 'guests': 3}
+    assert index.guests[102]['source'] == 'agent'
+    assert index.by_ip(cluster.address('pve2', 103)) == []
+    assert index.refresh(full=True)['read'] == 3
+
+
+def test_failed_config_read_is_retried(guests):
+    client = guests.client()
+    connect = client.connect
+
+    def flaky(conn_type, option, post_data, timeout=None):
+        if option.endswith('/qemu/102/config'):
+            raise requests.ConnectionError('connection reset')
+        return connect(conn_type, option, post_data, timeout)
+
+    client.connect = flaky
+    index = AddressIndex(client)
+    assert index.refresh()['guests'] == 4
+    assert index.guests[102]['source'] is None
+    assert index.by_mac('bc:24:11:00:00:66') == []
+    client.connect = connect
+    assert index.refresh()['read'] == 1
+    assert [record['vmid'] for record in index.by_mac('bc:24:11:00:00:66')] == [102]
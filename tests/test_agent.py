@@ -0,0 +1,72 @@
+"""BulkAgent against the fake API."""
+
+import time
+import pytest
+from pyproxmox3 import BulkAgent
+from pyproxmox3.agent import agent_enabled
+from pyproxmox3.fakeapi import FakeCluster, FakeProxmoxServer
+
+
+@pytest.fixture
+def agents():
+    """One running VM per agent state, plus a stopped one."""
+    cluster = FakeCluster(nodes=2, guests_per_node=0)
+    cluster.add_guest(100, 'pve1', status='running')
+    cluster.add_guest(101, 'pve1', status='running', agent='off')
+    cluster.add_guest(102, 'pve2', status='running', agent='missing')
+    cluster.add_guest(103, 'pve2', status='running', agent='hung')
+    cluster.add_guest(104, 'pve2')
+    with FakeProxmoxServer(cluster, hang=5.0) as server:
+        yield server
+
+
+def test_agent_enabled():
+    assert agent_enabled({'agent': '1'})
+    assert agent_enabled({'agent': 'enabled=1,fstrim_cloned_disks=1'})
+    assert not agent_enabled({'agent': 'fstrim_cloned_disks=1,enabled=0'})
+    assert not agent_enabled({})
+
+
+def test_states_and_per_vm_timeout(agents):
+    agent = BulkAgent(agents.client(), timeout=0.5)
+    start = time.monotonic()
+    results = agent.query(('get-osinfo', 'network-get-interfaces'))
+    # the hung agent costs its own timeout, not the pveproxy one
+    assert time.monotonic() - start < 3
+    assert {vmid: entry['state'] for vmid, entry in results.items()} == {
+        100: 'ok', 101: 'disabled', 102: 'failed', 103: 'failed', 104: 'stopped'}
+    assert set(results[100]['data']) == {'get-osinfo', 'network-get-interfaces'}
+    assert 'timeout' in results[103]['error']
+    assert set(agent.negative()) == {102, 103}
+
+
+def test_disabled_agents_are_not_asked(agents):
+    agent = BulkAgent(agents.client(), timeout=0.5)
+    agent.query('get-osinfo', vmids=[101])
+    asked = agents.requests
+    assert agent.query('get-osinfo', vmids=[101])[101]['state'] == 'disabled'
+    # the config setting is cached: only 'cluster/resources' is read again
+    assert agents.requests == asked + 1
+
+
+def test_dead_agents_are_skipped_until_the_cache_expires(agents):
+    agent = BulkAgent(agents.client(), timeout=0.5, negative_ttl=0.5)
+    agent.query('get-osinfo', vmids=[102])
+    cached = agent.query('get-osinfo', vmids=[102])[102]
+    assert cached['state'] == 'cached'
+    assert 'not running' in cached['error']
+    time.sleep(0.6)
+    assert agent.query('get-osinfo', vmids=[102])[102]['state'] == 'failed'
+    agent.forget(102)
+    assert agent.negative() == {}
+
+
+def test_other_errors_are_not_cached(agents):
+    agent = BulkAgent(agents.client(), timeout=0.5)
+    agent.query('get-osinfo', vmids=[100])
+    rule = agents.inject(r'/qemu/100/agent/', 500, "VM 100 is locked (backup)")
+    locked = agent.query('get-osinfo', vmids=[100])[100]
+    assert locked['state'] == 'failed' and 'locked' in locked['error']
+    agents.clear(rule)
+    assert agent.negative() == {}
+    assert agent.query('get-osinfo', vmids=[100])[100]['state'] == 'ok'
@@ -0,0 +1,70 @@
+"""Client benchmarks against the fake API."""
+
+import json
+import pytest
+from pyproxmox3 import benchmark
+from pyproxmox3.benchmark import MODES, WORKLOADS, percentile, run_case, run_jobs
+
+
+def case(server, workload, mode, concurrency=2):
+    return {'workload': workload, 'mode': mode, 'host': server.host, 'port': server.port,
+            'scheme': server.scheme, 'username': 'root@pam',
+            'password': server.cluster.users['root@pam'], 'iterations': 2,
+            'concurrency': concurrency}
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([3, 1, 2], 0) == 1
+    assert percentile([], 50) is None
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_modes_run_every_job(mode):
+    done = []
+    errors = run_jobs([lambda number=number: done.append(number) for number in range(20)],
+                      mode, 4)
+    assert errors == [] and sorted(done) == list(range(20))
+
+
+def test_job_errors_are_returned():
+    def broken():
+        raise RuntimeError('connection reset')
+    errors = run_jobs([broken, lambda: None, broken], 'threaded', 2)
+    assert len(errors) == 2 and all(isinstance(error, RuntimeError) for error in errors)
+    with pytest.raises(ValueError):
+        run_jobs([], 'fork', 1)
+
+
+@pytest.mark.parametrize('workload', WORKLOADS)
+def test_workloads(server, workload):
+    result = run_case(case(server, workload, 'threaded'))
+    assert result['workload'] == workload and result['concurrency'] == 2
+    assert result['jobs'] > 0 and result['calls'] >= result['jobs']
+    assert result['errors'] == 0
+    assert 0 < result['p50_ms'] <= result['p99_ms'] <= result['max_ms']
+
+
+def test_server_errors_are_counted(server):
+    server.inject(r'^nodes/[^/]+/status$', code=500)
+    result = run_case(case(server, 'inventory', 'sync'))
+    assert result['concurrency'] == 1
+    # one node status per node and iteration
+    assert result['errors'] == 2 * len(server.cluster.nodes)
+
+
+def test_command_line_report(tmp_path, capsys):
+    output = tmp_path / 'bench.json'
+    assert benchmark.main(['--workloads', 'inventory', '--modes', 'sync', '--nodes', '1',
+                           '--guests-per-node', '3', '--iterations', '1',
+                           '--output', str(output)]) == 0
+    report = json.loads(output.read_text())
+    assert [(result['workload'], result['mode']) for result in report['results']] == [
+        ('inventory', 'sync')]
+    assert report['parameters']['nodes'] == 1
+    assert 'inventory' in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        benchmark.main(['--workloads', 'backup'])
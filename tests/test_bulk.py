@@ -0,0 +1,66 @@
+"""BulkPower against the fake API."""
+
+import requests
+from pyproxmox3 import BulkPower
+
+
+def test_start_uses_one_task_per_node(cluster, client):
+    vmids = sorted(cluster.guests)
+    with BulkPower(client) as bulk:
+        result = bulk.start(vmids + [999])
+        _, not_done = result.wait(timeout=30)
+    assert not not_done and result.done()
+    # the guests of a node share its startall task
+    assert len({id(future) for future in result.futures.values()}) == len(cluster.nodes) + 1
+    assert list(result.failed()) == [999]
+    assert all(cluster.guests[vmid]['status'] == 'running' for vmid in vmids)
+
+
+def test_migrate_skips_guests_already_on_target(cluster, client):
+    vmids = sorted(cluster.guests)
+    already = [vmid for vmid in vmids if cluster.guests[vmid]['node'] == 'pve2']
+    for node_endpoints in (True, False):
+        with BulkPower(client) as bulk:
+            result = bulk.migrate(vmids, 'pve2', node_endpoints=node_endpoints)
+            result.wait(timeout=30)
+        assert result.failed() == {}
+        assert all(result.futures[vmid].result()['upid'] is None for vmid in already)
+        assert all(guest['node'] == 'pve2' for guest in cluster.guests.values())
+        already = vmids
+
+
+def test_connection_error_fails_only_its_node(cluster, client):
+    node_call = client.stop_all_node_guests
+
+    def stop_all(node, post_data=None, future=False):
+        if node == 'pve1':
+            raise requests.ConnectionError('connection refused')
+        return node_call(node, post_data, future=future)
+
+    client.stop_all_node_guests = stop_all
+    with BulkPower(client) as bulk:
+        result = bulk.stop(sorted(cluster.guests))
+        result.wait(timeout=30)
+    failed = {vmid for vmid, guest in cluster.guests.items() if guest['node'] == 'pve1'}
+    assert set(result.failed()) == failed
+    assert all(guest['status'] == 'stopped' for guest in cluster.guests.values()
+               if guest['node'] != 'pve1')
+
+
+def test_running_container_migrates_with_restart(cluster, client):
+    cluster.add_guest(900, 'pve1', kind='lxc', status='running')
+    cluster.add_guest(901, 'pve1', kind='qemu', status='running')
+    sent = []
+    migrate = client.migrate_lxc_container
+
+    def migrate_lxc(node, vmid, target, future=False, post_data=None):
+        sent.append(post_data)
+        return migrate(node, vmid, target, future=future, post_data=post_data)
+
+    client.migrate_lxc_container = migrate_lxc
+    with BulkPower(client) as bulk:
+        result = bulk.migrate([900, 901], 'pve3', node_endpoints=False)
+        result.wait(timeout=30)
+    assert result.failed() == {}
+    assert sent == [{'restart': 1}]
+    assert cluster.guests[900]['node'] == cluster.guests[901]['node'] == 'pve3'
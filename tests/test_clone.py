@@ -0,0 +1,69 @@
+"""ClonePipeline against the fake API."""
+
+from pyproxmox3 import ClonePipeline, VmidAllocator
+from pyproxmox3.clone import disk_storages
+
+
+def spy_clones(client):
+    """Record the clone parameters sent."""
+    sent = []
+    clone = client.clone_virtual_machine
+
+    def spy(node, vmid, post_data, future=False):
+        sent.append(dict(post_data))
+        return clone(node, vmid, post_data, future=future)
+
+    client.clone_virtual_machine = spy
+    return sent
+
+
+def test_disk_storages():
+    config = {'scsi0': 'ceph:vm-100-disk-0,size=32G', 'ide2': 'local:iso/d.iso,media=cdrom',
+              'efidisk0': 'local-lvm:vm-100-disk-1,size=4M', 'scsihw': 'virtio-scsi-pci'}
+    assert disk_storages(config) == {'ceph': ['ceph:vm-100-disk-0'],
+                                     'local-lvm': ['local-lvm:vm-100-disk-1']}
+
+
+def test_linked_clones_are_configured(cluster, client):
+    cluster.add_guest(9000, 'pve1', template=1)
+    sent = spy_clones(client)
+    names = ['web{:02}'.format(number) for number in range(6)]
+    with ClonePipeline(client, template_concurrency=2) as pipeline:
+        result = pipeline.clone('pve1', 9000, names, config={'cores': 4})
+    # close waited for the clones and their configuration
+    assert result.done() and result.failed() == {}
+    assert len(result.futures) == 6
+    assert all(data['full'] == 0 for data in sent)
+    for vmid in result.futures:
+        guest = cluster.guests[vmid]
+        assert guest['config']['cores'] == '4'
+        assert 'lock' not in guest['config'] and not guest['template']
+    assert sorted(cluster.guests[vmid]['config']['name'] for vmid in result.futures) == names
+
+
+def test_full_clones_to_a_storage(cluster, client):
+    cluster.add_guest(9000, 'pve1', template=1)
+    sent = spy_clones(client)
+    with ClonePipeline(client) as pipeline:
+        result = pipeline.clone('pve1', 9000, ['db01', 'db02'], storage='local-lvm',
+                                config=lambda newid, name: {'description': name})
+    assert result.failed() == {}
+    assert all(data['full'] == 1 and data['storage'] == 'local-lvm' for data in sent)
+    assert {cluster.guests[vmid]['config']['description'] for vmid in result.futures} == {
+        'db01', 'db02'}
+
+
+def test_collision_fails_the_clone_and_resyncs(cluster, client):
+    cluster.add_guest(9000, 'pve1', template=1)
+    allocator = VmidAllocator(client)
+    allocator.sync()
+    # created behind the allocator's back: its next free id is taken
+    taken = allocator.allocate()
+    allocator.release(taken)
+    cluster.add_guest(taken, 'pve2')
+    with ClonePipeline(client, allocator=allocator) as pipeline:
+        result = pipeline.clone('pve1', 9000, ['a', 'b'])
+    assert list(result.failed()) == [taken]
+    assert 'already exists' in result.failed()[taken]
+    assert taken not in allocator.leases
+    assert allocator.allocate() != taken
@@ -0,0 +1,31 @@
+"""OpenMetrics rendering of the exporter."""
+
+from pyproxmox3.exporter import ProxmoxExporter, render_family
+
+
+def test_special_values_use_openmetrics_spelling():
+    lines = []
+    render_family(lines, 'pve_test', 'gauge', 'Test', [
+        ('{id="a"}', float('nan')), ('{id="b"}', float('inf')), ('{id="c"}', float('-inf')),
+        ('{id="d"}', 0.25), ('{id="e"}', 3)])
+    assert lines[2:] == ['pve_test{id="a"} NaN', 'pve_test{id="b"} +Inf', 'pve_test{id="c"} -Inf',
+                         'pve_test{id="d"} 0.25', 'pve_test{id="e"} 3']
+
+
+def test_counters_get_the_total_suffix():
+    lines = []
+    render_family(lines, 'pve_errors', 'counter', 'Errors', [('', 2)])
+    assert lines == ['# TYPE pve_errors counter', '# HELP pve_errors Errors', 'pve_errors_total 2']
+
+
+def test_scrape_of_the_fake_cluster(cluster, client):
+    exporter = ProxmoxExporter(client)
+    exporter.refresh()
+    body = exporter.scrape().decode()
+    assert body.endswith('# EOF\n')
+    samples = [line for line in body.splitlines() if line and not line.startswith('#')]
+    assert samples
+    for line in samples:
+        value = line.rsplit(' ', 1)[1]
+        assert value in ('NaN', '+Inf', '-Inf') or float(value) == float(value)
+    assert any('node="pve1"' in line for line in samples)
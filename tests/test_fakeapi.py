@@ -0,0 +1,62 @@
+"""The fake API answers like pveproxy."""
+
+import json
+import time
+import requests
+from pyproxmox3.fakeapi import FakeCluster, FakeProxmoxServer
+
+
+def test_empty_task_log_is_the_no_content_line():
+    cluster = FakeCluster(nodes=1, guests_per_node=0, task_duration=0.5, log_delay=0.3)
+    cluster.add_guest(100, 'pve1')
+    with FakeProxmoxServer(cluster) as server:
+        client = server.client()
+        upid = json.loads(client.start_virtual_machine('pve1', 100))['data']
+        log_url = 'nodes/pve1/tasks/{}/log'.format(upid)
+        for start in (0, 5):
+            empty = client.connect('get', log_url, {'start': start})
+            assert empty['data'] == [{'n': 1, 't': 'no content'}]
+            assert empty['total'] == 1
+        time.sleep(0.7)
+        done = client.connect('get', log_url, {'start': 0})
+    assert [line['t'] for line in done['data']] == ['starting task {}'.format(upid), 'TASK OK']
+    assert done['total'] == 2
+
+
+def test_unknown_guest_is_a_500(client):
+    answer = client.connect('get', 'nodes/pve1/qemu/999/status/current', None)
+    assert answer['status']['code'] == 500
+    assert 'does not exist' in answer['status']['reason']
+
+
+def test_task_changes_the_cluster_when_done(cluster, client):
+    guest = next(guest for guest in cluster.guests.values() if guest['status'] == 'running')
+    kind = 'qemu' if guest['type'] == 'qemu' else 'lxc'
+    client.connect('post', 'nodes/{}/{}/{}/status/stop'.format(guest['node'], kind,
+                                                               guest['vmid']), None)
+    assert guest['status'] == 'running'
+    time.sleep(0.3)
+    cluster.settle()
+    assert guest['status'] == 'stopped'
+
+
+def test_writes_need_the_csrf_token(server, client):
+    url = '{}/nodes/pve1/qemu/100/status/start'.format(client.base_url)
+    answer = requests.post(url, cookies=client.ticket, verify=False)
+    assert answer.status_code == 401
+    answer = requests.post(url, cookies=client.ticket, verify=False,
+                           headers={'CSRFPreventionToken': 'forged'})
+    assert answer.status_code == 401
+    # reads only need the ticket
+    assert requests.get('{}/nodes'.format(client.base_url), cookies=client.ticket,
+                        verify=False).status_code == 200
+
+
+def test_running_container_migrates_only_with_restart(cluster, client):
+    cluster.add_guest(900, 'pve1', kind='lxc', status='running')
+    refused = client.connect('post', 'nodes/pve1/lxc/900/migrate', {'target': 'pve2'})
+    assert refused['status']['code'] == 500
+    assert '--restart' in refused['status']['reason']
+    started = client.connect('post', 'nodes/pve1/lxc/900/migrate',
+                             {'target': 'pve2', 'restart': 1})
+    assert started['data'].startswith('UPID:pve1:')
@@ -0,0 +1,70 @@
+"""Federation routing of guest calls."""
+
+import json
+import pytest
+from pyproxmox3 import Federation
+from pyproxmox3.fakeapi import FakeCluster, FakeProxmoxServer
+
+
+@pytest.fixture
+def federation(server):
+    """The conftest cluster as 'paris' next to a second cluster 'lyon'."""
+    with FakeProxmoxServer(FakeCluster(nodes=2, guests_per_node=3, seed=2)) as other:
+        fed = Federation({'paris': server.client(), 'lyon': other.client()})
+        yield fed
+        fed.close()
+
+
+def running_vm(cluster):
+    return next(guest for guest in cluster.guests.values()
+                if guest['type'] == 'qemu' and guest['status'] == 'running'
+                and not guest.get('template'))
+
+
+def count_refreshes(fed, monkeypatch):
+    calls = []
+    refresh = fed.refresh_index
+
+    def counted(clusters=None):
+        calls.append(clusters)
+        return refresh(clusters)
+
+    monkeypatch.setattr(fed, 'refresh_index', counted)
+    return calls
+
+
+def test_moved_guest_is_routed_again(federation, cluster, monkeypatch):
+    guest = running_vm(cluster)
+    entry = federation.locate(guest['vmid'], cluster='paris')
+    with cluster.lock:
+        guest['node'] = next(node for node in cluster.nodes if node != entry['node'])
+    refreshes = count_refreshes(federation, monkeypatch)
+    result = json.loads(federation.call('get_virtual_status', guest['vmid'], cluster='paris'))
+    assert result['status']['code'] == 200
+    assert result['data']['status'] == 'running'
+    assert refreshes == [['paris']]
+    assert federation.locate(guest['vmid'], cluster='paris')['node'] == guest['node']
+    # the index of the other cluster was kept
+    assert any(entry['cluster'] == 'lyon' for entries in federation.by_vmid.values()
+               for entry in entries)
+
+
+def test_moved_guest_task_is_routed_again(federation, cluster):
+    guest = running_vm(cluster)
+    entry = federation.locate(guest['vmid'], cluster='paris')
+    with cluster.lock:
+        guest['node'] = next(node for node in cluster.nodes if node != entry['node'])
+    future = federation.call('stop_virtual_machine', guest['vmid'], cluster='paris',
+                             future=True)
+    assert future.result(timeout=10)['exitstatus'] == 'OK'
+
+
+def test_genuine_error_is_not_retried(federation, cluster, monkeypatch):
+    guest = running_vm(cluster)
+    federation.locate(guest['vmid'], cluster='paris')
+    refreshes = count_refreshes(federation, monkeypatch)
+    result = json.loads(federation.call('delete_virtual_machine', guest['vmid'],
+                                        cluster='paris'))
+    assert result['status']['code'] == 500
+    assert 'running' in result['status']['reason']
+    assert refreshes == []
@@ -0,0 +1,31 @@
+"""Request instrumentation through PyProxmox.connect."""
+
+import pytest
+from pyproxmox3 import Instrumentation, ReplayTransport
+
+
+def test_requests_are_counted_per_endpoint_template(cluster, client):
+    client.instrumentation = Instrumentation()
+    for vmid in sorted(cluster.guests)[:3]:
+        guest = cluster.guests[vmid]
+        client.connect('get', 'nodes/{}/{}/{}/status/current'.format(
+            guest['node'], guest['type'], vmid), None)
+    snapshot = client.instrumentation.snapshot()
+    stats = [stats for name, stats in snapshot.items() if name.endswith('/status/current')]
+    assert sum(stats['count'] for stats in stats) == 3
+    assert all(set(stats['codes']) == {200} for stats in stats)
+
+
+def test_hooks_see_requests_that_raise(tmp_path):
+    path = tmp_path / 'empty.jsonl'
+    path.write_text('{"format": 1}\n')
+    client = ReplayTransport(str(path), strict=True).client()
+    client.instrumentation = Instrumentation()
+    seen = []
+    client.instrumentation.add_hooks(post=seen.append)
+    with pytest.raises(LookupError):
+        client.connect('get', 'nodes', None)
+    assert len(seen) == 1
+    assert seen[0]['status'] is None
+    assert isinstance(seen[0]['error'], LookupError)
+    assert client.instrumentation.snapshot()['GET nodes']['codes'] == {None: 1}
@@ -0,0 +1,70 @@
+"""Load generation harness against the fake API."""
+
+import json
+import pytest
+from pyproxmox3 import loadgen
+from pyproxmox3.loadgen import LoadHarness, find_knee, mix_writes, parse_mix
+
+
+@pytest.fixture
+def target(server):
+    """The fake server as a harness target."""
+    return {'host': server.host, 'port': server.port, 'scheme': server.scheme,
+            'username': 'root@pam', 'password': server.cluster.users['root@pam']}
+
+
+def test_mixes():
+    assert parse_mix('portal') == {'status': 8, 'config': 1, 'resources': 1}
+    assert parse_mix('status=5,config') == {'status': 5.0, 'config': 1.0}
+    with pytest.raises(ValueError):
+        parse_mix('status=1,reboot=1')
+    assert not mix_writes('read')
+    assert mix_writes('mixed')
+    assert not mix_writes({'status': 1, 'power': 0})
+
+
+def step(concurrency, throughput, p99_ms):
+    return {'concurrency': concurrency, 'requests': 100, 'throughput': throughput,
+            'p99_ms': p99_ms}
+
+
+def test_find_knee():
+    steps = [step(1, 100, 10), step(2, 190, 11), step(4, 350, 12), step(8, 370, 25),
+             step(16, 372, 60)]
+    knee = find_knee(steps)
+    assert knee['knee']['concurrency'] == 4
+    assert knee['saturation']['concurrency'] == 4
+    assert find_knee([]) == {'knee': None, 'saturation': None}
+
+
+@pytest.mark.parametrize('mode', ['threads', 'async'])
+def test_steps_report_throughput_and_latency(target, mode):
+    harness = LoadHarness(target, mix='read', mode=mode)
+    steps = harness.ramp([1, 2], duration=0.3)
+    assert [report['concurrency'] for report in steps] == [1, 2]
+    for report in steps:
+        assert report['requests'] > 0 and report['errors'] == 0
+        assert report['throughput'] == pytest.approx(report['requests'] / 0.3, rel=0.01)
+        assert 0 < report['p50_ms'] <= report['p95_ms'] <= report['p99_ms']
+
+
+def test_writes_go_through(target, cluster):
+    report = LoadHarness(target, mix={'power': 1}).step(2, 0.3)
+    assert report['requests'] > 0 and report['error_rate'] < 0.5
+    assert cluster.tasks
+
+
+def test_errors_are_counted(target, server):
+    server.inject(r'/config$', code=500)
+    report = LoadHarness(target, mix={'config': 1, 'status': 1}).step(1, 0.3)
+    assert 0 < report['errors'] < report['requests']
+
+
+def test_command_line_report(tmp_path, capsys):
+    output = tmp_path / 'ramp.json'
+    assert loadgen.main(['--fake', '--nodes', '1', '--guests-per-node', '3', '--levels', '1,2',
+                         '--duration', '0.2', '--output', str(output)]) == 0
+    report = json.loads(output.read_text())
+    assert [step['concurrency'] for step in report['steps']] == [1, 2]
+    assert report['knee'] in (1, 2)
+    assert 'clients' in capsys.readouterr().err
@@ -0,0 +1,53 @@
+"""MigrationScheduler against the fake API."""
+
+from pyproxmox3 import MigrationScheduler
+
+
+def test_moves_guests_and_skips_those_in_place(cluster, client):
+    moves = [(vmid, 'pve3') for vmid in sorted(cluster.guests)] + [(999, 'pve3')]
+    in_place = {vmid for vmid, guest in cluster.guests.items() if guest['node'] == 'pve3'}
+    with MigrationScheduler(client, source_concurrency=1, target_concurrency=2) as scheduler:
+        result = scheduler.migrate(moves)
+        result.wait(timeout=60)
+    assert list(result.failed()) == [999]
+    assert all(guest['node'] == 'pve3' for guest in cluster.guests.values())
+    # one future per vmid, those already on pve3 resolved without a migration
+    assert in_place and set(result.futures) == {vmid for vmid, _ in moves}
+    assert all(result.futures[vmid].result()['upid'] is None for vmid in in_place)
+    assert all(result.progress()[vmid] == 'OK' for vmid in in_place)
+
+
+def test_bwlimit_and_restart_are_sent(cluster, client):
+    cluster.add_guest(900, 'pve1', kind='lxc', status='running')
+    cluster.add_guest(901, 'pve1', kind='qemu', status='running')
+    sent = {}
+    migrate_vm, migrate_ct = client.migrate_virtual_machine, client.migrate_lxc_container
+
+    def spy_vm(node, vmid, post_data, future=False):
+        sent[vmid] = dict(post_data)
+        return migrate_vm(node, vmid, post_data, future=future)
+
+    def spy_ct(node, vmid, target, future=False, post_data=None):
+        sent[vmid] = dict(post_data or {}, target=target)
+        return migrate_ct(node, vmid, target, future=future, post_data=post_data)
+
+    client.migrate_virtual_machine, client.migrate_lxc_container = spy_vm, spy_ct
+    with MigrationScheduler(client, bwlimit=51200) as scheduler:
+        result = scheduler.migrate([(900, 'pve2'), (901, 'pve2')])
+        result.wait(timeout=60)
+    assert result.failed() == {}
+    assert sent == {900: {'bwlimit': 51200, 'restart': 1, 'target': 'pve2'},
+                    901: {'bwlimit': 51200, 'online': 1, 'target': 'pve2'}}
+
+
+def test_order_keeps_the_most_free_target_busy(client):
+    gib = 1024 ** 3
+    guests = {100: {'node': 'pve1', 'maxmem': 8 * gib}, 101: {'node': 'pve1', 'maxmem': 2 * gib},
+              102: {'node': 'pve1', 'maxmem': 4 * gib}, 103: {'node': 'pve2', 'maxmem': 6 * gib}}
+    free = {'pve1': 10 * gib, 'pve2': 13 * gib, 'pve3': 20 * gib}
+    moves = [(100, 'pve3'), (101, 'pve3'), (102, 'pve2'), (103, 'pve3')]
+    with MigrationScheduler(client) as scheduler:
+        ordered = scheduler.order(moves, guests, free)
+    # pve3 (20 GiB free) takes its biggest guest first, leaving 12: pve2 (13) is next
+    assert ordered == [(100, 'pve3'), (102, 'pve2'), (103, 'pve3'), (101, 'pve3')]
+    assert free == {'pve1': 24 * gib, 'pve2': 15 * gib, 'pve3': 4 * gib}
@@ -0,0 +1,50 @@
+"""Planner placement and rebalancing."""
+
+from pyproxmox3 import Planner
+from pyproxmox3.planner import NodeCapacity
+
+GIB = 1024 ** 3
+
+
+def planner_with(guests, nodes=('pve1', 'pve2')):
+    """A Planner on hand-made capacities: guests is a list of (vmid, node, status, GiB)."""
+    planner = Planner(None, headroom=0.1)
+    planner.nodes = {name: NodeCapacity(name, 32, 0.0, 100 * GIB, 0, 0, 0) for name in nodes}
+    for vmid, node, status, memory in guests:
+        planner.guests[vmid] = {'vmid': vmid, 'node': node, 'type': 'qemu', 'status': status,
+                                'cpu': 0.0, 'maxcpu': 2, 'maxmem': memory * GIB}
+        planner.nodes[node].guests.append(vmid)
+        if status == 'running':
+            planner.nodes[node].mem += memory * GIB
+    return planner
+
+
+def test_rebalance_ignores_stopped_guests():
+    planner = planner_with([(100, 'pve1', 'running', 30), (101, 'pve1', 'running', 30),
+                            (102, 'pve1', 'stopped', 40)])
+    moves = planner.rebalance()
+    assert moves == [(101, 'pve1', 'pve2')]
+    assert planner.nodes['pve1'].mem == planner.nodes['pve2'].mem == 30 * GIB
+
+
+def test_rebalance_does_nothing_when_only_stopped_guests_could_move():
+    planner = planner_with([(100, 'pve1', 'running', 80), (101, 'pve1', 'stopped', 10)])
+    assert planner.rebalance() == []
+
+
+def test_place_best_fit_on_memory():
+    planner = planner_with([(100, 'pve1', 'running', 50)])
+    placement = planner.place([{'name': 'small', 'memory': 35 * 1024},
+                               {'name': 'big', 'memory': 60 * 1024},
+                               {'name': 'huge', 'memory': 200 * 1024}])
+    assert [node for _, node in placement] == ['pve1', 'pve2', None]
+
+
+def test_refresh_reads_the_cluster(cluster, client):
+    planner = Planner(client)
+    planner.refresh()
+    assert set(planner.nodes) == set(cluster.nodes)
+    assert set(planner.guests) == set(cluster.guests)
+    for vmid, _, target in planner.rebalance(threshold=0.0):
+        assert cluster.guests[vmid]['status'] == 'running'
+        assert target != cluster.guests[vmid]['node']
@@ -0,0 +1,78 @@
+"""PriorityScheduler stride scheduling."""
+
+import time
+import threading
+import pytest
+from pyproxmox3.priority import PriorityScheduler, priority, current_priority
+
+
+def contend(scheduler, classes):
+    """
+    Queue one request per entry of classes behind a held slot, then let
+    them through one at a time. Returns the classes in the order granted.
+    """
+    order = []
+    scheduler.acquire('get', 'nodes')
+
+    def request(name):
+        with priority(name):
+            granted, _ = scheduler.acquire('get', 'nodes')
+        order.append(granted)
+        scheduler.release()
+
+    threads = [threading.Thread(target=request, args=(name,)) for name in classes]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while sum(scheduler.waiting().values()) < len(classes):
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_busy_classes_share_by_weight():
+    scheduler = PriorityScheduler(concurrency=1, weights={'interactive': 3, 'background': 1})
+    order = contend(scheduler, ['interactive'] * 12 + ['background'] * 12)
+    assert len(order) == 24
+    # while both wait, 3 interactive for 1 background, background never starved
+    assert order[:16].count('interactive') == 12
+    assert order[:16].count('background') == 4
+    assert 'background' in order[:4]
+    stats = scheduler.stats()
+    assert stats['interactive']['granted'] == 13 and stats['background']['granted'] == 12
+    assert stats['background']['queued'] == 12
+    assert scheduler.inflight == 0
+
+
+def test_idle_class_saves_no_credit():
+    scheduler = PriorityScheduler(concurrency=1, weights={'interactive': 3, 'background': 1})
+    for _ in range(30):
+        with scheduler.slot('get', 'nodes'):
+            pass
+    # background asked nothing for 30 grants: it does not get them back in a burst
+    order = contend(scheduler, ['interactive'] * 6 + ['background'] * 6)
+    assert order[:8].count('background') <= 3
+
+
+def test_classes():
+    scheduler = PriorityScheduler(classify=lambda method, path: 'background'
+                                  if path.endswith('rrddata') else None)
+    assert scheduler.request_class('get', 'nodes') == 'interactive'
+    assert scheduler.request_class('get', 'nodes/pve1/rrddata') == 'background'
+    with priority('interactive'):
+        assert current_priority() == 'interactive'
+        assert scheduler.request_class('get', 'nodes/pve1/rrddata') == 'interactive'
+        with priority('bulk'):
+            with pytest.raises(ValueError):
+                scheduler.request_class('get', 'nodes')
+    assert current_priority() is None
+
+
+def test_bad_weights():
+    with pytest.raises(ValueError):
+        PriorityScheduler(weights={'interactive': 0})
+    with pytest.raises(ValueError):
+        PriorityScheduler(weights={'background': 1})
@@ -0,0 +1,107 @@
+"""Token buckets and RateLimiter in the request path."""
+
+import time
+import asyncio
+import pytest
+from pyproxmox3 import Instrumentation, RateLimiter, RateLimitExceeded
+from pyproxmox3.ratelimit import TokenBucket, endpoint_class, request_node
+
+
+def test_bucket_refills_up_to_its_burst():
+    bucket = TokenBucket(10, 3)
+    assert bucket.tokens == 3
+    bucket.tokens = 0
+    bucket.refill(bucket.updated + 0.1)
+    assert bucket.tokens == pytest.approx(1)
+    assert bucket.delay(2) == pytest.approx(0.1)
+    bucket.refill(bucket.updated + 60)
+    assert bucket.tokens == 3
+    assert bucket.delay(2) == 0
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_classes_and_nodes():
+    assert endpoint_class('GET', 'nodes/pve1/qemu/100/config') == 'read'
+    assert endpoint_class('post', 'nodes/pve1/qemu/100/status/start') == 'write'
+    assert endpoint_class('post', 'nodes/pve1/qemu/100/clone') == 'heavy'
+    assert endpoint_class('delete', 'nodes/pve1/lxc/101') == 'heavy'
+    assert request_node('nodes/pve1/qemu') == 'pve1'
+    assert request_node('cluster/resources') is None
+    limiter = RateLimiter(cluster=(100, 100), node=(10, 10), classes={'heavy': (1, 1)})
+    assert limiter.keys('get', 'nodes/pve1/status') == ['cluster', 'node/pve1']
+    assert limiter.keys('post', 'nodes/pve2/qemu/100/clone') == ['cluster', 'node/pve2',
+                                                                  'class/heavy']
+
+
+def test_burst_then_paced():
+    limiter = RateLimiter(cluster=(50, 5))
+    start = time.monotonic()
+    waits = [limiter.acquire('get', 'nodes') for _ in range(10)]
+    elapsed = time.monotonic() - start
+    assert waits[:5] == [0.0] * 5
+    assert all(wait > 0 for wait in waits[5:])
+    # the 5 requests over the burst are paced at 50 per second
+    assert elapsed == pytest.approx(0.1, abs=0.05)
+    assert limiter.waits == 5
+    assert limiter.stats()['cluster']['waits'] == 5
+
+
+def test_non_blocking_raises_without_taking_tokens():
+    limiter = RateLimiter(node=(2, 1), blocking=False)
+    assert limiter.acquire('get', 'nodes/pve1/status') == 0.0
+    with pytest.raises(RateLimitExceeded) as raised:
+        limiter.acquire('get', 'nodes/pve1/status')
+    assert raised.value.wait == pytest.approx(0.5, abs=0.05)
+    assert isinstance(raised.value, RuntimeError)
+    # another node has its own bucket
+    assert limiter.acquire('get', 'nodes/pve2/status') == 0.0
+    time.sleep(raised.value.wait)
+    assert limiter.acquire('get', 'nodes/pve1/status') == pytest.approx(0, abs=0.01)
+    assert limiter.rejected == 1
+    assert limiter.stats()['node/pve1']['rejected'] == 1
+
+
+def test_timeout_raises_when_the_wait_is_longer():
+    limiter = RateLimiter(cluster=(1, 1), timeout=0.2)
+    limiter.acquire('get', 'nodes')
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire('get', 'nodes')
+    # a longer timeout for this call waits instead
+    assert limiter.acquire('get', 'nodes', timeout=2) > 0.5
+
+
+def test_acquire_async():
+    limiter = RateLimiter(cluster=(20, 1))
+
+    async def run():
+        return await asyncio.gather(*(limiter.acquire_async('get', 'nodes') for _ in range(4)))
+
+    start = time.monotonic()
+    waits = asyncio.run(run())
+    # the waits run side by side: the last one sets the elapsed time
+    assert sorted(waits) == pytest.approx([0.0, 0.05, 0.1, 0.15], abs=0.01)
+    assert time.monotonic() - start == pytest.approx(0.15, abs=0.05)
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(limiter.acquire_async('get', 'nodes', blocking=False))
+
+
+def test_connect_reports_the_rate_wait(client):
+    client.rate_limiter = RateLimiter(classes={'read': (20, 1)})
+    client.instrumentation = Instrumentation()
+    seen = []
+    client.instrumentation.add_hooks(pre=lambda info: seen.append(info['rate_wait']))
+    client.connect('get', 'nodes', None)
+    client.connect('get', 'nodes', None)
+    # writes are not in the 'read' bucket
+    client.connect('post', 'nodes/pve1/qemu/100/status/start', None)
+    assert seen[0] == 0.0
+    assert seen[1] == pytest.approx(0.05, abs=0.02)
+    assert seen[2] == 0.0
+
+
+def test_connect_raises_when_refused(client):
+    client.rate_limiter = RateLimiter(cluster=(1, 1), blocking=False)
+    assert client.connect('get', 'nodes', None)['status']['code'] == 200
+    with pytest.raises(RateLimitExceeded):
+        client.connect('get', 'nodes', None)
@@ -0,0 +1,58 @@
+"""Record a workflow on the fake API and replay it offline."""
+
+import gzip
+import json
+import time
+import pytest
+from pyproxmox3 import RecordingTransport, ReplayTransport
+
+
+def workflow(client):
+    nodes = client.connect('get', 'nodes', None)['data']
+    return sorted(node['node'] for node in nodes)
+
+
+def records(path):
+    with gzip.open(path, 'rt') as recorded:
+        return [json.loads(line) for line in recorded.read().splitlines()[1:]]
+
+
+@pytest.fixture
+def recording(tmp_path, client):
+    path = str(tmp_path / 'traffic.jsonl.gz')
+    client.transport = RecordingTransport(path)
+    nodes = workflow(client)
+    # the think time of the client, replayed too
+    time.sleep(0.2)
+    client.connect('put', 'nodes/pve1/qemu/100/config', {'cipassword': 'hunter2'})
+    client.transport.close()
+    return path, nodes
+
+
+def test_replay_answers_offline(recording):
+    path, nodes = recording
+    replay = ReplayTransport(path)
+    assert workflow(replay.client()) == nodes
+    assert replay.missed == 0
+
+
+def test_secrets_are_redacted(recording):
+    with gzip.open(recording[0], 'rt') as recorded:
+        assert 'hunter2' not in recorded.read()
+
+
+def test_strict_replay_refuses_unrecorded_requests(recording):
+    replay = ReplayTransport(recording[0], strict=True)
+    with pytest.raises(LookupError):
+        replay.client().connect('get', 'cluster/status', None)
+
+
+def test_replay_is_paced_from_its_start(recording):
+    recorded = records(recording[0])
+    span = recorded[-1]['t'] + recorded[-1]['d'] - recorded[0]['t']
+    replay = ReplayTransport(recording[0], speed=2.0)
+    start = time.monotonic()
+    for record in recorded:
+        replay.request(record['m'], 'https://replay/api2/json/' + record['p'])
+    # answered at the recorded times, twice as fast, however fast they are asked
+    assert time.monotonic() - start >= span / 2.0 * 0.95 > 0.09
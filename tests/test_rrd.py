@@ -0,0 +1,69 @@
+"""RRDSeries aggregations, with and without NumPy."""
+
+import math
+import pytest
+from pyproxmox3 import rrd
+
+SAMPLES = [{'time': 0, 'cpu': 1.0, 'mem': 10.0}, {'time': 60, 'cpu': 3.0},
+           {'time': 120}, {'time': 180, 'cpu': 2.0, 'mem': 30.0}]
+
+
+@pytest.fixture(params=['numpy', 'pure'])
+def backend(request, monkeypatch):
+    """Run a test with NumPy (when installed) and with the pure python columns."""
+    if request.param == 'pure':
+        monkeypatch.setattr(rrd, 'numpy', None)
+    elif rrd.numpy is None:
+        pytest.skip('NumPy not installed')
+    return request.param
+
+
+def values(column):
+    return [None if math.isnan(value) else float(value) for value in column]
+
+
+def test_aggregations_ignore_missing_values(backend):
+    series = rrd.RRDSeries.from_rrd_data(SAMPLES)
+    assert series.mean('cpu') == 2.0
+    assert series.max('cpu') == 3.0
+    assert series.sum('mem') == 40.0
+    assert series.percentile('cpu', 50) == 2.0
+
+
+def test_resample_gives_nan_to_empty_buckets(backend):
+    series = rrd.RRDSeries.from_rrd_data(SAMPLES)
+    for how in ('sum', 'mean', 'max', 'min'):
+        resampled = series.resample(60, how)
+        assert values(resampled.columns['mem']) == [10.0, None, None, 30.0]
+    assert values(series.resample(120, 'sum').columns['cpu']) == [4.0, 2.0]
+
+
+def test_rollup_by_timestamp(backend):
+    first = rrd.RRDSeries.from_rrd_data(SAMPLES)
+    second = rrd.RRDSeries.from_rrd_data([{'time': 60, 'cpu': 1.0}, {'time': 240, 'cpu': 5.0}])
+    total = rrd.rollup([first, second], 'cpu', 'sum')
+    assert values(total.time) == [0.0, 60.0, 120.0, 180.0, 240.0]
+    assert values(total.columns['cpu']) == [1.0, 4.0, None, 2.0, 5.0]
+
+
+def test_unknown_aggregation_is_refused_up_front(backend):
+    series = rrd.RRDSeries.from_rrd_data(SAMPLES)
+    with pytest.raises(ValueError):
+        series.resample(60, 'median')
+    with pytest.raises(ValueError):
+        rrd.rollup([series], 'cpu', 'median')
+    with pytest.raises(ValueError):
+        rrd.rollup([], 'cpu', 'median')
+
+
+def test_samples_without_time(backend):
+    series = rrd.RRDSeries.from_rrd_data(SAMPLES + [{'cpu': 9.0}])
+    assert series.to_records()[-1] == {'cpu': 9.0}
+    assert series.to_records()[0] == {'time': 0, 'cpu': 1.0, 'mem': 10.0}
+    # they have no bucket: no NaN time comes out of resample or rollup
+    hourly = series.resample(120)
+    assert values(hourly.time) == [0.0, 120.0]
+    assert values(hourly.column('cpu')) == [2.0, 2.0]
+    combined = rrd.rollup([series, series], 'cpu', how='max')
+    assert values(combined.time) == [0.0, 60.0, 120.0, 180.0]
+    assert [record['time'] for record in hourly.to_records()] == [0, 120]
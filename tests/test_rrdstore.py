@@ -0,0 +1,96 @@
+"""RingSeries and RRDStore files."""
+
+import os
+import threading
+from pyproxmox3.rrd import RRDSeries
+from pyproxmox3.rrdstore import RingSeries, RRDStore
+
+
+def samples(*times):
+    return RRDSeries.from_rrd_data([{'time': time, 'cpu': time / 1000.0} for time in times])
+
+
+def times(series):
+    return [int(time) for time in series.time]
+
+
+def test_wraps_around_keeping_the_newest(tmp_path):
+    ring = RingSeries(str(tmp_path / 'cpu.rrd'), ['cpu'], capacity=5)
+    assert ring.append(samples(60, 120, 180)) == 3
+    assert ring.append(samples(*range(240, 540, 60))) == 5
+    assert len(ring) == 5
+    assert times(ring.read()) == [240, 300, 360, 420, 480]
+    assert times(ring.read(since=300, until=420)) == [300, 360, 420]
+    assert ring.last_time() == 480
+
+
+def test_wrapped_file_reopens(tmp_path):
+    path = str(tmp_path / 'cpu.rrd')
+    ring = RingSeries(path, ['cpu'], capacity=4)
+    ring.append(samples(*range(60, 420, 60)))
+    ring.close()
+    ring = RingSeries(path)
+    assert ring.capacity == 4 and ring.columns == ['cpu']
+    assert times(ring.read()) == [180, 240, 300, 360]
+
+
+def test_only_newer_samples_are_appended(tmp_path):
+    ring = RingSeries(str(tmp_path / 'cpu.rrd'), ['cpu'], capacity=10)
+    ring.append(samples(60, 120, 180))
+    assert ring.append(samples(60, 120)) == 0
+    assert times(ring.read()) == [60, 120, 180]
+
+
+def test_partial_last_sample_is_replaced(tmp_path):
+    ring = RingSeries(str(tmp_path / 'cpu.rrd'), ['cpu'], capacity=10)
+    ring.append(RRDSeries.from_rrd_data([{'time': 60, 'cpu': 0.5}, {'time': 120, 'cpu': 0.1}]))
+    ring.append(RRDSeries.from_rrd_data([{'time': 120, 'cpu': 0.4}, {'time': 180, 'cpu': 0.3}]))
+    series = ring.read()
+    assert times(series) == [60, 120, 180]
+    assert list(series.columns['cpu']) == [0.5, 0.4, 0.3]
+
+
+def test_samples_without_values_are_skipped(tmp_path):
+    ring = RingSeries(str(tmp_path / 'cpu.rrd'), ['cpu'], capacity=10)
+    assert ring.append(RRDSeries.from_rrd_data([{'time': 60, 'cpu': 0.5}, {'time': 120}])) == 1
+    assert ring.last_time() == 60
+
+
+def test_concurrent_appends_write_each_sample_once(tmp_path):
+    ring = RingSeries(str(tmp_path / 'cpu.rrd'), ['cpu'], capacity=1000)
+    series = samples(*range(60, 30060, 60))
+    threads = [threading.Thread(target=ring.append, args=(series,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert times(ring.read()) == list(range(60, 30060, 60))
+
+
+def test_store_keys_and_query(tmp_path):
+    store = RRDStore(str(tmp_path), capacity=10)
+    store.append('qemu/101', samples(60, 120))
+    store.append('node/pve1', samples(60))
+    assert store.keys() == ['node/pve1', 'qemu/101']
+    assert times(store.query('qemu/101', since=100)) == [120]
+    store.close()
+
+
+def test_keys_round_trip(tmp_path):
+    store = RRDStore(str(tmp_path), capacity=10)
+    keys = ['storage/pve1/local__lvm', 'storage/pve1/local/lvm', 'qemu/101', 'node/a%2Fb']
+    for key in keys:
+        store.append(key, samples(60))
+    store.close()
+    assert RRDStore(str(tmp_path)).keys() == sorted(keys)
+    assert len(os.listdir(str(tmp_path))) == 4
+
+
+def test_columns_are_fixed_at_creation(tmp_path):
+    ring = RingSeries(str(tmp_path / 'node.rrd'), ['cpu'], capacity=10)
+    # a column the file was not created with is not stored, the others are
+    assert ring.append(RRDSeries.from_rrd_data([{'time': 60, 'cpu': 0.5, 'pressure': 1.0},
+                                                {'time': 120, 'pressure': 2.0}])) == 1
+    assert ring.read().names() == ['cpu']
+    assert ring.append(RRDSeries.from_rrd_data([{'cpu': 0.7}])) == 0
+    assert times(ring.read()) == [60]
@@ -0,0 +1,73 @@
+"""SweepExecutor against the fake API."""
+
+import json
+import time
+import pytest
+from pyproxmox3.sweep import SweepExecutor
+from pyproxmox3.fakeapi import FakeCluster, FakeProxmoxServer
+
+
+def memory(item, data):
+    """A transform: only the memory of the configs comes back."""
+    return data.get('memory') if item == 'config' and data else None
+
+
+@pytest.fixture
+def clusters():
+    """Two clusters on fake servers."""
+    with FakeProxmoxServer(FakeCluster(nodes=2, guests_per_node=3, seed=1)) as paris, \
+            FakeProxmoxServer(FakeCluster(nodes=1, guests_per_node=2, seed=2)) as lyon:
+        yield {'paris': paris, 'lyon': lyon}
+
+
+def guest_count(server):
+    return sum(1 for guest in server.cluster.guests.values() if not guest['template'])
+
+
+def test_units_interleave_the_nodes(clusters):
+    sweep = SweepExecutor({name: server.client() for name, server in clusters.items()},
+                          chunk=2)
+    units = sweep.units()
+    assert sum(len(guests) for _, _, guests in units) == sum(map(guest_count,
+                                                                 clusters.values()))
+    assert all(len(guests) <= 2 for _, _, guests in units)
+    # the first units come from different nodes
+    assert len({(cluster, node) for cluster, node, _ in units[:3]}) == 3
+
+
+def test_items_are_decoded_in_the_workers(clusters):
+    sweep = SweepExecutor({name: server.client() for name, server in clusters.items()},
+                          processes=2, threads=2, items=('config', 'agent/get-osinfo'))
+    results = list(sweep.run())
+    assert len(results) == sum(map(guest_count, clusters.values()))
+    for result in results:
+        guest = clusters[result.cluster].cluster.guests[result.vmid]
+        status, config = result.items['config']
+        assert status == 200 and config['memory'] == guest['config']['memory']
+        status, osinfo = result.items['agent/get-osinfo']
+        if guest['type'] == 'lxc':
+            assert (status, osinfo) == (None, None)
+        elif status == 200:
+            assert osinfo['result']['id'] == 'debian'
+
+
+def test_transform_and_raw(clusters):
+    sweep = SweepExecutor({'paris': clusters['paris'].client()}, processes=1,
+                          items=('config',))
+    units = sweep.units()[:1]
+    transformed = list(sweep.run(transform=memory, units=units))
+    assert all(result.items['config'] == (200, 2048) for result in transformed)
+    raw = list(sweep.run(units=units, raw=True))
+    assert all(isinstance(result.items['config'][1], bytes) for result in raw)
+    assert json.loads(raw[0].items['config'][1])['data']['memory'] == 2048
+
+
+def test_a_hung_request_times_out(clusters):
+    server = clusters['lyon']
+    server.inject(r'/config$', delay=5.0)
+    sweep = SweepExecutor({'lyon': server.client()}, processes=1, threads=1,
+                          items=('config',), timeout=0.5)
+    start = time.monotonic()
+    results = list(sweep.run())
+    assert time.monotonic() - start < 4
+    assert all(result.items['config'] == (None, None) for result in results)
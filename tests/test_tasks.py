@@ -0,0 +1,94 @@
+"""TaskFuture, TaskTracker and follow_task_log against the fake API."""
+
+import json
+import pytest
+from pyproxmox3 import RateLimiter, TaskTracker
+from pyproxmox3.fakeapi import FakeCluster, FakeProxmoxServer
+from pyproxmox3.tasks import TaskFuture, follow_task_log
+
+
+def unknown_upid(node):
+    return 'UPID:{}:00001234:00005678:5F000000:qmstart:100:root@pam:'.format(node)
+
+
+def stopped_vm(cluster):
+    return next(guest for guest in cluster.guests.values()
+                if guest['type'] == 'qemu' and guest['status'] == 'stopped'
+                and not guest['template'])
+
+
+def test_future_resolves_with_task_status(cluster, client):
+    guest = stopped_vm(cluster)
+    task = client.start_virtual_machine(guest['node'], guest['vmid'], future=True)
+    status = task.wait(timeout=10)
+    assert status['exitstatus'] == 'OK'
+    assert task.ok()
+    assert cluster.guests[guest['vmid']]['status'] == 'running'
+
+
+def test_future_fails_when_status_stays_unreadable(cluster, client):
+    task = TaskFuture(client, unknown_upid(next(iter(cluster.nodes))), max_failures=3)
+    with pytest.raises(AssertionError, match='unreadable 3 times'):
+        task.result(timeout=10)
+
+
+def test_tracker_resolves_many_tasks(cluster, client):
+    tracker = TaskTracker(client, interval=0.05, max_interval=0.2)
+    guests = [guest for guest in cluster.guests.values()
+              if guest['status'] == 'stopped' and not guest['template']]
+    tasks = [client.start_lxc_container(guest['node'], guest['vmid'], future=tracker)
+             if guest['type'] == 'lxc' else
+             client.start_virtual_machine(guest['node'], guest['vmid'], future=tracker)
+             for guest in guests]
+    done, not_done = tracker.wait_all(timeout=10)
+    assert not not_done and len(done) == len(guests)
+    assert all(task.ok() for task in tasks)
+    assert tracker.pending() == 0
+
+
+def test_polling_waits_for_the_rate_limiter(cluster, client):
+    # few reads allowed, refused without waiting: most polls are rejected
+    client.rate_limiter = RateLimiter(classes={'read': (4, 1)}, blocking=False)
+    guest = stopped_vm(cluster)
+    task = TaskFuture(client, json.loads(client.start_virtual_machine(
+        guest['node'], guest['vmid']))['data'], max_failures=1)
+    tracker = TaskTracker(client, interval=0.01, max_interval=0.02)
+    tracked = tracker.track(task.upid)
+    assert task.wait(timeout=10)['exitstatus'] == 'OK'
+    assert tracked.wait(timeout=10)['exitstatus'] == 'OK'
+    assert client.rate_limiter.rejected > 0
+
+
+def test_tracker_gives_up_on_unreadable_task(cluster, client):
+    tracker = TaskTracker(client, interval=0.01, max_interval=0.02)
+    task = tracker.track(unknown_upid(next(iter(cluster.nodes))))
+    with pytest.raises(AssertionError, match='unreadable'):
+        task.result(timeout=10)
+    assert tracker.pending() == 0
+
+
+@pytest.fixture
+def slow_log_cluster():
+    """Tasks whose log stays empty (the 'no content' filler) for a while."""
+    cluster = FakeCluster(nodes=1, guests_per_node=0, task_duration=0.5, log_delay=0.3)
+    cluster.add_guest(100, 'pve1')
+    return cluster
+
+
+def test_follow_task_log_skips_the_empty_log_filler(slow_log_cluster):
+    with FakeProxmoxServer(slow_log_cluster) as server:
+        client = server.client()
+        guest = stopped_vm(slow_log_cluster)
+        upid = json.loads(client.start_virtual_machine(guest['node'], guest['vmid']))['data']
+        lines = list(follow_task_log(client, upid, interval=0.05, max_interval=0.1))
+    assert lines == ['starting task {}'.format(upid), 'TASK OK']
+
+
+def test_follow_task_log_reads_long_logs_in_pages(cluster, client):
+    guest = stopped_vm(cluster)
+    upid = json.loads(client.start_virtual_machine(guest['node'], guest['vmid']))['data']
+    written = ['line {}'.format(number) for number in range(1, 41)]
+    with cluster.lock:
+        cluster.tasks[upid].log.extend(written)
+    lines = list(follow_task_log(client, upid, limit=7, interval=0.05, max_interval=0.1))
+    assert lines == ['starting task {}'.format(upid)] + written + ['TASK OK']
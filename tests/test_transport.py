@@ -0,0 +1,37 @@
+"""TimingTransport phases, against the fake API."""
+
+import socket
+from pyproxmox3 import transport
+from pyproxmox3.transport import PHASES, TimingTransport
+
+
+def test_phases_of_new_and_reused_connections(server):
+    timing_transport = TimingTransport()
+    url = server.url + '/version'
+    first = timing_transport.request('get', url).timing
+    second = timing_transport.request('get', url).timing
+    timing_transport.close()
+    assert set(PHASES) <= set(first)
+    assert first['connect'] > 0 and second['connect'] == 0
+    for timing in (first, second):
+        assert timing['send'] > 0 and timing['ttfb'] > 0
+        assert all(timing[phase] >= 0 for phase in PHASES)
+        assert sum(timing[phase] for phase in PHASES) <= timing['total'] + 1e-6
+
+
+def test_each_resolved_address_is_tried(server, monkeypatch):
+    resolve = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host == 'proxmox.test':
+            # nothing listens on 127.0.0.2, the second address answers
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.2', port)),
+                    (socket.AF_INET, socket.SOCK_STREAM, 6, '', (server.host, port))]
+        return resolve(host, port, *args, **kwargs)
+
+    monkeypatch.setattr(transport.socket, 'getaddrinfo', getaddrinfo)
+    timing_transport = TimingTransport()
+    response = timing_transport.request(
+        'get', '{}://proxmox.test:{}/api2/json/version'.format(server.scheme, server.port))
+    timing_transport.close()
+    assert response.status_code in (200, 401)
@@ -0,0 +1,49 @@
+"""UPID parsing and the task methods routed by UPID."""
+
+import json
+import pytest
+from pyproxmox3 import UPID, parse_upid, parse_upids
+from pyproxmox3.upid import upids_by_node
+
+RAW = 'UPID:vnode01:0000A1B2:0123ABCD:60A1B2C3:qmstart:101:root@pam:'
+
+
+def test_fields():
+    upid = parse_upid(RAW)
+    assert (upid.node, upid.type, upid.id, upid.user) == ('vnode01', 'qmstart', '101',
+                                                          'root@pam')
+    assert (upid.pid, upid.pstart, upid.starttime) == (0xA1B2, 0x0123ABCD, 0x60A1B2C3)
+    assert parse_upid(upid) is upid
+
+
+def test_compares_like_its_string():
+    upid = parse_upid(RAW)
+    assert upid == RAW and str(upid) == RAW
+    assert {RAW: 1}[upid] == 1
+    assert upid in {RAW}
+    assert isinstance(parse_upids([RAW])[0], UPID)
+
+
+@pytest.mark.parametrize('raw', ['UPID:vnode01:0000A1B2', 'TASK:a:1:2:3:qmstart:101:root@pam:',
+                                 'UPID:vnode01:zz:0123ABCD:60A1B2C3:qmstart:101:root@pam:'])
+def test_malformed(raw):
+    with pytest.raises(ValueError):
+        parse_upid(raw)
+
+
+def test_by_node():
+    other = RAW.replace('vnode01', 'vnode02')
+    assert upids_by_node([RAW, other, RAW]) == {'vnode01': [RAW, RAW], 'vnode02': [other]}
+
+
+def test_task_methods_take_the_upid_alone(cluster, client):
+    guest = next(guest for guest in cluster.guests.values() if guest['status'] == 'stopped'
+                 and guest['type'] == 'qemu' and not guest['template'])
+    upid = json.loads(client.start_virtual_machine(guest['node'], guest['vmid']))['data']
+    client.task_future({'data': upid}).wait(timeout=10)
+    status = json.loads(client.get_node_task_status_by_upid(upid))
+    assert status['data']['node'] == guest['node']
+    assert status['data']['exitstatus'] == 'OK'
+    assert json.loads(client.get_node_task_by_upid(parse_upid(upid)))['data']['upid'] == upid
+    log = json.loads(client.get_node_task_log_by_upid(guest['node'], upid))
+    assert log['data'][-1]['t'] == 'TASK OK'
@@ -0,0 +1,65 @@
+"""VmidAllocator bitmap, against the fake API."""
+
+import threading
+import pytest
+from pyproxmox3 import VmidAllocator
+
+
+def test_allocates_the_free_ids_in_order(cluster, client):
+    used = set(cluster.guests)
+    allocator = VmidAllocator(client, high=199)
+    vmids = allocator.allocate_many(10)
+    assert vmids == sorted(vmids)
+    assert not used & set(vmids)
+    assert vmids[0] == min(set(range(100, 200)) - used)
+
+
+def test_skips_full_bytes_of_the_bitmap(cluster, client):
+    for vmid in range(200, 217):
+        cluster.add_guest(vmid, 'pve1')
+    allocator = VmidAllocator(client, ranges={'tenant': (200, 299)})
+    assert allocator.allocate('tenant') == 217
+
+
+def test_concurrent_allocations_never_collide(client):
+    allocator = VmidAllocator(client, low=1000, high=1999)
+    found = []
+    lock = threading.Lock()
+
+    def worker():
+        vmids = allocator.allocate_many(50)
+        with lock:
+            found.extend(vmids)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(found) == len(set(found)) == 400
+
+
+def test_release_hands_the_id_out_again(client):
+    allocator = VmidAllocator(client, low=1000, high=1999)
+    first, second = allocator.allocate_many(2)
+    allocator.release(first)
+    assert allocator.allocate() == first
+    allocator.confirm(second)
+    allocator.release(second)
+    assert allocator.allocate() == second + 1
+
+
+def test_full_range_raises(client):
+    allocator = VmidAllocator(client, ranges={'small': (1000, 1002)})
+    allocator.allocate_many(3, 'small')
+    with pytest.raises(LookupError):
+        allocator.allocate('small')
+
+
+def test_collision_resyncs_from_the_cluster(cluster, client):
+    allocator = VmidAllocator(client, low=1000, high=1999)
+    vmid = allocator.allocate()
+    cluster.add_guest(vmid + 1, 'pve1')
+    allocator.report_collision(vmid)
+    # the lease is gone but the id is free, the one created meanwhile is not
+    assert allocator.allocate_many(2) == [vmid, vmid + 2]